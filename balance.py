@@ -2,23 +2,12 @@
 # Licensed under GPLv3
 import datetime
 import argparse
-import calendar
 import os.path
 import decimal
-import string
-import json
 import sys
-import csv
 import os
 import re
 
-try:
-    # python 2
-    from StringIO import StringIO
-except ImportError:
-    # python 3
-    from io import StringIO
-
 # Ensure that we look for any modules in our local lib dir.  This allows simple
 # testing and development use.  It also does not break the case where the lib
 # has been installed properly on the normal sys.path
@@ -28,16 +17,19 @@ sys.path.insert(0,
 # I would use site.addsitedir, but it does an append, not insert
 
 # Stupid pyflake, neither of these imports can be before the sys.path
-from row import Row # noqa
+from row import Row, set_now, get_now, month_ordinal, month_date # noqa
 from rowset import RowSet # noqa
+from ledger import Ledger, ledger_files # noqa
+import instrument # noqa
+import money # noqa
+
+# Anything else is imported by the subcommands (and options) that use it,
+# so that the simple subcommands start quickly, see TestStartup
 
-# TODO
-# - Implement a running balance check - perhaps using pragma lines in
-#   the input - then we can add a check that the calculated balance matches
-#   the known counted balance at that point in time (quick, accounting people,
-#   tell me the name for this concept!).  Complicating this is the fact that
-#   the running balance is split accross two files - so, this might need
-#   consolidate the incoming and outgoing files.
+# A counted balance can be recorded in any of the accounting files with a
+# pragma line, eg: "#!balance 2017-09-05 576" - the sum of all of the rows
+# dated on or before that day.  These are checked whenever all of the rows
+# are loaded, see checkpoint.py
 
 
 FILES_DIR = 'cash'
@@ -46,31 +38,220 @@ FILES_DIR = 'cash'
 decimal.getcontext().rounding = decimal.ROUND_DOWN
 
 
-def parse_dir(dirname):   # pragma: no cover
-    '''Take all files in dirname and return Row instances'''
+def parse_file(pathname, pragmas=None):
+    """Take one accounting file and return a list of its Row instances,
+       appending any "#!balance" pragma lines to the pragmas list if given
+    """
+    direction, _ = os.path.basename(pathname).split('-', 1)
+
+    rows = []
+    with open(pathname, 'r') as tsvfile:
+        for row in tsvfile.readlines():
+            row = row.rstrip('\n')
+            if not row:
+                continue
+            if re.match(r'^#', row):
+                # skip comment lines
+                # - but keep the "#!balance" pragmas, for checkpoint.py
+                if pragmas is not None and row.startswith('#!balance'):
+                    pragmas.append(row)
+                continue
+            row = Row(*re.split(r'\s+', row,
+                                # Number of splits (3 fields)
+                                maxsplit=2),
+                      direction=direction)
+            # The hashtag is only found when it is first used, but a row
+            # with more than one is an error that should stop the load, so
+            # look for them now (keeping the tag that is found)
+            if row.comment.count('#') > 1:
+                row._hashtag = row._xtag('#')
+            rows.append(row)
+    return rows
+
+
+def parse_file_pragmas(pathname):
+    """Return the rows of one accounting file and its "#!balance" pragma
+       lines, see parse_file()
+    """
+    pragmas = []
+    rows = parse_file(pathname, pragmas)
+    return rows, pragmas
+
+
+def parse_dir(dirname, jobs=1, cache=None, filenames=None,
+              partitions=None, pragmas=None):   # pragma: no cover
+    '''Take all files in dirname (or just the given filenames in it) and
+       return Row instances
+
+       With more than one job, the files are parsed on a process pool and
+       the results are merged back in the same order as a serial load.
+       When a RowCache is given, only the files that changed are parsed.
+       When Partitions are given, the span of each file is kept in them.
+       When a pragmas dict is given, the "#!balance" lines of each file are
+       put in it, by filename
+    '''
+    if filenames is None:
+        filenames = ledger_files(dirname)
+    pathnames = [os.path.join(dirname, filename) for filename in filenames]
+
+    results = {}
+    fingerprints = {}
+    if cache is not None:
+        for pathname in pathnames:
+            fingerprints[pathname] = cache.fingerprint(pathname)
+            # the pragmas are kept too, so a file is never read for them
+            parsed = cache.get(fingerprints[pathname])
+            if parsed is not None:
+                results[pathname] = parsed
+
+    todo = [pathname for pathname in pathnames if pathname not in results]
+    if jobs > 1 and len(todo) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(jobs, len(todo)))
+        try:
+            # map() keeps the results in the order of the pathnames
+            parsed = pool.map(parse_file_pragmas, todo, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parsed = [parse_file_pragmas(pathname) for pathname in todo]
+
+    for pathname, result in zip(todo, parsed):
+        results[pathname] = result
+        instrument.count('rows parsed', len(result[0]))
+        if cache is not None:
+            cache.put(fingerprints[pathname], result)
+
+    for pathname in pathnames:
+        rows, lines = results[pathname]
+        filename = os.path.basename(pathname)
+        if partitions is not None:
+            partitions.record(filename, rows)
+        if pragmas is not None:
+            pragmas[filename] = lines
+        for row in rows:
+            yield row
+
+
+def load_rows(args):
+    """Load the rows from the files in args.dir and then split and filter
+       them, as asked for by the commandline args
+    """
+    cache = getattr(args, 'row_cache', None)
+    # where to keep anything else worked out from the files between runs
+    cache_dir = getattr(args, 'cache', None)
+    snapshot_file = getattr(args, 'snapshot', None)
+    store_file = getattr(args, 'store', None)
+
+    # first, load the data
+    split = False
+    if snapshot_file is not None:
+        import snapshot
+        with instrument.phase('snapshot'):
+            rows, split = snapshot.load(snapshot_file)
+        if split and not args.split:
+            # the rows cannot be unsplit again
+            raise ValueError('Snapshot "{}" was compiled with --split, so'
+                             ' it can only be used with --split'.format(
+                                 snapshot_file))
+    elif store_file is not None:
+        from store import Store
+        with instrument.phase('store'):
+            store = Store(store_file, split=args.split)
+            store.update(args.dir, parse_file)
+            rows = store.rows()
+            split = args.split
+    else:
+        # skip the files that cannot have any rows that the filters keep,
+        # along with those that the subcommand filters out itself
+        filters = (args.filter or []) + (getattr(args, 'prune', None) or [])
+        filenames = all_files = ledger_files(args.dir)
+        # what is known about each file from the runs before, only kept
+        # when there is a cache directory to keep it in
+        partitions = None
+        if cache_dir is not None:
+            from partition import Partitions
+            partitions = Partitions(args.dir, split=args.split,
+                                    cache_dir=cache_dir)
+        checkpoints = None
+        start = None
+        pragmas = None
+        if filters:
+            if partitions is not None:
+                with instrument.phase('prune'):
+                    filenames = partitions.prune(filenames, filters)
+        else:
+            # with all of the rows, the balance checkpoints can be checked,
+            # their pragmas are collected as the files are parsed
+            pragmas = {}
+            if partitions is not None and \
+                    getattr(args, 'checkpoint', False) and not args.split:
+                # only the running balance is needed, so start from the
+                # newest checkpoint that can be trusted
+                from checkpoint import Checkpoints
+                with instrument.phase('checkpoint'):
+                    checkpoints = Checkpoints(args.dir, cache_dir=cache_dir)
+                    found = checkpoints.known(all_files, partitions)
+                    if found:
+                        start = checkpoints.trusted(found, all_files,
+                                                    partitions)
+                    if start is not None:
+                        after = ['date>' + start.date.isoformat()]
+                        filenames = partitions.prune(filenames, after)
+
+        with instrument.phase('parse'):
+            if args.columnar:
+                from columnar import ColumnarRowSet
+                rows = ColumnarRowSet()
+            else:
+                rows = RowSet()
+            rows.append(parse_dir(args.dir, jobs=args.jobs, cache=cache,
+                                  filenames=filenames,
+                                  partitions=partitions, pragmas=pragmas))
+
+        if start is not None:
+            opening = rows.__class__()
+            opening.append([start.row()])
+            opening.append(list(rows.filter(after)))
+            rows = opening
+
+        if checkpoints is not None or any((pragmas or {}).values()):
+            from checkpoint import Checkpoints
+            with instrument.phase('checkpoint'):
+                if checkpoints is None:
+                    checkpoints = Checkpoints(args.dir, cache_dir=cache_dir)
+                found = checkpoints.update(pragmas, all_files, partitions)
+                checkpoints.verify(found, rows, all_files, partitions, start)
+                checkpoints.save()
+
+        if partitions is not None:
+            partitions.save()
+
+    if cache is not None and args.cache_stats:
+        sys.stderr.write('{}\n'.format(cache))
+
+    # optionally split multi-month transactions into one per month
+    if args.split and not split:
+        with instrument.phase('split'):
+            rows = rows.autosplit()
+
+    # apply any filters requested
+    with instrument.phase('filter'):
+        return rows.filter(args.filter)
 
-    for filename in os.listdir(dirname):
-        if not re.match(r'^(incoming|outgoing)-\d{4}-\d{2}', filename):
-            sys.stderr.write(
-                'Filename "{}" not valid, put into proper accounting file\n'
-                .format(filename))
-            continue
 
-        direction, _ = filename.split('-', 1)
+def load_ledger(args):
+    """Load the rows from the files in args.dir as a Ledger, which can be
+       updated one file at a time, splitting and filtering each file as
+       asked for by the commandline args
+    """
+    def prepare(rows):
+        if args.split:
+            rows = rows.autosplit()
+        return rows.filter(args.filter)
 
-        with open(os.path.join(dirname, filename), 'r') as tsvfile:
-            for row in tsvfile.readlines():
-                row = row.rstrip('\n')
-                if not row:
-                    continue
-                if re.match(r'^#', row):
-                    # skip comment lines
-                    # - in future there might be meta/pragmas
-                    continue
-                yield Row(*re.split(r'\s+', row,
-                                    # Number of splits (3 fields)
-                                    maxsplit=2),
-                          direction=direction)
+    return Ledger(args.dir, parse_file, prepare)
 
 
 def render_month(date):
@@ -92,32 +273,6 @@ def render_month_len():
     return 9
 
 
-def grid_accumulate(rows):
-    """Accumulate the rows into month+tag buckets
-    """
-    grid = {}
-    totals = {}
-    months_present = set()
-
-    months = rows.group_by('month')
-    for month in months:
-        months_present.add(month)
-        totals[month] = months[month].value
-
-        tags = months[month].group_by('hashtag')
-
-        for tag in tags:
-            # I would prefer auto-vivification to all these if statements
-            if tag not in grid:
-                grid[tag] = {}
-
-            grid[tag][month] = {}
-            grid[tag][month]['sum'] = tags[tag].value
-
-    totals['total'] = rows.value
-    return months_present, grid, totals
-
-
 def grid_render_onerow(prefix, prefix_len, rowdata, cell_len):
     s = []
 
@@ -138,44 +293,35 @@ def grid_render_colheader(months, months_len, tags_len):
     )
 
 
-def grid_render_totals(months, totals, months_len, tags_len):
+def grid_render_totals(pivot, months_len, tags_len):
     s = []
 
     s += "\n"
     s += grid_render_onerow(
         'MONTH Sub Total', tags_len,
-        [totals[x] for x in months], months_len
+        pivot.month_totals, months_len
     )
-
-    running_totals = []
-    running_total = 0
-    for month in months:
-        running_total += totals[month]
-        running_totals.append(running_total)
-
     s += grid_render_onerow(
         'RUNNING Balance', tags_len,
-        running_totals, months_len
+        pivot.running_totals, months_len
     )
 
-    s += "TOTAL: {:>{}}".format(totals['total'], months_len)
+    s += "TOTAL: {:>{}}".format(pivot.total, months_len)
 
     return s
 
 
-def grid_render_rows(months, tags, grid, months_len, tags_len):
+def grid_render_rows(pivot, months_len, tags_len):
     s = []
 
-    tags = sorted(tags)
-
     # Output each tag on its own row
-    for tag in tags:
+    for tag in pivot.tags:
         cells = []
-        for month in months:
-            if month in grid[tag]:
-                cells.append(grid[tag][month]['sum'])
-            else:
+        for value in pivot.line(tag):
+            if value is None:
                 cells.append('')
+            else:
+                cells.append(value)
 
         s += grid_render_onerow(
             tag, tags_len,
@@ -185,21 +331,77 @@ def grid_render_rows(months, tags, grid, months_len, tags_len):
     return s
 
 
-def grid_render(months, tags, grid, totals):
+def grid_render(pivot):
     # Render the accumulated data
 
-    tags_len = max([len(i) for i in tags])+1
+    tags_len = max([len(i) for i in pivot.tags])+1
     months_len = render_month_len()
-    months = sorted(months)
 
     s = []
-    s += grid_render_colheader(months, months_len, tags_len)
-    s += grid_render_rows(months, tags, grid, months_len, tags_len)
-    s += grid_render_totals(months, totals, months_len, tags_len)
+    s += grid_render_colheader(pivot.months, months_len, tags_len)
+    s += grid_render_rows(pivot, months_len, tags_len)
+    s += grid_render_totals(pivot, months_len, tags_len)
 
     return ''.join(s)
 
 
+def date_runs(rows):
+    """Return the (start, end) indexes of each run of rows that is already
+       in date order
+    """
+    runs = []
+    start = 0
+    last = None
+    for i, row in enumerate(rows):
+        if last is not None and row.date < last:
+            runs.append((start, i))
+            start = i
+        last = row.date
+    if len(rows):
+        runs.append((start, len(rows)))
+    return runs
+
+
+def date_sorted(rows):
+    """Yield the rows in the same order as a stable sort by date would give,
+       without copying them.  The cash files are each almost in date order,
+       so this is a merge of a few runs that are already sorted
+    """
+    def run(start, end):
+        for i in range(start, end):
+            row = rows[i]
+            # the index keeps equal dates in order, and the rows from
+            # ever being compared
+            yield (row.date, i, row)
+
+    import heapq
+    runs = [run(start, end) for start, end in date_runs(rows)]
+    for _, _, row in heapq.merge(*runs):
+        yield row
+
+
+def csv_write(f, rows):
+    """Write the rows, in date order, as csv to the file f, a line at a time
+       and followed by their sum
+    """
+    import csv
+    writer = csv.writer(f)
+
+    # Write header
+    writer.writerow([row.capitalize() for row in Row._fields])
+
+    total = 0
+    exp = 0
+    for row in date_sorted(rows):
+        writer.writerow(row)
+        total += row.cents
+        exp = min(exp, row._exp)
+
+    writer.writerow('')
+    writer.writerow(('Sum',))
+    writer.writerow((money.normalise(total, exp),))
+
+
 def topay_render(rows, strings):
     rows = rows.filter(['direction==outgoing'])
     alltags = sorted(rows.group_by('hashtag').keys())
@@ -280,38 +482,39 @@ def subp_party(args):
 
 
 def subp_csv(args):
-    rows = RowSet()
-    rows.append(sorted(args.rows, key=lambda x: x.date))
-
+    # Write straight to the stream when there is one, instead of keeping
+    # the whole output in memory
+    stream = getattr(args, 'stream', None)
+    if stream is not None:
+        csv_write(stream, args.rows)
+        return None
+
+    try:
+        from StringIO import StringIO  # python 2
+    except ImportError:
+        from io import StringIO  # python 3
     buf = StringIO()
-    writer = csv.writer(buf)
-
-    # Write header
-    writer.writerow([row.capitalize() for row in Row._fields])
-
-    writer.writerows(rows)
-
-    writer.writerow('')
-    writer.writerow(('Sum',))
-    writer.writerow((rows.value,))
+    csv_write(buf, args.rows)
     return buf.getvalue()
 
 
-def subp_grid(args):
+def grid_label(row):
     # ensure that each category has a nice and clear prefix
-    for row in args.rows:
-        if row.hashtag is None:
-            row.hashtag = 'unknown'
+    hashtag = row.hashtag
+    if hashtag is None:
+        hashtag = 'unknown'
 
-        if row.direction == 'outgoing':
-            row.hashtag = row.hashtag + ' out'
-        else:
-            row.hashtag = row.hashtag + ' in'
+    if row.direction == 'outgoing':
+        return hashtag + ' out'
+    return hashtag + ' in'
 
-    (months, grid, totals) = grid_accumulate(args.rows)
-    tags = args.rows.group_by('hashtag').keys()
 
-    return grid_render(months, tags, grid, totals)
+grid_label.fields = ('hashtag', 'direction')
+
+
+def subp_grid(args):
+    # The pivot is kept with the rows, so served and batch runs reuse it
+    return grid_render(args.rows.pivot(grid_label))
 
 
 def subp_json_payments(args):
@@ -321,10 +524,15 @@ def subp_json_payments(args):
     r = {}
     for tag, payment in payments.items():
         r[tag] = render_month(payment.last().date)
+
+    import json
     return json.dumps((r))
 
 
 def subp_make_balance(args):
+    import calendar
+    import string
+
     # Load the template file
     # TODO - use a string or an arg for the template source
     with open(os.path.join(os.path.dirname(__file__),
@@ -340,19 +548,20 @@ def subp_make_balance(args):
     ])
 
     # Make the category look pretty
-    for row in grid_rows:
+    def label(row):
         a = row.hashtag.split(':')
-        row.hashtag = ''.join(a[1:]).title()
+        return ''.join(a[1:]).title()
+    label.fields = ('hashtag',)
 
-    (months, grid, totals) = grid_accumulate(grid_rows)
-    tags = grid_rows.group_by('hashtag').keys()
-    months = sorted(months)
+    from pivot import Pivot
+    pivot = Pivot(grid_rows, label)
 
     months_len = render_month_len()
-    tags_len = max([len(i) for i in tags])+1
+    tags_len = max([len(i) for i in pivot.tags])+1
 
-    header = ''.join(grid_render_colheader(months, months_len, tags_len))
-    grid = ''.join(grid_render_rows(months, tags, grid, months_len, tags_len))
+    header = ''.join(grid_render_colheader(pivot.months, months_len,
+                                           tags_len))
+    grid = ''.join(grid_render_rows(pivot, months_len, tags_len))
 
     def _get_next_rent_month():
         last_payment = args.rows.group_by('hashtag')['bills:rent'].last()
@@ -386,58 +595,38 @@ def subp_make_balance(args):
 
 
 def subp_stats(args):
-    # stats are only likely to be valid for previous months
-    rows = args.rows.filter(['rel_months<0'])
-    current_month = args.rows.filter(['rel_months==0'])
-
-    def make_rowset(value):
-        r = RowSet()
-        r.append(Row(value, '1970-01-01', 'fake row', 'signed'))
-        return r
-
-    def stats_rowset(rowset):
-        r = {}
-        r['incoming'] = rowset.filter(['value>0'])
-        r['outgoing'] = rowset.filter(['value<0'])
-        # TODO - values of zero?  we have one member as such, but it is a
-        # exceptional case
-        r['dues']     = rowset.filter(['hashtag=~^dues:']) # noqa
-        r['members']  = len(r['dues'].group_by('hashtag').keys()) # noqa
-        if r['members']:
-            r['ARPM'] = int(r['dues'].value / r['members']) # noqa
-        else:
-            r['ARPM'] = -1
-
-        r['other']    = rowset.filter(['value>0','hashtag!~^dues:']) # noqa
+    from stats import Stats
+    stats = Stats(args.rows)
 
-        return r
+    # stats are only likely to be valid for previous months
+    now = month_ordinal(get_now())
 
     result = {}
-    months = rows.group_by('month')
-    for k, month in months.items():
-        result[k] = stats_rowset(month)
+    for month in stats.months:
+        if month < now:
+            result[month_date(month)] = stats.summary(month, month)
 
     months_len = render_month_len()+2
     tags_len = 13
 
     months = sorted(result.keys())
 
-    result['Total'] = stats_rowset(rows)
+    result['Total'] = stats.summary(last=now - 1)
 
-    result['Average'] = {}
+    result['Average'] = {'nr_months': {}}
     for tag in ('outgoing', 'incoming', 'dues', 'other'):
-        result['Average'][tag] = make_rowset(
-            result['Total'][tag].value / len(months))
+        result['Average'][tag] = result['Total'][tag] / len(months)
+        result['Average']['nr_months'][tag] = 1
     result['Average']['members'] = int(sum(
         [result[x]['members'] for x in months]
     ) / len(months))
     result['Average']['ARPM'] = int(
-        result['Total']['dues'].value /
+        result['Total']['dues'] /
         result['Average']['members'] /
         len(months)
     )
 
-    result['MonthTD'] = stats_rowset(current_month)
+    result['MonthTD'] = stats.summary(now, now)
 
     months.append('Average')
     months.append('MonthTD')
@@ -448,7 +637,7 @@ def subp_stats(args):
     for tag in ('outgoing', 'incoming'):
         s += grid_render_onerow(
             tag, tags_len,
-            [result[x][tag].value.to_integral_exact(
+            [result[x][tag].to_integral_exact(
                     rounding=decimal.ROUND_FLOOR
                 ) for x in months],
             months_len
@@ -457,7 +646,7 @@ def subp_stats(args):
     for tag in ('dues', 'other'):
         s += grid_render_onerow(
             " {}:".format(tag), tags_len,
-            [result[x][tag].value.to_integral_exact(
+            [result[x][tag].to_integral_exact(
                     rounding=decimal.ROUND_FLOOR
                 ) for x in months],
             months_len
@@ -480,16 +669,16 @@ def subp_stats(args):
     # until near the end of the month
     months = months[:-2]
 
-    def members_given_dues_outgoing(dues, rowset):
-        months = len(rowset.group_by('month').keys())
+    def members_given_dues_outgoing(dues, stats):
+        months = stats['nr_months']['outgoing']
         total_dues = dues * months
-        return abs((rowset.value / total_dues).to_integral_exact(
+        return abs((stats['outgoing'] / total_dues).to_integral_exact(
                 rounding=decimal.ROUND_FLOOR
         ))
 
-    def dues_given_members_outgoing(members, rowset):
-        months = len(rowset.group_by('month').keys())
-        return abs(rowset.value / members / months).to_integral_exact(
+    def dues_given_members_outgoing(members, stats):
+        months = stats['nr_months']['outgoing']
+        return abs(stats['outgoing'] / members / months).to_integral_exact(
                 rounding=decimal.ROUND_FLOOR
         )
 
@@ -505,7 +694,7 @@ def subp_stats(args):
     for dues in sorted(fees_rates):
         s += grid_render_onerow(
             " dues {}".format(dues), tags_len,
-            [members_given_dues_outgoing(dues, result[x]['outgoing'])
+            [members_given_dues_outgoing(dues, result[x])
                 for x in months],
             months_len
         )
@@ -521,7 +710,7 @@ def subp_stats(args):
     for members in sorted(members_count):
         s += grid_render_onerow(
             " members {}".format(members), tags_len,
-            [dues_given_members_outgoing(members, result[x]['outgoing'])
+            [dues_given_members_outgoing(members, result[x])
                 for x in months],
             months_len
         )
@@ -531,11 +720,178 @@ def subp_stats(args):
     return ''.join(s)
 
 
-# A list of all the sub-commands
+def subp_compile(args):
+    """Write the loaded rows to a snapshot file, which can then be loaded
+       with --snapshot instead of parsing the files again
+    """
+    from columnar import ColumnarRowSet
+    import snapshot
+
+    rows = args.rows
+    if not isinstance(rows, ColumnarRowSet):
+        rows = ColumnarRowSet(rows)
+    with instrument.phase('compile'):
+        snapshot.write(args.output, rows, split=args.split)
+
+
+# The subcommands that are not a report on the rows
+_not_reports = ('batch', 'serve', 'compile')
+
+
+def report_args(args, cmd, filters=None):
+    """Return the args to run the given subcommand with, on a view of the
+       shared rows with any extra filters applied
+    """
+    import copy
+    job_args = copy.copy(args)
+    job_args.cmd = cmd
+    job_args.func = subp_cmds[cmd]['func']
+    # only filtering again when asked to
+    job_args.rows = args.rows.filter(filters)
+    # the output is returned, so the jobs are not written out of order
+    job_args.stream = None
+    return job_args
+
+
+def batch_job_args(args, job):
+    """Parse one batch job string, eg: "--filter month>2016-08 stats", and
+       return the args to run its subcommand with
+    """
+    import shlex
+    parser = argparse.ArgumentParser(prog='batch job')
+    parser.add_argument('--filter', action='append',
+                        help='Add a key=value filter to the rows used')
+    parser.add_argument('--output', action='store', type=str,
+                        help='Write the output to this file')
+    parser.add_argument('cmd',
+                        choices=sorted(x for x in subp_cmds
+                                       if x not in _not_reports))
+    job = parser.parse_args(shlex.split(job))
+
+    job_args = report_args(args, job.cmd, job.filter)
+    job_args.output = job.output
+    return job_args
+
+
+def subp_batch(args):
+    """Run several subcommands against the rows that were loaded once,
+       writing each to its own output file or otherwise to stdout
+       (separated by a blank line)
+    """
+    results = []
+    for command in args.commands:
+        job_args = batch_job_args(args, command)
+
+        if job_args.output is None:
+            with instrument.phase(job_args.cmd):
+                results.append('{}'.format(job_args.func(job_args)))
+            continue
+
+        with open(job_args.output, 'w') as f:
+            job_args.stream = instrument.writer(f)
+            with instrument.phase(job_args.cmd):
+                result = job_args.func(job_args)
+            # unless it was already written to the stream
+            if result is not None:
+                job_args.stream.write('{}\n'.format(result))
+
+    if not results:
+        return None
+    return '\n\n'.join(results)
+
+
+def watch_update(server, watcher, timeout=1.0):
+    """Swap the files that have changed into the rows that the server is
+       using, waiting up to timeout seconds for some to change
+    """
+    filenames = watcher.changes(timeout)
+    if not filenames:
+        return
+    try:
+        server.update(lambda rows: rows.update(filenames), '_watch')
+    except Exception as e:
+        # eg: a file that is only half written, the rows are kept as they
+        # were until it is written again
+        sys.stderr.write('Could not update from {}: {}\n'.format(
+            ', '.join(sorted(filenames)), e))
+
+
+def subp_serve(args):   # pragma: no cover
+    """Keep the rows in memory and answer the other subcommands over HTTP,
+       until interrupted
+    """
+    from server import make_server
+    from watch import make_watcher
+    import threading
+    import copy
+
+    def load():
+        if args.watch:
+            return load_ledger(args)
+        rows = load_rows(args)
+        if isinstance(rows, RowSet):
+            # split any rows left to be split now, rather than in whichever
+            # of the request threads looks at them first
+            rows._split_rows()
+        return rows
+
+    def run(cmd, filters, rows):
+        snapshot_args = copy.copy(args)
+        snapshot_args.rows = rows
+        job_args = report_args(snapshot_args, cmd, filters)
+        return job_args.func(job_args)
+
+    commands = {}
+    for cmd in subp_cmds:
+        if cmd not in _not_reports:
+            commands[cmd] = 'text/plain'
+    commands['json_payments'] = 'application/json'
+    commands['make_balance'] = 'text/html'
+
+    server = make_server(load, run, commands, listen=args.listen,
+                         path=args.socket, threads=args.threads,
+                         now=args.now)
+
+    def watch():
+        watcher = make_watcher(args.dir)
+        while True:
+            watch_update(server, watcher)
+
+    if args.watch:
+        thread = threading.Thread(target=watch)
+        thread.daemon = True
+        thread.start()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def write_profile(args):
+    """Write out the phase times and counters that were recorded, as asked
+       for by the commandline args
+    """
+    if args.profile:
+        sys.stderr.write(instrument.render())
+    if args.profile_json is not None:
+        import json
+        with open(args.profile_json, 'w') as f:
+            f.write(json.dumps(instrument.results(), indent=1,
+                               sort_keys=True))
+            f.write('\n')
+
+
+# A list of all the sub-commands, with any options of their own.  Their
+# functions import what they need, so nothing is loaded for the others
 subp_cmds = {
     'sum': {
         'func': subp_sum,
         'help': 'Sum all transactions',
+        # Only the balance is needed, so it can start from a checkpoint
+        'checkpoint': True,
     },
     'make_balance': {
         'func': subp_make_balance,
@@ -552,6 +908,7 @@ subp_cmds = {
     'party': {
         'func': subp_party,
         'help': 'Is it party time or not?',
+        'checkpoint': True,
     },
     'csv': {
         'func': subp_csv,
@@ -564,17 +921,59 @@ subp_cmds = {
     'json_payments': {
         'func': subp_json_payments,
         'help': 'Output JSON of incoming payments',
+        # The rows that it looks at, so the others need not be loaded
+        'prune': ['direction==incoming'],
     },
     'stats': {
         'func': subp_stats,
         'help': 'Output finance stats report',
     },
+    'batch': {
+        'func': subp_batch,
+        'help': 'Run several of the other subcommands on the same rows',
+        'args': [
+            (('commands',), dict(
+                nargs='+', metavar='command',
+                help='Subcommands to run, each one a quoted string that can'
+                     ' also have its own --filter and --output options')),
+        ],
+    },
+    'serve': {
+        'func': subp_serve,
+        'help': 'Keep the rows loaded and answer subcommands over HTTP',
+        'args': [
+            (('--watch',), dict(
+                action='store_const', const=True, default=False,
+                help='Parse the files again as they change, one file at a'
+                     ' time (this does not use --columnar, --cache, --jobs'
+                     ' or the balance checkpoints)')),
+            (('--listen',), dict(
+                action='store', type=str, default='127.0.0.1:8000',
+                help='Host and port to listen on (default %(default)s)')),
+            (('--socket',), dict(
+                action='store', type=str,
+                help='Listen on this unix socket path instead')),
+            (('--threads',), dict(
+                action='store', type=int, default=4,
+                help='Number of requests to answer at once'
+                     ' (default %(default)s)')),
+        ],
+    },
+    'compile': {
+        'func': subp_compile,
+        'help': 'Write the rows to a snapshot file, for use with --snapshot',
+        'args': [
+            (('output',), dict(
+                action='store', type=str,
+                help='Snapshot file to write')),
+        ],
+    },
 }
 
 #
 # Most of this is boilerplate and stays the same even with addition of
-# features.  The only exception is if a sub-command needs to add a new
-# commandline option.
+# features.  A sub-command that needs a new commandline option lists it in
+# its "args" in subp_cmds.
 #
 if __name__ == '__main__':  # pragma: no cover
     argparser = argparse.ArgumentParser(
@@ -591,28 +990,104 @@ if __name__ == '__main__':  # pragma: no cover
                            action='store_const', const=True,
                            default=False,
                            help='Split rows that cover multiple months')
+    argparser.add_argument('--jobs',
+                           action='store',
+                           type=int,
+                           default=1,
+                           help='Number of processes used to parse the files')
+    argparser.add_argument('--columnar',
+                           action='store_const', const=True,
+                           default=False,
+                           help='Store the rows in columns, using less memory')
+    argparser.add_argument('--cache',
+                           action='store',
+                           type=str,
+                           help='Directory to cache parsed rows in')
+    argparser.add_argument('--cache-clear',
+                           action='store_const', const=True,
+                           default=False,
+                           help='Invalidate the cache before loading')
+    argparser.add_argument('--cache-stats',
+                           action='store_const', const=True,
+                           default=False,
+                           help='Report the cache hits and misses on stderr')
+    argparser.add_argument('--snapshot',
+                           action='store',
+                           type=str,
+                           help='Load the rows from this file, written by the'
+                                ' compile subcommand, instead of --dir')
+    argparser.add_argument('--store',
+                           action='store',
+                           type=str,
+                           help='Keep the rows in this SQLite database,'
+                                ' only parsing the files that have changed')
+    argparser.add_argument('--now',
+                           action='store',
+                           type=str,
+                           help='Date (YYYY-MM-DD) that relative months are'
+                                ' counted from, instead of today')
+    argparser.add_argument('--profile',
+                           action='store_const', const=True,
+                           default=False,
+                           help='Report the time taken by each phase and the'
+                                ' counters on stderr')
+    argparser.add_argument('--profile-json',
+                           action='store',
+                           type=str,
+                           help='Write the phase times and counters to this'
+                                ' file as JSON')
+    argparser.add_argument('--cprofile',
+                           action='store',
+                           type=str,
+                           help='Write a cProfile dump of the subcommand'
+                                ' (not the loading) to this file')
 
     subp = argparser.add_subparsers(help='Subcommand', dest='cmd')
     subp.required = True
     for key, value in subp_cmds.items():
         value['parser'] = subp.add_parser(key, help=value['help'])
         value['parser'].set_defaults(func=value['func'])
+        for arg_names, arg_options in value.get('args', []):
+            value['parser'].add_argument(*arg_names, **arg_options)
 
     args = argparser.parse_args()
 
+    instrument.enable(args.profile or args.profile_json is not None)
+
+    # decide what "now" is once, so the whole run agrees on it
+    set_now(args.now)
+
     if not os.path.exists(args.dir):
         raise RuntimeError('Directory "{}" does not exist'.format(args.dir))
 
-    # first, load the data
-    args.rows = RowSet()
-    args.rows.append(parse_dir(args.dir))
-
-    # optionally split multi-month transactions into one per month
-    if args.split:
-        args.rows = args.rows.autosplit()
+    args.row_cache = None
+    if args.cache:
+        from cache import RowCache
+        args.row_cache = RowCache(args.cache)
+        if args.cache_clear:
+            args.row_cache.clear()
+
+    args.prune = subp_cmds[args.cmd].get('prune')
+    args.checkpoint = subp_cmds[args.cmd].get('checkpoint', False)
+
+    # the serve subcommand loads the rows itself, so it can reload them
+    if args.cmd != 'serve':
+        args.rows = load_rows(args)
+
+    # the subcommands that can, write to this as they go
+    args.stream = instrument.writer(sys.stdout)
+
+    with instrument.phase(args.cmd):
+        if args.cprofile:
+            import cProfile
+            profiler = cProfile.Profile()
+            result = profiler.runcall(args.func, args)
+            profiler.dump_stats(args.cprofile)
+        else:
+            result = args.func(args)
 
-    # apply any filters requested
-    args.rows = args.rows.filter(args.filter)
+    with instrument.phase('output'):
+        if result is not None:
+            args.stream.write('{}\n'.format(result))
 
-    result = args.func(args)
-    print(result)
+    write_profile(args)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# Licensed under GPLv3
+
+""" This is a benchmark harness - it makes up ledgers of several sizes and
+    times loading, splitting, filtering and each of the subcommands on them,
+    writing the results as JSON so that runs can be compared
+"""
+
+import argparse
+import datetime
+import platform
+import tempfile
+import shutil
+import json
+import time
+import copy
+import sys
+import os
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'lib'))
+# I would use site.addsitedir, but it does an append, not insert
+
+import balance  # noqa
+import synthetic  # noqa
+import pivot  # noqa
+
+
+def timed(func, repeat):
+    """Return the result of func() and the fastest time it took, out of
+       repeat runs
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+
+def bench_size(args, members):
+    """Time everything on a made up ledger with the given number of members
+       and return a list of results
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        count = synthetic.generate(tmpdir, members=members, years=args.years,
+                                   split=args.split_fraction,
+                                   start=args.start)
+
+        # the reports are as of the end of the made up history
+        balance.set_now(datetime.date(args.start + args.years - 1, 12, 20))
+
+        load_args = argparse.Namespace(
+            dir=tmpdir, filter=None, split=False, jobs=args.jobs,
+            columnar=args.columnar, row_cache=None, cache_stats=False,
+        )
+        rows, seconds = timed(lambda: balance.load_rows(load_args),
+                              args.repeat)
+        results = [('load', seconds)]
+
+        def split():
+            result = rows.autosplit()
+            # make sure that every child row is made
+            len(result)
+            return result
+        split_rows, seconds = timed(split, args.repeat)
+        results.append(('split', seconds))
+
+        filters = ['hashtag=~^dues:', 'month>{}-06'.format(args.start)]
+        _, seconds = timed(lambda: split_rows.filter(filters), args.repeat)
+        results.append(('filter', seconds))
+
+        report_args = argparse.Namespace(rows=split_rows, stream=None)
+        for cmd in sorted(balance.subp_cmds):
+            if cmd in balance._not_reports:
+                continue
+
+            def run():
+                job_args = copy.copy(report_args)
+                # a copy of the rows, so no indexes are kept between runs
+                job_args.rows = split_rows.filter(None)
+                return balance.subp_cmds[cmd]['func'](job_args)
+
+            try:
+                _, seconds = timed(run, args.repeat)
+            except Exception as e:
+                seconds = '{}: {}'.format(e.__class__.__name__, e)
+            results.append((cmd, seconds))
+
+        entries = []
+        for phase, seconds in results:
+            entry = {
+                'members': members,
+                'years': args.years,
+                'rows': count,
+                'phase': phase,
+            }
+            if isinstance(seconds, float):
+                entry['seconds'] = round(seconds, 6)
+            else:
+                entry['error'] = seconds
+            entries.append(entry)
+        return entries
+
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(
+        description='Time the subcommands on made up ledgers')
+    argparser.add_argument('--members',
+                           action='store',
+                           type=str,
+                           default='10,100,1000',
+                           help='Comma separated sizes, as numbers of members'
+                                ' (default %(default)s)')
+    argparser.add_argument('--years',
+                           action='store',
+                           type=int,
+                           default=3,
+                           help='Years of history (default %(default)s)')
+    argparser.add_argument('--start',
+                           action='store',
+                           type=int,
+                           default=2010,
+                           help='First year of history (default %(default)s)')
+    argparser.add_argument('--split-fraction',
+                           action='store',
+                           type=float,
+                           default=0.1,
+                           help='Fraction of rows paid with !months'
+                                ' (default %(default)s)')
+    argparser.add_argument('--repeat',
+                           action='store',
+                           type=int,
+                           default=3,
+                           help='Runs of each timing, the fastest is kept'
+                                ' (default %(default)s)')
+    argparser.add_argument('--jobs',
+                           action='store',
+                           type=int,
+                           default=1,
+                           help='Number of processes used to parse the files')
+    argparser.add_argument('--columnar',
+                           action='store_const', const=True,
+                           default=False,
+                           help='Store the rows in columns')
+    argparser.add_argument('--output',
+                           action='store',
+                           type=str,
+                           help='Write the results to this file')
+    args = argparser.parse_args(argv)
+
+    results = []
+    for members in args.members.split(','):
+        results.extend(bench_size(args, int(members)))
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': pivot.numpy is not None,
+        'columnar': args.columnar,
+        'jobs': args.jobs,
+        'repeat': args.repeat,
+        'split_fraction': args.split_fraction,
+        'results': results,
+    }
+    data = json.dumps(report, indent=1, sort_keys=True)
+
+    if args.output is None:
+        print(data)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,83 @@
+# Licensed under GPLv3
+import tempfile
+import hashlib
+import pickle
+import os
+
+
+class RowCache(object):
+    """Keep the parsed rows from each accounting file on disk, so that files
+       that have not changed since the last run do not need parsing again.
+       Whatever else parse_dir() gets from a file (its "#!balance" pragma
+       lines) is kept along with the rows.
+    """
+
+    # Change this whenever the pickled form of a Row, or of what is kept
+    # with them, changes.  Any entries written by an older version are then
+    # simply treated as misses
+    version = 5
+
+    suffix = '.rows'
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+
+    def __str__(self):
+        return 'cache {}: {} hits, {} misses'.format(
+            self.dirname, self.hits, self.misses)
+
+    @staticmethod
+    def fingerprint(pathname):
+        """Return the key used to decide if a file has changed
+        """
+        pathname = os.path.abspath(pathname)
+        stat = os.stat(pathname)
+        with open(pathname, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        return (pathname, stat.st_size, stat.st_mtime, digest)
+
+    def _entryname(self, fingerprint):
+        name = hashlib.sha1(fingerprint[0].encode('utf-8')).hexdigest()
+        return os.path.join(self.dirname, name + self.suffix)
+
+    def get(self, fingerprint):
+        """Return the rows stored for this fingerprint, or None
+        """
+        try:
+            with open(self._entryname(fingerprint), 'rb') as f:
+                version, stored, rows = pickle.load(f)
+        except Exception:
+            # A missing, truncated or otherwise unreadable entry is a miss
+            version, stored, rows = (None, None, None)
+
+        if version != self.version or stored != fingerprint:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return rows
+
+    def put(self, fingerprint, rows):
+        """Store the rows parsed from the file with this fingerprint
+        """
+        data = pickle.dumps((self.version, fingerprint, rows),
+                            pickle.HIGHEST_PROTOCOL)
+
+        # Write to a temp file and rename it into place, so that a
+        # concurrent reader never sees a half written entry
+        fd, tmpname = tempfile.mkstemp(dir=self.dirname)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmpname, self._entryname(fingerprint))
+
+    def clear(self):
+        """Invalidate the whole cache
+        """
+        for name in os.listdir(self.dirname):
+            if name.endswith(self.suffix):
+                os.unlink(os.path.join(self.dirname, name))
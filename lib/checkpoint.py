@@ -0,0 +1,220 @@
+# Licensed under GPLv3
+import decimal
+import bisect
+import sys
+import os
+import re
+
+from row import Row, parse_date
+from partition import _load_sidecar, _save_sidecar, _sidecar_path
+import instrument
+import money
+
+# A line in an accounting file that records a counted balance, the sum of
+# every row (in all of the files) dated on or before that day
+_pragma = re.compile(r'#!balance\s+(\S+)\s+(\S+)\s*$')
+
+
+def _valid(date, value):
+    try:
+        parse_date(date)
+        money.from_value(value)
+    except (ValueError, decimal.InvalidOperation):
+        return False
+    return True
+
+
+def read_checkpoints(lines, filename):
+    """Return the [date, value] strings of the "#!balance DATE VALUE" lines
+       of one accounting file, as collected by parse_file()
+    """
+    result = []
+    for line in lines:
+        m = _pragma.match(line)
+        # check them now, so that the error names the file
+        if not m or not _valid(*m.groups()):
+            raise ValueError('Bad balance pragma "{}" in {}'.format(
+                line, filename))
+        result.append(list(m.groups()))
+    return result
+
+
+class Checkpoint(object):
+    """A counted balance, as written in one of the accounting files
+    """
+    def __init__(self, date, value, filename):
+        self.date = parse_date(date)
+        self.value = value
+        self.cents = money.from_value(value)[0]
+        self.filename = filename
+
+    @property
+    def key(self):
+        return '{} {}'.format(self.date.isoformat(), self.value)
+
+    def row(self):
+        """Return a single row with the whole balance, to stand in for all
+           of the rows up to and including this date
+        """
+        return Row(self.value, self.date, 'balance brought forward',
+                   'signed')
+
+
+class Checkpoints(object):
+    """Keep track of the balance checkpoints in the accounting files, and
+       of which of them have been verified against the rows.
+
+       The checkpoints are read from the lines that parse_file() collects
+       as it parses each file.  A checkpoint stays verified for as long as
+       none of the files with rows dated on or before it have changed (as
+       told by the Partitions), and no new file has any, so that the
+       balance after it can be found from the rows after it alone.  The
+       checkpoints of each file and the verified ones are kept in a small
+       sidecar file in the cache directory, next to the one kept by
+       Partitions, but only once there are any checkpoints.  Without a
+       cache directory they are only checked.
+    """
+
+    # Change this whenever the sidecar changes, an older one is ignored
+    version = 2
+
+    sidecar = 'checkpoints'
+
+    def __init__(self, dirname, cache_dir=None):
+        self.dirname = dirname
+        self.pathname = _sidecar_path(cache_dir, self.sidecar, dirname)
+        self.changed = False
+
+        data = {}
+        if self.pathname is not None:
+            data = _load_sidecar(self.pathname, self.version)
+        self.files = data.get('files', {})
+        self.verified = data.get('verified', {})
+
+    def _checkpoints(self, filenames):
+        result = []
+        for filename in filenames:
+            entry = self.files.get(filename)
+            if entry is not None:
+                for date, value in entry['checkpoints']:
+                    result.append(Checkpoint(date, value, filename))
+        result.sort(key=lambda checkpoint: checkpoint.date)
+        return result
+
+    def known(self, filenames, partitions):
+        """Return the kept checkpoints of the given files, oldest first, or
+           None when any of the files has changed since they were kept and
+           so has to be parsed to find them
+        """
+        for filename in filenames:
+            entry = self.files.get(filename)
+            if entry is None or entry['stat'] != partitions.stat(filename):
+                return None
+        return self._checkpoints(filenames)
+
+    def update(self, pragmas, filenames, partitions=None):
+        """Keep the checkpoints of the files that were parsed, from a dict
+           of the "#!balance" lines of each one, and return those of all of
+           the given files, oldest first.  The files that were not parsed
+           keep the checkpoints that were kept for them.
+        """
+        for filename in sorted(pragmas):
+            entry = {
+                'stat': partitions.stat(filename) if partitions else None,
+                'checkpoints': read_checkpoints(
+                    pragmas[filename],
+                    os.path.join(self.dirname, filename)),
+            }
+            if self.files.get(filename) != entry:
+                self.files[filename] = entry
+                self.changed = True
+
+        for filename in set(self.files) - set(filenames):
+            del self.files[filename]
+            self.changed = True
+
+        return self._checkpoints(filenames)
+
+    def _history(self, checkpoint, filenames, partitions):
+        """Return the stat of each file that has rows dated on or before the
+           checkpoint, or None if that cannot be told from the partitions
+        """
+        date = checkpoint.date.isoformat()
+        history = {}
+        for filename in filenames:
+            entry = partitions.current(filename)
+            if entry is None:
+                return None
+            span = entry['rows']
+            if span is not None and span['dates'][0] <= date:
+                history[filename] = entry['stat']
+        return history
+
+    def trusted(self, checkpoints, filenames, partitions):
+        """Return the newest of the checkpoints that was verified and that
+           still has the same rows before it, or None
+        """
+        for checkpoint in reversed(checkpoints):
+            history = self.verified.get(checkpoint.key)
+            if history is None:
+                continue
+            if self._history(checkpoint, filenames, partitions) == history:
+                return checkpoint
+        return None
+
+    def verify(self, checkpoints, rows, filenames, partitions, start=None):
+        """Check the checkpoints against the running balance of the rows,
+           which are either all of the rows or the row of the start
+           checkpoint and those after it.  Any that do not match are written
+           to stderr, the others are kept as verified, when there are
+           partitions to tell if they later change.
+        """
+        if start is not None:
+            checkpoints = [x for x in checkpoints if x.date > start.date]
+        if not checkpoints:
+            return
+
+        # The total of the rows up to each checkpoint, since the one before
+        dates = [x.date for x in checkpoints]
+        totals = [0] * len(checkpoints)
+        for date, group in rows.group_by('date').items():
+            i = bisect.bisect_left(dates, date)
+            if i < len(totals):
+                totals[i] += money.from_value(group.value)[0]
+
+        balance = 0
+        for checkpoint, total in zip(checkpoints, totals):
+            balance += total
+            if balance != checkpoint.cents:
+                instrument.count('checkpoint mismatches')
+                if self.verified.pop(checkpoint.key, None) is not None:
+                    self.changed = True
+                sys.stderr.write(
+                    'Balance checkpoint {} {} in {} does not match the'
+                    ' running balance of {}\n'.format(
+                        checkpoint.date.isoformat(), checkpoint.value,
+                        checkpoint.filename, money.normalise(balance, -2)))
+                continue
+
+            history = None
+            if partitions is not None:
+                history = self._history(checkpoint, filenames, partitions)
+            if history is not None and \
+                    self.verified.get(checkpoint.key) != history:
+                self.verified[checkpoint.key] = history
+                self.changed = True
+            instrument.count('checkpoints verified')
+
+    def save(self):
+        """Write the sidecar, if anything in it has changed
+        """
+        if not self.changed or self.pathname is None:
+            return
+        if not any(entry['checkpoints'] for entry in self.files.values()):
+            # nothing worth keeping
+            return
+        # A read only directory just means checking them all next time
+        if _save_sidecar(self.pathname, {'version': self.version,
+                                         'files': self.files,
+                                         'verified': self.verified}):
+            self.changed = False
@@ -0,0 +1,293 @@
+# Licensed under GPLv3
+from array import array
+import datetime
+import types
+
+from row import Row, make_row
+from filters import parse_filter, compile_filter
+from rowset import BaseRowSet, RowSet
+import instrument
+import money
+
+
+class ColumnarRowSet(BaseRowSet):
+    """A RowSet that keeps its rows as columns of plain numbers instead of
+       a list of Row objects.
+
+       - values are integer minor units (cents) with the number of decimal
+         places they were written with (to render them back the same way)
+       - dates are ordinal numbers
+       - the direction is a single byte
+       - hashtags and comments are dictionary encoded, with the tables shared
+         between this rowset and any rowset derived from it
+
+       Rows are only turned back into Row objects when they are looked at
+       one at a time.
+    """
+
+    # The Row fields that can be calculated from a single column, these can
+    # be evaluated once for each distinct value in that column instead of
+    # once for each row
+    _columns = {
+        'value': '_valuekeys',
+        'date': 'dates',
+        'month': 'dates',
+        'rel_months': 'dates',
+        'direction': 'directions',
+        'hashtag': 'tags',
+        'comment': 'comments',
+        'bangtag': 'comments',
+    }
+
+    _directions = ('incoming', 'outgoing')
+
+    def __init__(self, rows=None, _tables=None):
+        BaseRowSet.__init__(self)
+        self.cents = array(money.cents_typecode)
+        self.exps = array('b')
+        self.dates = array('i')
+        self.directions = array('b')
+        self.tags = array('i')
+        self.comments = array('i')
+
+        if _tables is None:
+            # the tables of strings, the index into these is the stored id
+            _tables = ([None], {None: 0}, [], {})
+        (self._tags, self._tag_ids,
+         self._comments, self._comment_ids) = _tables
+
+        # Running aggregates in cents, kept up to date as rows are added
+        self._total = 0
+        self._exp = 0
+        self._min = None
+        self._max = None
+        # The index of the chronologically last row
+        self._last = None
+
+        if rows is not None:
+            self.append(rows)
+
+    def _tables(self):
+        return (self._tags, self._tag_ids, self._comments, self._comment_ids)
+
+    def __len__(self):
+        return len(self.cents)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('rowset index out of range')
+        return self._row(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._row(i)
+
+    def _row(self, i):
+        """Turn the given index back into a Row object
+        """
+        date = datetime.date.fromordinal(self.dates[i])
+        fields = (self.cents[i], self.exps[i], date,
+                  self._comments[self.comments[i]])
+        return make_row(Row, fields, {'_hashtag': self._tags[self.tags[i]]})
+
+    @property
+    def _valuekeys(self):
+        return zip(self.cents, self.exps)
+
+    @property
+    def value(self):
+        # ensure that values that have been promoted to have some digits
+        # of significance return to being simple integers when possible.
+        return money.normalise(self._total, self._exp)
+
+    @property
+    def count(self):
+        return len(self)
+
+    def _aggregate(self, total, exp, min_cents, max_cents):
+        """Add the given aggregates into the running aggregates
+        """
+        self._total += total
+        self._exp = min(self._exp, exp)
+        if self._min is None or min_cents < self._min:
+            self._min = min_cents
+        if self._max is None or max_cents > self._max:
+            self._max = max_cents
+
+    def _latest(self, i):
+        """Keep the index of the last row, given a newly added row
+        """
+        if self._last is None or self.dates[i] >= self.dates[self._last]:
+            self._last = i
+
+    def _append_row(self, row):
+        self.invalidate()
+        cents, exp = row.cents, row._exp
+
+        tag = row.hashtag
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = self._tag_ids[tag] = len(self._tags)
+            self._tags.append(tag)
+
+        comment_id = self._comment_ids.get(row.comment)
+        if comment_id is None:
+            comment_id = self._comment_ids[row.comment] = len(self._comments)
+            self._comments.append(row.comment)
+
+        self.cents.append(cents)
+        self.exps.append(exp)
+        self._aggregate(cents, exp, cents, cents)
+        self.dates.append(row.date.toordinal())
+        self._latest(len(self.dates) - 1)
+        self.directions.append(self._directions.index(row.direction))
+        self.tags.append(tag_id)
+        self.comments.append(comment_id)
+
+    def append(self, item):
+        if isinstance(item, Row):
+            self._append_row(item)
+        elif isinstance(item, (list, RowSet, ColumnarRowSet,
+                               types.GeneratorType)):
+            for entry in item:
+                self.append(entry)
+        else:
+            raise ValueError('dont know how to append {}'.format(item))
+
+    def _take(self, indexes, result=None):
+        """Return a new rowset with only the rows at the given indexes
+        """
+        if result is None:
+            result = ColumnarRowSet(_tables=self._tables())
+        result.invalidate()
+        start = len(result)
+        for name in ('cents', 'exps', 'dates', 'directions', 'tags',
+                     'comments'):
+            src = getattr(self, name)
+            getattr(result, name).extend(src[i] for i in indexes)
+
+        if len(result) > start:
+            cents = result.cents[start:]
+            result._aggregate(sum(cents), min(result.exps[start:]),
+                              min(cents), max(cents))
+            for i in range(start, len(result)):
+                result._latest(i)
+        return result
+
+    def _keys(self, field):
+        """Return the column that decides the given field, or the row index
+           for fields that can only be calculated from the whole row
+        """
+        name = self._columns.get(field)
+        if name is None:
+            return range(len(self))
+        return getattr(self, name)
+
+    def _memoised(self, field, func, counter=None):
+        """Calculate func(row) once for each distinct key of the field and
+           return the result for every row, counting the calculations in the
+           named instrument counter if one is given
+        """
+        return self._memoised_keys(self._keys(field), func, counter)
+
+    def _memoised_keys(self, keys, func, counter=None):
+        """Calculate func(row) once for each distinct key and return the
+           result for every row
+        """
+        memo = {}
+        result = []
+        for i, key in enumerate(keys):
+            try:
+                result.append(memo[key])
+            except KeyError:
+                memo[key] = func(self._row(i))
+                result.append(memo[key])
+        if counter is not None:
+            instrument.count(counter, len(memo))
+        return result
+
+    def filter(self, filter_strings):
+        """Apply the given list of human readable filters to the rows
+        """
+        if not filter_strings:
+            # Nothing would be removed, so share the columns (which may be
+            # a snapshot mapped from disk) rather than copying them
+            return self
+
+        keep = [True] * len(self)
+        for s in filter_strings:
+            field = parse_filter(s)[0]
+            predicate = compile_filter(s)
+
+            matches = self._memoised(field, predicate, 'filter evaluations')
+            for i, match in enumerate(matches):
+                if not match:
+                    keep[i] = False
+
+        return self._take([i for i, match in enumerate(keep) if match])
+
+    def autosplit(self):
+        """look at the split bangtag and return the rowset all split
+        """
+        result = ColumnarRowSet(_tables=self._tables())
+        may_split = self._memoised('comment', lambda row: '!' in row.comment)
+        for i, split in enumerate(may_split):
+            if split:
+                result.append(self._row(i).autosplit())
+            else:
+                self._take([i], result)
+        instrument.count('rows split', len(result) - len(self))
+        return result
+
+    def _pivot_index(self, label, fields):
+        """Number the labels and months of the rows for a Pivot, without
+           making a Row for each row.  The label must only depend on the
+           given fields, so that it can be worked out once for each distinct
+           combination of their columns.
+        """
+        keys = [self._keys(field) for field in fields]
+        if len(keys) == 1:
+            keys = keys[0]
+        else:
+            keys = zip(*keys)
+
+        tag_ids = {}
+        tag_index = self._memoised_keys(
+            keys, lambda row: tag_ids.setdefault(label(row), len(tag_ids)))
+        month_ids = {}
+        month_index = self._memoised_keys(
+            self.dates,
+            lambda row: month_ids.setdefault(row.month_key, len(month_ids)))
+        return (tag_ids, array('i', tag_index),
+                month_ids, array('i', month_index))
+
+    def _build_groups(self, field):
+        if field == 'month':
+            # See the matching hack in RowSet._build_groups()
+            def func(row):
+                return row.month_key
+        else:
+            def func(row):
+                return row._getvalue(field)
+
+        indexes = {}
+        for i, key in enumerate(self._memoised(field, func)):
+            if key is None:
+                key = 'unknown'
+            indexes.setdefault(key, []).append(i)
+
+        result = {}
+        for key, group in indexes.items():
+            result[key] = self._take(group)
+        return result
+
+    def last(self):
+        """Return the chronologically last row from the rowset
+        """
+        # The same row as a stable sort by date would put last, kept up to
+        # date as the rows are added
+        if self._last is None:
+            raise IndexError('no rows in the rowset')
+        return self._row(self._last)
@@ -0,0 +1,204 @@
+# Licensed under GPLv3
+import operator
+import fractions
+import decimal
+import math
+import re
+
+from row import Row
+
+
+# The human readable filters (eg: "value>50" or "comment=~#tag") that
+# choose the rows.  Only the runs that filter import this module
+
+
+def parse_filter(string):
+    """Split a human readable filter into its field, operation and the value
+       to match against
+    """
+    # its not a real tokeniser, its just a RE. so, now I have two problems
+    m = re.match("([a-z0-9_]+)([=!<>~]{1,2})(.*)", string, re.I)
+    if not m:
+        raise ValueError('filters must be <key><op><value>')
+
+    field = m.group(1)
+    op = m.group(2)
+    value_match = m.group(3)
+
+    # coerce our value to match into a number, if that looks possible
+    try:
+        value_match = float(value_match)
+    except ValueError:
+        pass
+
+    return field, op, value_match
+
+
+def match_filter(op, value_now, value_match):
+    """Apply one filter operation to a simple value, returning True if the
+       value matches
+    """
+    if op == '==':
+        return value_now == value_match
+    elif op == '!=':
+        return value_now != value_match
+    elif op == '>':
+        return value_now > value_match
+    elif op == '<':
+        return value_now < value_match
+    elif op == '=~':
+        return bool(re.search(value_match, value_now, re.I))
+    elif op == '!~':
+        return not re.search(value_match, value_now, re.I)
+
+    raise ValueError('Unknown filter operation "{}"'.format(op))
+
+
+# The operations that are a simple comparison
+_compare_ops = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+}
+
+# The fields that are always already a simple number or string
+_simple_fields = {
+    'value': decimal.Decimal,
+    'comment': str,
+    'month': str,
+    'direction': str,
+    'rel_months': int,
+}
+
+
+def _compile_getter(field):
+    """Return a function that gets the simple value of the field from a row,
+       deciding once how to do that instead of on every row
+    """
+    attr = getattr(Row, field, None)
+
+    if isinstance(attr, property) or field in Row.__slots__:
+        get = operator.attrgetter(field)
+    elif callable(attr):
+        get = operator.methodcaller(field)
+    else:
+        # Let the row raise its usual error when this is used
+        return lambda row: row._getvalue_simple(field)
+
+    if field in _simple_fields:
+        return get
+
+    def getter(row):
+        attr = get(row)
+        if isinstance(attr, (int, str, decimal.Decimal)):
+            return attr
+        return str(attr)
+    return getter
+
+
+def is_finite(number):
+    """Return True if the number is neither infinite nor NaN
+    """
+    return not (math.isinf(number) or math.isnan(number))
+
+
+def cents_limit(op, value_match):
+    """Return the whole number of cents that the cents of a row can be
+       compared with, to give the same result as comparing the Decimal value
+       with the given number, or None when no whole number of cents can ever
+       be equal to it
+    """
+    limit = fractions.Fraction(value_match) * 100
+
+    if op in ('==', '!='):
+        if limit.denominator != 1:
+            return None
+        return int(limit)
+
+    if op == '>':
+        return int(math.floor(limit))
+    return int(math.ceil(limit))
+
+
+def _compile_cents(op, value_match):
+    """Return a predicate comparing the value of a row with a number, using
+       the integer cents of the row so that no Decimal is ever made.  The
+       number is converted exactly, so the result is the same as comparing
+       the Decimal value
+    """
+    limit = cents_limit(op, value_match)
+
+    if limit is None:
+        return lambda row: op == '!='
+    if op == '==':
+        return lambda row: row.cents == limit
+    if op == '!=':
+        return lambda row: row.cents != limit
+    if op == '>':
+        return lambda row: row.cents > limit
+    return lambda row: row.cents < limit
+
+
+def compile_filter(string):
+    """Parse a human readable filter once and return a predicate function
+       that checks if a row matches it
+    """
+    field, op, value_match = parse_filter(string)
+    get = _compile_getter(field)
+
+    if op in _compare_ops:
+        compare = _compare_ops[op]
+
+        if isinstance(value_match, float):
+            simple = _simple_fields.get(field)
+            if simple is decimal.Decimal:
+                if field == 'value' and is_finite(value_match):
+                    return _compile_cents(op, value_match)
+                # An exact conversion, so the comparison is unchanged
+                value_match = decimal.Decimal(value_match)
+            elif simple is int and value_match.is_integer():
+                value_match = int(value_match)
+
+        def predicate(row):
+            return compare(get(row), value_match)
+
+    elif op in ('=~', '!~') and isinstance(value_match, str):
+        search = re.compile(value_match, re.I).search
+
+        if op == '=~':
+            def predicate(row):
+                return search(get(row)) is not None
+        else:
+            def predicate(row):
+                return search(get(row)) is None
+
+    elif op in ('=~', '!~'):
+        # Not a valid pattern, leave it to raise the usual errors
+        def predicate(row):
+            return match_filter(op, get(row), value_match)
+
+    else:
+        raise ValueError('Unknown filter operation "{}"'.format(op))
+
+    return predicate
+
+
+def compile_filters(filter_strings):
+    """Compile a list of human readable filters into one predicate function
+       that checks if a row matches all of them
+    """
+    predicates = [compile_filter(s) for s in filter_strings or []]
+
+    if not predicates:
+        return lambda row: True
+
+    if len(predicates) == 1:
+        return predicates[0]
+
+    def predicate(row):
+        for match in predicates:
+            if not match(row):
+                return False
+        return True
+    return predicate
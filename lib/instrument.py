@@ -0,0 +1,127 @@
+# Licensed under GPLv3
+import time
+
+
+# Nothing is recorded unless this is set with enable(), so that the calls
+# left in the code cost no more than a function call when not profiling
+enabled = False
+
+# The total seconds and number of calls of each named phase
+timers = {}
+# The named counters, eg: "rows parsed"
+counters = {}
+# The names of the phases, in the order that they were first started
+_order = []
+
+
+class _Phase(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.start
+        if self.name not in timers:
+            timers[self.name] = [0.0, 0]
+        timers[self.name][0] += elapsed
+        timers[self.name][1] += 1
+        return False
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_no_phase = _NoPhase()
+
+
+def enable(on=True):
+    """Start (or stop) recording, forgetting anything recorded so far
+    """
+    global enabled
+    enabled = on
+    timers.clear()
+    counters.clear()
+    del _order[:]
+
+
+def phase(name):
+    """Return a context manager that adds the time spent inside it to the
+       named phase
+    """
+    if not enabled:
+        return _no_phase
+    if name not in _order:
+        _order.append(name)
+    return _Phase(name)
+
+
+def count(name, n=1):
+    """Add n to the named counter
+    """
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+
+class CountingWriter(object):
+    """Pass writes on to a file, counting the bytes in "render bytes"
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, data):
+        count('render bytes', len(data))
+        return self.f.write(data)
+
+
+def writer(f):
+    """Return the file f, wrapped to count what is written to it when
+       recording
+    """
+    if not enabled:
+        return f
+    return CountingWriter(f)
+
+
+def results():
+    """Return everything recorded as a dict, ready to be written as JSON
+    """
+    phases = []
+    for name in _order:
+        seconds, calls = timers.get(name, (0.0, 0))
+        phases.append({
+            'name': name,
+            'seconds': round(seconds, 6),
+            'calls': calls,
+        })
+    return {
+        'phases': phases,
+        'counters': dict(counters),
+    }
+
+
+def render():
+    """Return everything recorded as a human readable table
+    """
+    data = results()
+    width = max([len(x['name']) for x in data['phases']] +
+                [len(x) for x in data['counters']] + [5])
+
+    s = []
+    s.append('{:<{}} {:>10} {:>6}'.format('Phase', width, 'Seconds', 'Calls'))
+    for entry in data['phases']:
+        s.append('{:<{}} {:>10.4f} {:>6}'.format(
+            entry['name'], width, entry['seconds'], entry['calls']))
+    s.append('')
+    s.append('{:<{}} {:>10}'.format('Counter', width, 'Count'))
+    for name in sorted(data['counters']):
+        s.append('{:<{}} {:>10}'.format(name, width, data['counters'][name]))
+    return '\n'.join(s) + '\n'
@@ -0,0 +1,43 @@
+# Licensed under GPLv3
+import importlib
+
+try:
+    from importlib.util import find_spec
+except ImportError:  # pragma: no cover
+    # python 2
+    import imp
+
+    def find_spec(name):
+        try:
+            imp.find_module(name)
+        except ImportError:
+            return None
+        return True
+
+
+class LazyModule(object):
+    """Stand in for a module, importing it when one of its attributes is
+       first used
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self._name)
+
+
+def optional(name):
+    """Return the named module, to be imported when it is first used, or
+       None if it is not installed.  This is for modules that take longer
+       to import than the simpler subcommands take to run, eg: numpy
+    """
+    if find_spec(name) is None:
+        return None
+    return LazyModule(name)
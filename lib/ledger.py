@@ -0,0 +1,143 @@
+# Licensed under GPLv3
+import os.path
+import sys
+import os
+import re
+
+from rowset import RowSet
+
+
+# The names of the accounting files, eg: "incoming-2018-02"
+_is_ledger_file = re.compile(r'^(incoming|outgoing)-\d{4}-\d{2}').match
+
+
+def ledger_files(dirname):
+    """Return the accounting filenames found in dirname, in a stable order
+    """
+    filenames = []
+    for filename in sorted(os.listdir(dirname)):
+        if filename.startswith('.'):
+            # Hidden files, eg: the sidecar kept by partition.py
+            continue
+        if not _is_ledger_file(filename):
+            sys.stderr.write(
+                'Filename "{}" not valid, put into proper accounting file\n'
+                .format(filename))
+            continue
+        filenames.append(filename)
+    return filenames
+
+
+def _concat(rowsets):
+    """Return one RowSet with the rows of all the given rowsets, taking its
+       aggregates from theirs instead of from the rows
+    """
+    result = RowSet()
+    for rowset in rowsets:
+        result.rows.extend(rowset.rows)
+        result._aggregate(rowset._sum, rowset._exp, rowset._count,
+                          rowset._min, rowset._max, rowset._last)
+    return result
+
+
+class Ledger(RowSet):
+    """The rows of all the accounting files in a directory, kept as one
+       RowSet for each file so that a changed file can be parsed again on
+       its own with update().
+
+       A ledger is never changed once it is made.  update() returns a new
+       ledger that shares every file and month that did not change with
+       this one, so the totals, the group_by() indexes and the pivot() grid
+       are only worked out again for the months that the changed files
+       have rows in.
+    """
+
+    def __init__(self, dirname, parse, prepare=None, _files=None,
+                 _months=None, _changed=None):
+        """The rows of each file are found with parse(pathname), and then
+           passed as a RowSet to prepare(rows) when given, which returns the
+           rows to keep (eg: split and filtered)
+        """
+        RowSet.__init__(self)
+        self.dirname = dirname
+        self.parse = parse
+        self.prepare = prepare
+
+        if _files is None:
+            _files = {}
+            for filename in ledger_files(dirname):
+                _files[filename] = self._load_file(filename)
+        self._files = _files
+        self._filenames = sorted(_files)
+
+        whole = _concat(self._files[filename] for filename in self._filenames)
+        self.rows = whole.rows
+        self._aggregate(whole._sum, whole._exp, whole._count, whole._min,
+                        whole._max, whole._last)
+
+        # The month index is kept from one ledger to the next, as its
+        # RowSets hold the pivot of each month
+        months = {}
+        if _months is not None:
+            months.update(_months)
+        if _changed is None:
+            _changed = set()
+            for filename in self._filenames:
+                _changed.update(self._file_groups(filename, 'month'))
+        for month in _changed:
+            months.pop(month, None)
+            groups = [self._file_groups(filename, 'month').get(month)
+                      for filename in self._filenames]
+            groups = [group for group in groups if group is not None]
+            if groups:
+                months[month] = _concat(groups)
+        self._groups['month'] = months
+
+    def _load_file(self, filename):
+        rows = RowSet()
+        rows.append(self.parse(os.path.join(self.dirname, filename)))
+        if self.prepare is not None:
+            rows = self.prepare(rows)
+        return rows
+
+    def _file_groups(self, filename, field):
+        return self._files[filename].group_by(field)
+
+    def update(self, filenames):
+        """Return a new ledger with the given files parsed again, or left
+           out if they no longer exist.  Any other filenames are ignored.
+        """
+        files = dict(self._files)
+        changed = set()
+        for filename in filenames:
+            if filename in files:
+                changed.update(files.pop(filename).group_by('month'))
+
+            pathname = os.path.join(self.dirname, filename)
+            if _is_ledger_file(filename) and os.path.isfile(pathname):
+                files[filename] = self._load_file(filename)
+                changed.update(files[filename].group_by('month'))
+
+        return Ledger(self.dirname, self.parse, self.prepare, _files=files,
+                      _months=self.group_by('month'), _changed=changed)
+
+    def _build_groups(self, field):
+        # Join together the groups of each file, the files that did not
+        # change keep their groups from the last ledger
+        groups = {}
+        for filename in self._filenames:
+            for key, rows in self._file_groups(filename, field).items():
+                groups.setdefault(key, []).append(rows)
+
+        return dict((key, _concat(rows)) for key, rows in groups.items())
+
+    def pivot(self, label=None):
+        """Return the Pivot of the rows, which is made from the pivots of
+           each month so that only the months that changed are looked at
+        """
+        if label not in self._pivots:
+            from pivot import Pivot
+            months = self.group_by('month')
+            self._pivots[label] = Pivot.merge(
+                months[month].pivot(label) for month in sorted(months))
+        return self._pivots[label]
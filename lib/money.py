@@ -0,0 +1,89 @@
+# Licensed under GPLv3
+from array import array
+import decimal
+import re
+
+# Money is handled as a whole number of cents, along with the number of
+# decimal places it was written with (as a Decimal exponent of 0, -1 or -2).
+# The places are kept only so that the value renders exactly as it would
+# have done as a Decimal, the arithmetic is all done on the integer cents.
+
+# The array typecode for a column of cents.  Python 2 has no 'q', where a
+# 'l' is 64 bits wide that will do, and failing that a double still holds
+# every cent up to 2**53 exactly.
+try:
+    cents_typecode = array('q').typecode
+except ValueError:  # pragma: no cover
+    cents_typecode = 'l' if array('l').itemsize >= 8 else 'd'
+
+# The simple way that values are written in the accounting files
+_simple = re.compile(r'([0-9]+)(?:\.([0-9]{1,2}))?$')
+
+
+def from_string(string):
+    """Convert a written value into cents and decimal places
+    """
+    m = _simple.match(string)
+    if not m:
+        return from_decimal(decimal.Decimal(string))
+
+    whole, fraction = m.groups()
+    if fraction is None:
+        return int(whole) * 100, 0
+
+    cents = int(whole) * 100 + int(fraction) * (10 ** (2 - len(fraction)))
+    return cents, -len(fraction)
+
+
+def from_decimal(value):
+    """Convert a Decimal into cents and decimal places
+    """
+    if not value.is_finite():
+        raise ValueError('Value "{}" is not a number'.format(value))
+
+    cents = value.scaleb(2)
+    if cents != cents.to_integral_value():
+        raise ValueError('Value "{}" has a fraction of a cent'.format(value))
+
+    exp = min(0, max(-2, value.as_tuple().exponent))
+    return int(cents), exp
+
+
+def from_value(value):
+    """Convert any of the types a value might be given as into cents and
+       decimal places
+    """
+    if isinstance(value, str):
+        return from_string(value)
+    if isinstance(value, int):
+        return value * 100, 0
+    if not isinstance(value, decimal.Decimal):
+        value = decimal.Decimal(value)
+    return from_decimal(value)
+
+
+def to_decimal(cents, exp):
+    """Convert cents back into a Decimal written with the same places
+    """
+    scale = 10 ** (2 + exp)
+    return decimal.Decimal(cents // scale).scaleb(exp)
+
+
+def normalise(cents, exp):
+    """Convert cents into a Decimal, but as a simple integer when there are
+       no cents to show
+    """
+    if cents % 100 == 0:
+        return decimal.Decimal(cents // 100)
+    return to_decimal(cents, exp)
+
+
+def split(cents, count):
+    """Divide the cents into count shares of whole units, rounding towards
+       zero so that no money is invented, and return the share and the
+       remainder that was lost to the rounding
+    """
+    each = abs(cents) // (100 * count) * 100
+    if cents < 0:
+        each = -each
+    return each, cents - each * count
@@ -0,0 +1,233 @@
+# Licensed under GPLv3
+import hashlib
+import json
+import os
+
+from row import month_ordinal, month_date, get_now
+from filters import parse_filter, match_filter
+import instrument
+
+
+def _load_sidecar(pathname, version):
+    """Return the data kept in a sidecar file, or an empty dict if there is
+       none or it was written by another version
+    """
+    try:
+        with open(pathname) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get('version') != version:
+        return {}
+    return data
+
+
+def _save_sidecar(pathname, data):
+    """Write the data to a sidecar file, returning False if it could not be
+    """
+    # Only needed when something has changed, which is not the usual case
+    import tempfile
+
+    # Write to a temp file and rename it into place, so that a concurrent
+    # reader never sees a half written sidecar
+    try:
+        fd, tmpname = tempfile.mkstemp(prefix='.',
+                                       dir=os.path.dirname(pathname))
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(data))
+        os.rename(tmpname, pathname)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def _sidecar_path(cache_dir, name, dirname):
+    """Return where to keep a sidecar about the files in dirname, in the
+       cache directory, or None when there is no cache directory.  These
+       are never written into the directory of the accounting files.
+    """
+    if cache_dir is None:
+        return None
+    key = hashlib.sha1(os.path.abspath(dirname).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, '{}-{}'.format(name, key[:16]))
+
+
+def _file_stat(pathname):
+    """Return what is kept to tell if a file has changed: its size and
+       mtime, and a hash of its contents for the changes that leave those
+       the same (as RowCache.fingerprint() does)
+    """
+    stat = os.stat(pathname)
+    with open(pathname, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return [stat.st_size, stat.st_mtime, digest]
+
+
+def _span(rows):
+    """Return the first and last date (as "YYYY-MM-DD") and the directions
+       of the given rows, or None when there are none
+    """
+    dates = [row.date for row in rows]
+    if not dates:
+        return None
+    return {
+        'dates': [min(dates).isoformat(), max(dates).isoformat()],
+        'directions': sorted(set(row.direction for row in rows)),
+    }
+
+
+def _split(rows):
+    for row in rows:
+        if '!' in row.comment:
+            for child in row.autosplit():
+                yield child
+        else:
+            yield row
+
+
+def _months(span):
+    """Return the month ordinal of each month in the span
+    """
+    first, last = [int(x[0:4]) * 12 + int(x[5:7]) for x in span['dates']]
+    return range(first, last + 1)
+
+
+def _may_match(span, field, op, value_match):
+    """Return False if none of the rows in the span can match the filter,
+       or True if some might (or if that cannot be told from the span)
+    """
+    if field == 'direction':
+        values = span['directions']
+    elif field == 'month':
+        values = [month_date(x).strftime('%Y-%m') for x in _months(span)]
+    elif field == 'month_ordinal':
+        values = _months(span)
+    elif field == 'rel_months':
+        now = month_ordinal(get_now())
+        values = [x - now for x in _months(span)]
+    elif field == 'date' and isinstance(value_match, str):
+        # The dates are compared as strings, so only the ends of the span
+        # need to be looked at
+        first, last = span['dates']
+        if op == '==':
+            return first <= value_match <= last
+        if op == '<':
+            return first < value_match
+        if op == '>':
+            return last > value_match
+        return True
+    else:
+        return True
+
+    for value in values:
+        try:
+            if match_filter(op, value, value_match):
+                return True
+        except Exception:
+            # Let the filter on the rows raise its usual error
+            return True
+    return False
+
+
+class Partitions(object):
+    """Decide which accounting files need to be parsed at all for a list of
+       filters.
+
+       The span of dates and the directions of the rows in each file, as
+       they are or (when split is set) as autosplit() would make them, are
+       kept in a small sidecar file in the cache directory.  Without one
+       they are only kept for this run, and the files are told apart by
+       their size and mtime alone, as they are not hashed for nothing.  A
+       file that has changed since its span was kept is always parsed, and
+       its span then kept again.
+    """
+
+    # Change this whenever the sidecar changes, an older one is ignored
+    version = 3
+
+    sidecar = 'partitions'
+
+    def __init__(self, dirname, split=False, cache_dir=None):
+        self.dirname = dirname
+        self.split = split
+        self.pathname = _sidecar_path(cache_dir, self.sidecar, dirname)
+        self.changed = False
+        # The stat of each file, only worked out once for each run
+        self._stats = {}
+
+        data = {}
+        if self.pathname is not None:
+            data = _load_sidecar(self.pathname, self.version)
+        self.files = data.get('files', {})
+
+    def stat(self, filename):
+        """Return what is kept to tell if the file has changed, see
+           _file_stat()
+        """
+        if filename not in self._stats:
+            pathname = os.path.join(self.dirname, filename)
+            if self.pathname is not None:
+                self._stats[filename] = _file_stat(pathname)
+            else:
+                stat = os.stat(pathname)
+                self._stats[filename] = [stat.st_size, stat.st_mtime]
+        return self._stats[filename]
+
+    def current(self, filename):
+        """Return the kept stat and spans of the file, if it has not changed
+           since, or None
+        """
+        entry = self.files.get(filename)
+        if entry is None or entry['stat'] != self.stat(filename):
+            return None
+        return entry
+
+    def record(self, filename, rows):
+        """Keep the spans of the rows parsed from the given file
+        """
+        entry = self.current(filename)
+        if entry is None:
+            entry = self.files[filename] = {
+                'stat': self.stat(filename),
+                'rows': _span(rows),
+            }
+            self.changed = True
+        if self.split and 'split' not in entry:
+            # only worked out when the rows are being split anyway
+            entry['split'] = _span(list(_split(rows)))
+            self.changed = True
+
+    def prune(self, filenames, filter_strings):
+        """Return the filenames that could have rows matching all of the
+           filters, once split when asked for, counting the others in the
+           "files pruned" instrument counter
+        """
+        kind = 'split' if self.split else 'rows'
+        filters = [parse_filter(s) for s in filter_strings or []]
+        if not filters:
+            return list(filenames)
+
+        result = []
+        for filename in filenames:
+            entry = self.current(filename)
+            if entry is not None and kind in entry:
+                span = entry[kind]
+                if span is None:
+                    # No rows at all, so nothing to match
+                    continue
+                if not all(_may_match(span, *f) for f in filters):
+                    continue
+            result.append(filename)
+
+        instrument.count('files pruned', len(filenames) - len(result))
+        return result
+
+    def save(self):
+        """Write the sidecar, if any of the spans have changed
+        """
+        if not self.changed or self.pathname is None:
+            return
+        # A read only directory just means nothing is pruned next time
+        if _save_sidecar(self.pathname,
+                         {'version': self.version, 'files': self.files}):
+            self.changed = False
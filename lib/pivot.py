@@ -0,0 +1,227 @@
+# Licensed under GPLv3
+from array import array
+
+import money
+import lazy
+
+# Only imported when the first pivot is made, see lazy.py
+numpy = lazy.optional('numpy')
+
+
+def _hashtag(row):
+    hashtag = row.hashtag
+    if hashtag is None:
+        hashtag = 'unknown'
+    return hashtag
+
+
+# The row fields that the label depends on, see Pivot()
+_hashtag.fields = ('hashtag',)
+
+
+class Pivot(object):
+    """Sum a rowset into a dense table with one line for each tag and one
+       column for each month, along with the totals for each month and the
+       running balance.
+
+       The rows are only looked at once.  The sums are kept in integer cents
+       (see money.py) using numpy when it is installed, or plain arrays when
+       it is not, and only turned into Decimals when they are asked for.
+    """
+
+    def __init__(self, rows, label=None):
+        """The label function decides the tag for each row, by default it is
+           the hashtag (or 'unknown' when there is none).  A label can have a
+           "fields" attribute listing the only row fields it looks at, which
+           lets columnar rows be labelled without making each Row.
+        """
+        if label is None:
+            label = _hashtag
+
+        fields = getattr(label, 'fields', None)
+        if fields is not None and hasattr(rows, '_pivot_index'):
+            # Columnar rows can number the labels straight from their
+            # columns, when the label says which fields it looks at
+            (tag_ids, tag_index,
+             month_ids, month_index) = rows._pivot_index(label, fields)
+            cents = rows.cents
+            exps = rows.exps
+        else:
+            (tag_ids, tag_index, month_ids, month_index,
+             cents, exps) = self._read_rows(rows, label)
+
+        tag_order, month_order = self._order(tag_ids, month_ids)
+
+        shape = (len(self.tags), len(self.months))
+        if numpy is not None and len(cents):
+            self._sum_numpy(shape,
+                            numpy.array(tag_order)[numpy.asarray(tag_index)],
+                            numpy.array(month_order)[
+                                numpy.asarray(month_index)],
+                            numpy.asarray(cents), numpy.asarray(exps))
+        else:
+            self._sum_arrays(shape, [tag_order[i] for i in tag_index],
+                             [month_order[i] for i in month_index],
+                             cents, exps)
+
+        self._totals()
+
+    @staticmethod
+    def _read_rows(rows, label):
+        """The single pass, numbering the tags and months as they are found
+        """
+        tag_ids = {}
+        month_ids = {}
+        tag_index = array('i')
+        month_index = array('i')
+        cents = array(money.cents_typecode)
+        exps = array('b')
+        for row in rows:
+            tag = label(row)
+            tag_id = tag_ids.get(tag)
+            if tag_id is None:
+                tag_id = tag_ids[tag] = len(tag_ids)
+
+            month = row.month_key
+            month_id = month_ids.get(month)
+            if month_id is None:
+                month_id = month_ids[month] = len(month_ids)
+
+            tag_index.append(tag_id)
+            month_index.append(month_id)
+            cents.append(row.cents)
+            exps.append(row._exp)
+        return tag_ids, tag_index, month_ids, month_index, cents, exps
+
+    @classmethod
+    def merge(cls, pivots):
+        """Combine the pivots of several rowsets into the pivot that their
+           rows would make together.  Only the cells are looked at, so when
+           each pivot is of a single month this is much cheaper than going
+           over the rows again.
+        """
+        self = cls.__new__(cls)
+
+        cells = []
+        tag_ids = {}
+        month_ids = {}
+        for pivot in pivots:
+            for i, tag in enumerate(pivot.tags):
+                tag_id = tag_ids.setdefault(tag, len(tag_ids))
+                for j, month in enumerate(pivot.months):
+                    count = int(pivot._counts[i][j])
+                    if not count:
+                        continue
+                    month_id = month_ids.setdefault(month, len(month_ids))
+                    cells.append((tag_id, month_id, int(pivot._cents[i][j]),
+                                  int(pivot._exps[i][j]), count))
+
+        tag_order, month_order = self._order(tag_ids, month_ids)
+        tags, months, cents, exps, counts = list(zip(*cells)) or [()] * 5
+        self._sum_arrays((len(self.tags), len(self.months)),
+                         [tag_order[i] for i in tags],
+                         [month_order[i] for i in months],
+                         cents, exps, counts)
+
+        self._totals()
+        return self
+
+    def _order(self, tag_ids, month_ids):
+        """Sort the tags and months found, returning the mappings from the
+           order they were found in to the sorted order, so the table is in
+           display order
+        """
+        self.tags = sorted(tag_ids)
+        self.months = sorted(month_ids)
+
+        tag_order = [0] * len(tag_ids)
+        for i, tag in enumerate(self.tags):
+            tag_order[tag_ids[tag]] = i
+        month_order = [0] * len(month_ids)
+        for i, month in enumerate(self.months):
+            month_order[month_ids[month]] = i
+        self._tag_ids = dict((tag, i) for i, tag in enumerate(self.tags))
+        return tag_order, month_order
+
+    def _sum_numpy(self, shape, tags, months, cents, exps):
+        cells = (tags, months)
+        self._cents = numpy.zeros(shape, dtype=numpy.int64)
+        numpy.add.at(self._cents, cells, cents)
+        self._exps = numpy.zeros(shape, dtype=numpy.int8)
+        numpy.minimum.at(self._exps, cells, exps)
+        self._counts = numpy.zeros(shape, dtype=numpy.int64)
+        numpy.add.at(self._counts, cells, 1)
+
+        self._month_cents = [int(x) for x in self._cents.sum(axis=0)]
+        self._month_exps = [int(x) for x in self._exps.min(axis=0)]
+
+    def _sum_arrays(self, shape, tags, months, cents, exps, counts=None):
+        nr_tags, nr_months = shape
+        self._cents = [array(money.cents_typecode, [0] * nr_months)
+                       for _ in range(nr_tags)]
+        self._exps = [array('b', [0] * nr_months) for _ in range(nr_tags)]
+        self._counts = [array(money.cents_typecode, [0] * nr_months)
+                        for _ in range(nr_tags)]
+
+        if counts is None:
+            counts = [1] * len(cents)
+        for tag, month, value, exp, count in zip(tags, months, cents, exps,
+                                                 counts):
+            self._cents[tag][month] += value
+            if exp < self._exps[tag][month]:
+                self._exps[tag][month] = exp
+            self._counts[tag][month] += count
+
+        self._month_cents = [int(sum(column)) for column in zip(*self._cents)]
+        self._month_exps = [min(column) for column in zip(*self._exps)]
+        if not nr_tags:
+            self._month_cents = []
+            self._month_exps = []
+
+    def _totals(self):
+        """Work out the totals for each month, the running balance and the
+           grand total, rendering them the same way as RowSet.value would
+        """
+        self.month_totals = []
+        self.running_totals = []
+
+        running = 0
+        running_exp = 0
+        for cents, exp in zip(self._month_cents, self._month_exps):
+            total = money.normalise(cents, exp)
+            self.month_totals.append(total)
+
+            # The running balance is a sum of the rendered month totals, so
+            # it keeps any places that they have
+            running += cents
+            running_exp = min(running_exp, total.as_tuple().exponent)
+            self.running_totals.append(money.to_decimal(running, running_exp))
+
+        self.total = money.normalise(running, min(self._month_exps or [0]))
+
+    def cell(self, tag, month_index):
+        """Return the sum for the tag in the given month column, or None if
+           there were no rows for it
+        """
+        i = self._tag_ids[tag]
+        if not self._counts[i][month_index]:
+            return None
+        return money.normalise(int(self._cents[i][month_index]),
+                               int(self._exps[i][month_index]))
+
+    def line(self, tag):
+        """Return the sums for the tag in every month column
+        """
+        return [self.cell(tag, i) for i in range(len(self.months))]
+
+    def grid(self):
+        """Return the sums as nested dicts of {tag: {month: {'sum': value}}},
+           leaving out the months that have no rows for a tag
+        """
+        grid = {}
+        for tag in self.tags:
+            grid[tag] = {}
+            for month, value in zip(self.months, self.line(tag)):
+                if value is not None:
+                    grid[tag][month] = {'sum': value}
+        return grid
@@ -1,26 +1,201 @@
 # Licensed under GPLv3
-from collections import namedtuple
 import datetime
 import calendar
 import decimal
 import re
 
+try:
+    # The same as threading.local, without importing all of threading
+    from _thread import _local as _thread_local  # python 3
+except ImportError:  # pragma: no cover
+    from thread import _local as _thread_local  # python 2
+
+import money
+
 
 # TODO
-# - make Row take Date objects and not strings with dates, removing a string
-#   handling fart from Row.autosplit() and removing external formatting
-#   knowledge from Row
 # - The "!months:[offset:]count" tag is perhaps a little awkward, find a
 #   more obvious format (perhaps "!months=month[,month]+" - which is clearly
 #   a more discoverable format, but would get quite verbose with yearly
 #   transactions (or even just one with more than 3 months...)
 
 
-class Row(namedtuple('Row', ('value', 'date', 'comment'))):
+# Every date seen so far, so that all the rows on the same day share one
+# date object.  Looked up by both the date and its written form, which
+# lets parse_date() skip all the parsing for a date it has seen before.
+# It is only a cache, so once it holds _dates_limit entries (which a long
+# running server reloading the files would otherwise keep adding to) it is
+# emptied and starts again
+_dates = {}
+_dates_limit = 100000
+
+
+def _remember_date(key, date):
+    if len(_dates) >= _dates_limit:
+        _dates.clear()
+    _dates[key] = date
+
+
+def intern_date(date):
+    """Return the shared date object equal to the given date
+    """
+    try:
+        return _dates[date]
+    except KeyError:
+        _remember_date(date, date)
+        return date
+
+
+def parse_date(string):
+    """Turn a written "YYYY-MM-DD" date into a shared date object
+    """
+    try:
+        return _dates[string]
+    except KeyError:
+        pass
+
+    s = string.strip()
+    if (len(s) == 10 and s[4] == '-' and s[7] == '-' and
+            s[0:4].isdigit() and s[5:7].isdigit() and s[8:10].isdigit()):
+        date = datetime.date(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+    else:
+        # Not the fixed width format, but strptime might still accept it
+        date = datetime.datetime.strptime(s, "%Y-%m-%d").date()
+
+    date = intern_date(date)
+    _remember_date(string, date)
+    return date
+
+
+def month_ordinal(date):
+    """Number the month of the given date, so that the difference between
+       two of these is the number of months between them
+    """
+    return date.year * 12 + date.month
+
+
+def month_date(ordinal):
+    """Return the first day of the month with the given month ordinal
+    """
+    year, month = divmod(ordinal - 1, 12)
+    return intern_date(datetime.date(year, month + 1, 1))
+
+
+# The date that relative months are measured from.  This is decided once
+# for each run, so that every row (and every filter) agrees on it
+_now = None
+_now_month = None
+
+# The date (and its month ordinal) that a thread is using instead, see
+# NowScope
+_local_now = _thread_local()
+
+
+def decide_now(date=None):
+    """Return the reference date for the given "YYYY-MM-DD" string (or
+       date), defaulting to today
+    """
+    if date is None:
+        return datetime.datetime.now().date()
+    if not isinstance(date, datetime.date):
+        return parse_date(date)
+    return date
+
+
+def set_now(date=None):
+    """Set the reference date for the rest of this run, defaulting to today
+    """
+    global _now, _now_month
+    date = decide_now(date)
+    _now = date
+    _now_month = month_ordinal(date)
+
+
+def _get_now():
+    """Return the reference date and its month ordinal
+    """
+    local = getattr(_local_now, 'now', None)
+    if local is not None:
+        return local
+    if _now is None:
+        set_now()
+    return _now, _now_month
+
+
+def get_now():
+    """Return the reference date, deciding it on first use if nobody has
+       set it yet
+    """
+    return _get_now()[0]
+
+
+class NowScope(object):
+    """Use the given date as the reference date in the current thread only,
+       while in a "with" block.  This lets each of the server threads keep
+       to the date that the rows it is using were loaded at, while another
+       thread loads them again
+    """
+
+    def __init__(self, date):
+        self.now = None
+        if date is not None:
+            self.now = (date, month_ordinal(date))
+
+    def __enter__(self):
+        self.previous = getattr(_local_now, 'now', None)
+        if self.now is not None:
+            _local_now.now = self.now
+        return self
+
+    def __exit__(self, *exc_info):
+        _local_now.now = self.previous
+
+
+# The "YYYY-MM" string for each month ordinal that has been used
+_month_names = {}
+
+
+def make_row(cls, fields, memo=None):
+    """Make a row from fields that have already been checked, used to
+       unpickle rows and to derive new rows without parsing anything again
+    """
+    obj = object.__new__(cls)
+    obj.cents, obj._exp, date, obj.comment = fields
+    obj.date = intern_date(date)
+    if memo:
+        for name, value in memo.items():
+            setattr(obj, name, value)
+    return obj
+
 
-    def __new__(cls, value, date, comment, direction):
-        value = decimal.Decimal(value)
-        date = datetime.datetime.strptime(date.strip(), "%Y-%m-%d").date()
+class Row(object):
+    """A single transaction.
+
+       Only the value, date and comment are stored when the row is created,
+       everything else is calculated from them the first time it is asked
+       for and then remembered in one of the underscore slots.
+
+       The value is stored as a whole number of cents (see money.py) and is
+       only turned into a Decimal when it is asked for.  The date can be
+       given as a date object or written as "YYYY-MM-DD".
+    """
+
+    __slots__ = ('cents', '_exp', 'date', 'comment',
+                 '_hashtag', '_bangtag', '_month_key', '_month_ordinal',
+                 '_direction')
+
+    _fields = ('value', 'date', 'comment')
+    _memo = ('_hashtag', '_bangtag', '_month_key', '_month_ordinal',
+             '_direction')
+
+    def __init__(self, value, date, comment, direction):
+        cents, exp = money.from_value(value)
+        if isinstance(date, datetime.datetime):
+            date = intern_date(date.date())
+        elif isinstance(date, datetime.date):
+            date = intern_date(date)
+        else:
+            date = parse_date(date)
 
         if direction not in ('incoming', 'outgoing', 'signed'):
             raise ValueError('Direction "{}" unhandled'.format(direction))
@@ -29,21 +204,68 @@ class Row(namedtuple('Row', ('value', 'date', 'comment'))):
             # If the direction is not 'signed', we use the direction
             # field as the sign, so it is impossible to have a negative
             # value - check that here
-            if value < 0:
+            if cents < 0:
                 raise ValueError('Value "{}" is negative'.format(value))
 
         # Inverse value
         if direction == 'outgoing':
-            value = decimal.Decimal(0)-value
+            cents = -cents
+
+        self.cents = cents
+        self._exp = exp
+        self.date = date
+        self.comment = comment
+
+    def __reduce__(self):
+        """Allow rows to be pickled (eg: to pass them between processes or to
+           cache them on disk) without parsing their fields a second time
+        """
+        memo = {}
+        for name in self._memo:
+            if hasattr(self, name):
+                memo[name] = getattr(self, name)
+        return (make_row, (self.__class__, self._key(), memo))
+
+    def _key(self):
+        return (self.cents, self._exp, self.date, self.comment)
 
-        obj = super(cls, Row).__new__(cls, value, date, comment)
+    @property
+    def value(self):
+        return money.to_decimal(self.cents, self._exp)
+
+    # Behave like the (value, date, comment) tuple that rows used to be
+
+    def __iter__(self):
+        yield self.value
+        yield self.date
+        yield self.comment
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, i):
+        return tuple(self)[i]
 
-        # Look at the comment for this row and extract any hashtags found
-        # hashtags are used to tag the category of each transaction and
-        # might be overwritten later to decorate them nicely
-        obj.hashtag = obj._xtag('#')
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            return (self.cents == other.cents and self.date == other.date and
+                    self.comment == other.comment)
+        if isinstance(other, tuple):
+            return tuple(self) == other
+        return NotImplemented
 
-        return obj
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return '{}(value={!r}, date={!r}, comment={!r})'.format(
+            self.__class__.__name__, self.value, self.date, self.comment)
 
     def __add__(self, value):
         if isinstance(value, Row):
@@ -54,12 +276,34 @@ class Row(namedtuple('Row', ('value', 'date', 'comment'))):
     def __radd__(self, value):
         return self.__add__(value)
 
+    def relabel(self, hashtag):
+        """Return a copy of this row with a different hashtag, used to
+           decorate the category nicely without changing this row, which
+           might be shared with other rowsets
+        """
+        return make_row(self.__class__, self._key(), {'_hashtag': hashtag})
+
+    @property
+    def hashtag(self):
+        """The hashtag found in the comment for this row, hashtags are used
+           to tag the category of each transaction
+        """
+        try:
+            return self._hashtag
+        except AttributeError:
+            self._hashtag = self._xtag('#')
+            return self._hashtag
+
     @property
     def direction(self):
-        if self.value < 0:
-            return "outgoing"
-        else:
-            return "incoming"
+        try:
+            return self._direction
+        except AttributeError:
+            if self.cents < 0:
+                self._direction = "outgoing"
+            else:
+                self._direction = "incoming"
+            return self._direction
 
     @property
     def month(self):
@@ -67,24 +311,43 @@ class Row(namedtuple('Row', ('value', 'date', 'comment'))):
            - used for the filter language
              (others should just use the date object)
         """
-        return self.date.strftime('%Y-%m')
+        ordinal = self.month_ordinal
+        try:
+            return _month_names[ordinal]
+        except KeyError:
+            name = _month_names[ordinal] = self.month_key.strftime('%Y-%m')
+            return name
 
     @property
-    def rel_months(self):
-        now = datetime.datetime.now().date()
-        month_this = self.date.replace(day=1)
-        month_now = now.replace(day=1)
-        rel_days = (month_this - month_now).days
+    def month_key(self):
+        """the first day of the month of this row, used to group rows
+        """
+        try:
+            return self._month_key
+        except AttributeError:
+            self._month_key = intern_date(self.date.replace(day=1))
+            return self._month_key
 
-        # approximate the relative number of months with 28 days per month.
-        # for large enough relative values, this will be inaccurate.
-        # TODO - improve the accuracy when needed
-        return int(rel_days / 28.0)
+    @property
+    def month_ordinal(self):
+        """the month of this row as a number, see month_ordinal()
+        """
+        try:
+            return self._month_ordinal
+        except AttributeError:
+            self._month_ordinal = month_ordinal(self.date)
+            return self._month_ordinal
+
+    @property
+    def rel_months(self):
+        """the number of months from the reference date to this row
+        """
+        return self.month_ordinal - _get_now()[1]
 
     def _xtag(self, x):
         """Generically extract tags with a given prefix
         """
-        p = re.compile(x+'([a-zA-Z]\S*)')
+        p = re.compile(x+r'([a-zA-Z]\S*)')
         all_tags = p.findall(self.comment)
 
         # FIXME - enforce known case on all tags
@@ -102,7 +365,11 @@ class Row(namedtuple('Row', ('value', 'date', 'comment'))):
         """Look at the comment for this row and extract any '!' tags found
            bangtags are used to insert meta-commands (like '!months:-1:5')
         """
-        return self._xtag('!')
+        try:
+            return self._bangtag
+        except AttributeError:
+            self._bangtag = self._xtag('!')
+            return self._bangtag
 
     @staticmethod
     def _month_add(date, incr):
@@ -118,33 +385,28 @@ class Row(namedtuple('Row', ('value', 'date', 'comment'))):
         if incr == 0:
             return date
 
-        year = date.year
-        month = date.month + incr
+        year, month = divmod(date.year * 12 + date.month - 1 + incr, 12)
+        month += 1
         day = date.day
-        while month > 12:
-            year += 1
-            month -= 12
-        while month < 1:
-            year -= 1
-            month += 12
 
         # clamp to maximum day of the month
-        day = min(day, calendar.monthrange(year, month)[1])
+        if day > 28:
+            day = min(day, calendar.monthrange(year, month)[1])
 
         return datetime.date(year, month, day)
 
-    def _split_dates(self):
-        """extract any !months tag and use that to calculate the list of
-           dates that this row could be split into
+    def _split_range(self):
+        """extract any !months tag and return the range of month offsets
+           that this row could be split into, or None if there is no tag
         """
         tag = self.bangtag()
         if tag is None:
-            return [self.date]
+            return None
 
         fields = tag.split(':')
 
         if fields[0] != 'months':       # TODO: fix this for multiple tags
-            return [self.date]
+            return None
 
         if len(fields) < 2 or len(fields) > 3:
             raise ValueError('months bang must specify one or two numbers')
@@ -158,33 +420,42 @@ class Row(namedtuple('Row', ('value', 'date', 'comment'))):
             start = 0
             end = int(fields[1])
 
-        dates = []
-        for i in range(start, end):
-            dates.append(self._month_add(self.date, i))
+        return range(start, end)
+
+    def _split_dates(self):
+        """calculate the list of dates that this row could be split into
+        """
+        offsets = self._split_range()
+        if offsets is None:
+            return [self.date]
+
+        return [self._month_add(self.date, i) for i in offsets]
 
-        return dates
+    def _split_shares(self):
+        """return the month offsets and the shares of the value (see
+           money.split()) of the rows that a simple autosplit() would make,
+           without making them
+        """
+        offsets = self._split_range()
+        if offsets is None:
+            offsets = range(0, 1)
+
+        if len(offsets) < 1:
+            raise ValueError(
+                'would divide by zero, splitting children from {}'.format(
+                    self.date))
+
+        each_cents, remainder = money.split(self.cents, len(offsets))
+        return offsets, each_cents, remainder
 
     def autosplit(self, method='simple'):
         """look at the split bangtag and return a split row if needed
         """
-        dates = self._split_dates()
-
         # append a bangtag to show that something has happend to this row
         # this also means that it cannot be passed to split() twice as that
         # would find two bangtags and raise an exception
         comment = self.comment+' !child'
 
-        # divide the value amongst all the child rows
-        count_children = len(dates)
-        if count_children < 1:
-            raise ValueError(
-                'would divide by zero, splitting children from {}'.format(
-                    self.date))
-
-        each_value = self.value / count_children
-        # (avoid numbers that cannot be represented with cash by using int())
-        each_value = int(each_value)
-
         rows = []
 
         if method == 'simple':
@@ -192,18 +463,23 @@ class Row(namedtuple('Row', ('value', 'date', 'comment'))):
             # amongst multiple months - rounding any fractions down
             # and applying them to the first month
 
+            # (avoid numbers that cannot be represented with cash by only
+            # using whole units) the remainder is any money lost due to
+            # rounding, which is only added to the first child
+            offsets, each_cents, remainder = self._split_shares()
+
             # no splitting needed, return unchanged
-            if len(dates) == 1 and dates[0] == self.date:
+            if len(offsets) == 1 and offsets[0] == 0:
                 return [self]
 
-            # the remainder is any money lost due to rounding
-            remainder = self.value - each_value * count_children
-
-            for date in dates:
-                datestr = date.isoformat()
-                this_value = each_value + remainder
-                remainder = 0  # only add the remainder to the first child
-                rows.append(Row(this_value, datestr, comment, 'signed'))
+            exp = self._exp
+            for offset in offsets:
+                rows.append(make_row(self.__class__,
+                                     (each_cents + remainder, exp,
+                                      self._month_add(self.date, offset),
+                                      comment)))
+                remainder = 0
+                exp = 0
 
         elif method == 'proportional':
             # The 'proportional' splitting attempts to pro-rata the transaction
@@ -219,30 +495,41 @@ class Row(namedtuple('Row', ('value', 'date', 'comment'))):
             # a data source for membership end dates, but neither analysis nor
             # discussion has been done on this.
 
+            dates = self._split_dates()
+
+            # divide the value amongst all the child rows
+            count_children = len(dates)
+            if count_children < 1:
+                raise ValueError(
+                    'would divide by zero, splitting children from {}'.format(
+                        self.date))
+
+            # (avoid numbers that cannot be represented with cash by using
+            # int())
+            each_value = int(self.value / count_children)
+
             value = self.value  # the total value available to share
 
             # for first month, only add the cash for the remainder of the month
             date = dates.pop(0)
             day = date.day
             percent = 1-min(28, day-1)/28.0  # FIXME - month lengths vary
-            datestr = date.isoformat()
             this_value = int(each_value * percent)
             value -= this_value
-            rows.append(Row(this_value, datestr, comment, self.direction))
+            rows.append(Row(this_value, date, comment, self.direction))
 
             # the body fills full months with full shares of the value
             while value >= each_value and len(dates):
                 date = dates.pop(0)
-                datestr = date.isoformat()
                 value -= each_value
-                rows.append(Row(each_value, datestr, comment, self.direction))
+                rows.append(Row(each_value, date, comment, self.direction))
 
             # finally, add any remainders
             if len(dates):
                 date = dates.pop(0)
             else:
                 date = self._month_add(date, 1)
-            datestr = date.replace(day=1).isoformat()  # NOTE: clamp to 1st day
+            date = date.replace(day=1)  # NOTE: clamp to 1st day
             # this will include any money lost due to rounding
             this_value = abs(sum(rows) - self.value)
             percent = min(1, this_value/each_value)
@@ -250,7 +537,7 @@ class Row(namedtuple('Row', ('value', 'date', 'comment'))):
             week = int(day/7)
             comment += "({}% dom={} W{})".format(percent, day, week)
             # FIXME - record the resulting "end date" somewhere
-            rows.append(Row(this_value, datestr, comment, self.direction))
+            rows.append(Row(this_value, date, comment, self.direction))
 
         else:
             raise ValueError('unknown splitter method name')
@@ -294,42 +581,10 @@ class Row(namedtuple('Row', ('value', 'date', 'comment'))):
         """Using the given human readable filter, check if this row matches
            and if so, return it, or None
         """
+        # The filters are only loaded by the runs that use them
+        from filters import compile_filter
 
-        # its not a real tokeniser, its just a RE. so, now I have two problems
-        m = re.match("([a-z0-9_]+)([=!<>~]{1,2})(.*)", string, re.I)
-        if not m:
-            raise ValueError('filters must be <key><op><value>')
-
-        field = m.group(1)
-        op = m.group(2)
-        value_match = m.group(3)
-        value_now = self._getvalue_simple(field)
-
-        # coerce our value to match into a number, if that looks possible
-        try:
-            value_match = float(value_match)
-        except ValueError:
-            pass
-
-        if op == '==':
-            if value_now == value_match:
-                return self
-        elif op == '!=':
-            if value_now != value_match:
-                return self
-        elif op == '>':
-            if value_now > value_match:
-                return self
-        elif op == '<':
-            if value_now < value_match:
-                return self
-        elif op == '=~':
-            if re.search(value_match, value_now, re.I):
-                return self
-        elif op == '!~':
-            if not re.search(value_match, value_now, re.I):
-                return self
-        else:
-            raise ValueError('Unknown filter operation "{}"'.format(op))
+        if compile_filter(string)(self):
+            return self
 
         return None
@@ -1,43 +1,178 @@
 #!/usr/bin/env python
 # Licensed under GPLv3
-import decimal
 import types
 
 from row import Row
+import instrument
+import money
 
 
-class RowSet(object):
+class BaseRowSet(object):
+    """What every kind of rowset (RowSet, ColumnarRowSet and StoreRowSet)
+       does the same way: the group_by() indexes and pivot() grids that are
+       kept with it, and the smallest and largest values from the cents in
+       _min and _max.  Each kind builds its own groups with _build_groups()
+    """
+
+    def __init__(self):
+        # The group_by() results for each field, built when first asked for
+        self._groups = {}
+        # How many times each group_by() index was built, to show reuse
+        self.index_builds = {}
+        # The pivot() results for each label function
+        self._pivots = {}
+
+    @property
+    def min_value(self):
+        if self._min is None:
+            return None
+        return money.normalise(self._min, -2)
+
+    @property
+    def max_value(self):
+        if self._max is None:
+            return None
+        return money.normalise(self._max, -2)
+
+    def invalidate(self):
+        """Forget any indexes built from the rows, call this if the rows are
+           ever changed without using append()
+        """
+        self._groups = {}
+        self._pivots = {}
+
+    def group_by(self, field):
+        """Group the rowset by the given row field and return groups as a dict
+
+           The groups are an index that is kept with this rowset and reused
+           until the rows change, so they must be treated as read only
+        """
+        if field not in self._groups:
+            self._groups[field] = self._build_groups(field)
+            self.index_builds[field] = self.index_builds.get(field, 0) + 1
+            instrument.count('group_by builds')
+
+        return dict(self._groups[field])
+
+    def pivot(self, label=None):
+        """Return the Pivot of the rows by month and label, which is kept
+           with this rowset in the same way as the group_by() indexes
+        """
+        if label not in self._pivots:
+            # Only imported by the subcommands that pivot the rows
+            from pivot import Pivot
+            self._pivots[label] = Pivot(self, label)
+        return self._pivots[label]
+
+
+class RowSet(BaseRowSet):
     """Contain a bunch of rows, allowing statistics to be done on them
     """
 
     def __init__(self):
+        BaseRowSet.__init__(self)
         self.rows = []
 
+        # Running aggregates, kept up to date by append() so that they never
+        # need to walk the rows.  Nested rowsets contribute their aggregates
+        # as they were when they were appended.  The sums are in cents, with
+        # the most decimal places seen so far (see money.py)
+        self._sum = 0
+        self._exp = 0
+        self._count = 0
+        self._min = None
+        self._max = None
+        # The chronologically last row, the one that a stable sort by date
+        # would put last
+        self._last = None
+
+    @property
+    def rows(self):
+        if self._unsplit is not None:
+            self._split_rows()
+        return self._rows
+
+    @rows.setter
+    def rows(self, rows):
+        self._rows = rows
+        # The rows that autosplit() has not split yet
+        self._unsplit = None
+
     def __getitem__(self, i):
         return self.rows[i]
 
+    def __iter__(self):
+        return iter(self.rows)
+
     def __len__(self):
         return len(self.rows)
 
     @property
     def value(self):
-        sum = decimal.Decimal(0)
-        for row in self:
-            if isinstance(row, (Row, RowSet)):
-                sum += row.value
-            else:
-                raise ValueError("unexpected type")
-
         # ensure that values that have been promoted to have some digits
         # of significance return to being simple integers when possible.
-        if int(sum) == sum:
-            sum = sum.to_integral_exact()
+        return money.normalise(self._sum, self._exp)
+
+    @property
+    def count(self):
+        """The number of rows, including those inside nested rowsets
+        """
+        return self._count
+
+    def _aggregate(self, total, exp, count, min_cents, max_cents, last):
+        """Add the given aggregates into the running aggregates
+        """
+        if not count:
+            return
+        if last is not None and (self._last is None or
+                                 last.date >= self._last.date):
+            self._last = last
+        self._sum += total
+        self._exp = min(self._exp, exp)
+        self._count += count
+        if self._min is None or min_cents < self._min:
+            self._min = min_cents
+        if self._max is None or max_cents > self._max:
+            self._max = max_cents
+
+    def _set_rows(self, rows):
+        """Replace the rows with a list of Row objects, working out the
+           aggregates in the same pass
+        """
+        self.invalidate()
+        self.rows = rows
+        self._sum = 0
+        self._exp = 0
+        self._count = 0
+        self._min = None
+        self._max = None
+        self._last = None
 
-        return sum
+        if rows:
+            cents = [row.cents for row in rows]
+            # max() gives the first of the equal dates, so look from the end
+            last = max(reversed(rows), key=lambda row: row.date)
+            self._aggregate(sum(cents), min(row._exp for row in rows),
+                            len(cents), min(cents), max(cents), last)
 
     def append(self, item):
-        if isinstance(item, (Row, RowSet)):
+        """Add a Row, a nested RowSet, or a list or generator of them.
+
+           A nested RowSet adds its aggregates as they are when it is
+           appended, so it should be complete by then: rows appended to it
+           afterwards are still iterated over, but are not counted in the
+           value, count and so on of this one.
+        """
+        self.invalidate()
+
+        if isinstance(item, Row):
             self.rows.append(item)
+            self._aggregate(item.cents, item._exp, 1, item.cents, item.cents,
+                            item)
+        elif isinstance(item, RowSet):
+            self.rows.append(item)
+            self._aggregate(item._sum, item._exp, item._count, item._min,
+                            item._max, item._last)
         elif isinstance(item, list):
             for entry in item:
                 self.append(entry)
@@ -53,54 +188,115 @@ class RowSet(object):
     def filter(self, filter_strings):
         """Apply the given list of human readable filters to the rows
         """
-        if filter_strings is None:
-            filter_strings = []
+        if not filter_strings:
+            # Nothing would be removed, so this rowset is shared rather
+            # than copied, keeping its indexes (and any rows still to be
+            # split) for whoever looks at it next
+            return self
+
+        # The filters are only loaded by the runs that use them
+        from filters import compile_filters
+
+        # Parse the filters once, so each row is just a predicate call
+        predicate = compile_filters(filter_strings)
 
         result = RowSet()
-        for row in self.rows:
-            match = True
-            for s in filter_strings:
-                if not row.filter(s):
-                    match = False
-                    break
-            if match:
-                result.append(row)
+        instrument.count('filter evaluations', len(self.rows))
+        result._set_rows([row for row in self.rows if predicate(row)])
         return result
 
     def autosplit(self):
         """look at the split bangtag and return the rowset all split
+
+           The split rows are only made when the rows are first looked at,
+           until then the aggregates (value, count and so on) are worked out
+           from the shares of the rows being split
         """
         result = RowSet()
-        for row in self:
-            result.append(row.autosplit())
+        unsplit = []
+        # The date and the item that the latest row will come from
+        latest = None
+        for row in self.rows:
+            if isinstance(row, RowSet):
+                row = row.autosplit()
+                result._aggregate(row._sum, row._exp, row._count, row._min,
+                                  row._max, None)
+                date = row._last.date if row._count else None
+            else:
+                offsets, each_cents, remainder = row._split_shares()
+                first = each_cents + remainder
+                shares = (first, each_cents) if len(offsets) > 1 else (first,)
+                result._aggregate(row.cents, row._exp, len(offsets),
+                                  min(shares), max(shares), None)
+                # Only the last row made from each one can be the latest
+                date = row._month_add(row.date, offsets[-1])
+
+            if date is not None and (latest is None or date >= latest[0]):
+                latest = (date, row)
+            unsplit.append(row)
+
+        if latest is not None:
+            if isinstance(latest[1], RowSet):
+                result._last = latest[1]._last
+            else:
+                result._last = latest[1].autosplit()[-1]
+        result._unsplit = unsplit
         return result
 
-    def group_by(self, field):
-        """Group the rowset by the given row field and return groups as a dict
+    def _split_rows(self):
+        """Make the rows that autosplit() left to be made later
+
+           The server threads can look at the same rowset at once, so the
+           rows to split are only read once, and another thread may have
+           already split them by then.  At worst they are split twice, to
+           the same rows.
         """
-        # This could be cached for performance, but for clarity it is not
-        result = {}
+        unsplit = self._unsplit
+        if unsplit is None:
+            return
+
+        rows = []
+        for row in unsplit:
+            if isinstance(row, RowSet):
+                rows.append(row)
+            else:
+                rows.extend(row.autosplit())
+        instrument.count('rows split', len(rows) - len(unsplit))
+
+        # The rows are in place before they are marked as split
+        self._rows = rows
+        self._unsplit = None
+
+    def _build_groups(self, field):
+        groups = {}
         for row in self:
             if field == 'month':
                 # FIXME - Hack!
                 # - the "month" attribute of the row is intended for string
                 #   pattern matching, but the rowset wants to keep the original
                 #   objects intact as much as possible
-                key = row.date.replace(day=1)
+                key = row.month_key
             else:
                 key = row._getvalue(field)
 
             if key is None:
                 key = 'unknown'
 
-            if key not in result:
-                result[key] = RowSet()
+            if key not in groups:
+                groups[key] = []
+
+            groups[key].append(row)
 
-            result[key].append(row)
+        result = {}
+        for key, rows in groups.items():
+            result[key] = RowSet()
+            result[key]._set_rows(rows)
         return result
 
     def last(self):
         """Return the chronologically last row from the rowset
         """
-        rows = sorted(self, key=lambda x: x.date)
-        return rows[-1]
+        # Kept up to date as the rows are added, so there is no sorting
+        if self._last is None:
+            raise IndexError('no rows in the rowset')
+        return self._last
@@ -0,0 +1,301 @@
+# Licensed under GPLv3
+import threading
+import traceback
+import json
+import time
+import os
+
+try:
+    # python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import UnixStreamServer
+    from urlparse import urlparse, parse_qs
+    import Queue as queue
+except ImportError:
+    # python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import UnixStreamServer
+    from urllib.parse import urlparse, parse_qs
+    import queue
+
+from row import NowScope, decide_now
+
+
+class Snapshot(object):
+    """One loaded copy of the rows.  A snapshot is never changed once it is
+       made, a reload makes a new one, so requests can keep using the one
+       they started with while the next one is loaded.  The reference date
+       for relative months is kept with the rows it was loaded with.
+    """
+
+    def __init__(self, rows, generation, now=None):
+        self.rows = rows
+        self.generation = generation
+        self.now = now
+        self.loaded = time.time()
+
+
+class LatencyHistogram(object):
+    """Count how long requests took, in buckets that double in size
+    """
+
+    # The upper bound of each bucket, in milliseconds
+    bounds = tuple(2 ** i for i in range(14))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        bucket = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if ms <= bound:
+                bucket = i
+                break
+
+        with self._lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += ms
+            self.max = max(self.max, ms)
+
+    def as_dict(self):
+        with self._lock:
+            buckets = {}
+            for bound, count in zip(self.bounds + ('inf',), self.counts):
+                if count:
+                    buckets['le_{}ms'.format(bound)] = count
+            return {
+                'count': self.count,
+                'total_ms': round(self.total, 3),
+                'max_ms': round(self.max, 3),
+                'buckets': buckets,
+            }
+
+
+class ThreadPoolMixIn:
+    """Handle each request on one of a fixed pool of threads, instead of
+       the one thread per request that ThreadingMixIn would start.
+
+       Like the socketserver mixins this is not derived from object, as the
+       python 2 servers are old style classes, so the server that it is
+       mixed into has to call stop_pool() from its server_close()
+    """
+
+    threads = 4
+
+    def start_pool(self):
+        self._requests = queue.Queue()
+        self._workers = []
+        for _ in range(self.threads):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def stop_pool(self):
+        workers = getattr(self, '_workers', [])
+        for _ in workers:
+            self._requests.put(None)
+        for worker in workers:
+            worker.join()
+
+
+class LedgerMixIn(ThreadPoolMixIn):
+    """Keep the rows in memory and answer subcommands about them.
+
+       - load() returns a freshly loaded set of rows
+       - run(cmd, filters, rows) returns the output of the subcommand
+       - commands maps each subcommand name to its content type
+       - now is the "YYYY-MM-DD" reference date for relative months, or
+         None for the day that each snapshot is loaded
+    """
+
+    def setup_ledger(self, load, run, commands, threads=None, now=None):
+        self.load = load
+        self.run = run
+        self.commands = commands
+        self.now = now
+        if threads is not None:
+            self.threads = threads
+
+        self.latency = {}
+        self._latency_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.snapshot = None
+        self.reload()
+        self.start_pool()
+
+    def reload(self):
+        """Load a new snapshot and swap it in, the requests that are using
+           the old one are not disturbed
+        """
+        with self._reload_lock:
+            generation = 1
+            if self.snapshot is not None:
+                generation = self.snapshot.generation + 1
+            # a reload is a new run, so it has a new idea of "now"
+            now = decide_now(self.now)
+            with NowScope(now):
+                rows = self.load()
+            self.snapshot = Snapshot(rows, generation, now)
+        return self.snapshot
+
+    def update(self, func, name='_update'):
+        """Swap in a snapshot of the rows returned by func(rows), given the
+           rows of the current one, recording how long it took under name
+        """
+        start = time.time()
+        with self._reload_lock:
+            snapshot = self.snapshot
+            with NowScope(snapshot.now):
+                rows = func(snapshot.rows)
+            self.snapshot = Snapshot(rows, snapshot.generation + 1,
+                                     snapshot.now)
+        self.histogram(name).record(time.time() - start)
+        return self.snapshot
+
+    def histogram(self, name):
+        with self._latency_lock:
+            if name not in self.latency:
+                self.latency[name] = LatencyHistogram()
+            return self.latency[name]
+
+    def metrics(self):
+        snapshot = self.snapshot
+        with self._latency_lock:
+            latency = dict(self.latency)
+        return {
+            'generation': snapshot.generation,
+            'loaded': snapshot.loaded,
+            'rows': len(snapshot.rows),
+            'latency': dict((k, v.as_dict()) for k, v in latency.items()),
+        }
+
+
+class LedgerHTTPServer(LedgerMixIn, HTTPServer):
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.stop_pool()
+
+
+class LedgerUnixServer(LedgerMixIn, UnixStreamServer):
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        self.stop_pool()
+
+
+class LedgerRequestHandler(BaseHTTPRequestHandler):
+    """Answer "GET /<cmd>?filter=<filter>&filter=..." with the output of the
+       subcommand, along with:
+       - "GET /_metrics" with the latency histograms and snapshot details
+       - "POST /_reload" to load the rows again
+    """
+
+    def do_GET(self):
+        start = time.time()
+        url = urlparse(self.path)
+        cmd = url.path.strip('/')
+
+        if cmd == '_metrics':
+            self.reply(200, json.dumps(self.server.metrics(), sort_keys=True),
+                       'application/json')
+        elif cmd in self.server.commands:
+            filters = parse_qs(url.query).get('filter')
+            # Use the same snapshot for the whole request
+            snapshot = self.server.snapshot
+            try:
+                with NowScope(snapshot.now):
+                    result = self.server.run(cmd, filters, snapshot.rows)
+            except (ValueError, AttributeError) as e:
+                # Most likely a bad filter
+                self.reply(400, '{}\n'.format(e))
+            except Exception as e:
+                self.log_error('%s', traceback.format_exc())
+                self.reply(500, 'Internal error: {!r}\n'.format(e))
+            else:
+                self.reply(200, '{}\n'.format(result),
+                           self.server.commands[cmd])
+        else:
+            self.reply(404, 'Unknown subcommand "{}"\n'.format(cmd))
+            cmd = '_unknown'
+
+        self.server.histogram(cmd).record(time.time() - start)
+
+    def do_POST(self):
+        if urlparse(self.path).path.strip('/') != '_reload':
+            self.reply(404, 'Only /_reload can be posted to\n')
+            return
+
+        start = time.time()
+        snapshot = self.server.reload()
+        self.server.histogram('_reload').record(time.time() - start)
+        self.reply(200, json.dumps({'generation': snapshot.generation}),
+                   'application/json')
+
+    def reply(self, code, body, content_type='text/plain'):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type',
+                         '{}; charset=utf-8'.format(content_type))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets have no client address
+        if not self.client_address:
+            return 'unix'
+        return self.client_address[0]
+
+    def log_message(self, format, *args):
+        if self.server.quiet:
+            return
+        BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def make_server(load, run, commands, listen=None, path=None, threads=4,
+                quiet=False, now=None):
+    """Load the rows and return a server ready to serve_forever(), either on
+       a "host:port" to listen on or on the path of a unix socket
+    """
+    if path is not None:
+        if os.path.exists(path):
+            os.unlink(path)
+        server = LedgerUnixServer(path, LedgerRequestHandler,
+                                  bind_and_activate=False)
+    else:
+        host, port = listen.rsplit(':', 1)
+        server = LedgerHTTPServer((host, int(port)), LedgerRequestHandler,
+                                  bind_and_activate=False)
+        server.allow_reuse_address = True
+
+    server.quiet = quiet
+    try:
+        server.setup_ledger(load, run, commands, threads, now)
+        server.server_bind()
+        server.server_activate()
+    except Exception:
+        server.server_close()
+        raise
+    return server
@@ -0,0 +1,209 @@
+# Licensed under GPLv3
+from array import array
+import struct
+import mmap
+import sys
+import os
+
+from columnar import ColumnarRowSet
+import money
+
+
+# The file starts with this header, followed by the columns and then the
+# string tables, each one starting on a multiple of 8 bytes:
+# - magic, version and the byte order that the numbers were written in
+# - the number of rows, and whether they have already been split
+# - the aggregates of the rowset, and the index of its last row (or -1)
+_magic = b'BALSNAP\0'
+_header = struct.Struct('<8sHBBqqbqqqq')
+version = 1
+
+# The ColumnarRowSet columns that are stored, in order.  The cents are 64
+# bits wide whichever typecode holds them (see money.py)
+_columns = (
+    ('cents', money.cents_typecode),
+    ('exps', 'b'),
+    ('dates', 'i'),
+    ('directions', 'b'),
+    ('tags', 'i'),
+    ('comments', 'i'),
+)
+
+_byteorders = {'little': 1, 'big': 2}
+
+
+def _pad(f):
+    f.write(b'\0' * (-f.tell() % 8))
+
+
+def _write_strings(f, strings):
+    """Write a table of strings as their number, the offset of the end of
+       each one and then all of their utf-8 bytes
+    """
+    data = [s.encode('utf-8') for s in strings]
+    ends = array('I')
+    end = 0
+    for item in data:
+        end += len(item)
+        ends.append(end)
+
+    f.write(struct.pack('<Q', len(data)))
+    _pad(f)
+    f.write(ends.tobytes() if hasattr(ends, 'tobytes') else ends.tostring())
+    _pad(f)
+    f.write(b''.join(data))
+    _pad(f)
+
+
+def write(pathname, rows, split=False):
+    """Write a ColumnarRowSet to a snapshot file, recording if the rows have
+       already been split
+    """
+    # write to a temp file and rename it into place, so that a reader never
+    # sees a half written snapshot
+    tmpname = pathname + '.tmp'
+    with open(tmpname, 'wb') as f:
+        last = -1
+        if rows._last is not None:
+            last = rows._last
+        f.write(_header.pack(
+            _magic, version, _byteorders[sys.byteorder], bool(split),
+            len(rows), rows._total, rows._exp,
+            rows._min if rows._min is not None else 0,
+            rows._max if rows._max is not None else 0,
+            last, 0))
+        _pad(f)
+
+        for name, typecode in _columns:
+            column = array(typecode, getattr(rows, name))
+            f.write(column.tobytes() if hasattr(column, 'tobytes')
+                    else column.tostring())
+            _pad(f)
+
+        # the first tag is always None, for rows without a hashtag
+        _write_strings(f, rows._tags[1:])
+        _write_strings(f, rows._comments)
+    os.rename(tmpname, pathname)
+
+
+def _view(buf, start, end):
+    """Return a read only view of part of the buffer
+    """
+    try:
+        return memoryview(buf)[start:end]
+    except TypeError:  # pragma: no cover
+        # python 2 cannot view an mmap, so view a copy of the part instead
+        return memoryview(buf[start:end])
+
+
+def _column(buf, offset, typecode, count):
+    """Return a read only view of count numbers in the buffer, and the
+       offset of whatever follows them
+    """
+    size = array(typecode).itemsize * count
+    view = _view(buf, offset, offset + size)
+    try:
+        column = view.cast(typecode)
+    except AttributeError:  # pragma: no cover
+        # python 2 has no cast(), so it has to be a copy
+        column = array(typecode, view.tobytes())
+    offset += size
+    return column, offset + (-offset % 8)
+
+
+class StringTable(object):
+    """The strings of a snapshot, only decoded when they are looked at.
+       Strings can be appended, for the new comments of derived rows.
+    """
+
+    def __init__(self, buf, offset):
+        count, = struct.unpack_from('<Q', buf, offset)
+        offset += 8
+        self._ends, offset = _column(buf, offset, 'I', count)
+        self._data = _view(buf, offset, offset + (
+            self._ends[-1] if count else 0))
+        self._extra = []
+        self._ids = None
+
+        size = len(self._data)
+        self.end = offset + size + (-(offset + size) % 8)
+
+    def __len__(self):
+        return len(self._ends) + len(self._extra)
+
+    def __getitem__(self, i):
+        if i >= len(self._ends):
+            return self._extra[i - len(self._ends)]
+        start = self._ends[i - 1] if i else 0
+        return self._data[start:self._ends[i]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, string):
+        self._extra.append(string)
+
+    def ids(self):
+        """Return a dict from each string to its index, only made when
+           rows are added
+        """
+        return _LazyIds(self)
+
+
+class _LazyIds(object):
+    """A dict of the index of each string in a StringTable, made when it is
+       first used
+    """
+
+    def __init__(self, table):
+        self._table = table
+        self._dict = None
+
+    def _ids(self):
+        if self._dict is None:
+            self._dict = dict((s, i) for i, s in enumerate(self._table))
+        return self._dict
+
+    def get(self, key, default=None):
+        return self._ids().get(key, default)
+
+    def __setitem__(self, key, value):
+        self._ids()[key] = value
+
+
+def load(pathname):
+    """Map a snapshot file into memory and return a read only
+       ColumnarRowSet of its rows, along with whether they have already
+       been split.  The columns are read straight from the file as they are
+       used, nothing is done for each row while loading.
+    """
+    with open(pathname, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (magic, file_version, byteorder, split, count, total, exp, min_cents,
+     max_cents, last, _) = _header.unpack_from(buf, 0)
+    if magic != _magic or file_version != version:
+        raise ValueError('"{}" is not a version {} snapshot'.format(
+            pathname, version))
+    if byteorder != _byteorders[sys.byteorder]:
+        raise ValueError('"{}" was written on a machine with a different'
+                         ' byte order'.format(pathname))
+
+    offset = _header.size + (-_header.size % 8)
+    columns = {}
+    for name, typecode in _columns:
+        columns[name], offset = _column(buf, offset, typecode, count)
+
+    tags = StringTable(buf, offset)
+    comments = StringTable(buf, tags.end)
+    tags = [None] + list(tags)
+    tag_ids = dict((tag, i) for i, tag in enumerate(tags))
+
+    rows = ColumnarRowSet(_tables=(tags, tag_ids, comments, comments.ids()))
+    for name, column in columns.items():
+        setattr(rows, name, column)
+    if count:
+        rows._aggregate(total, exp, min_cents, max_cents)
+        rows._last = last
+    return rows, bool(split)
@@ -0,0 +1,210 @@
+# Licensed under GPLv3
+from array import array
+import bisect
+import datetime
+import re
+
+from row import month_ordinal
+from columnar import ColumnarRowSet
+import money
+import lazy
+
+# Only imported when the first stats are made, see lazy.py
+numpy = lazy.optional('numpy')
+
+
+# The hashtags that are membership dues, the same as "hashtag=~^dues:"
+_is_dues = re.compile('^dues:', re.I).search
+
+
+class Stats(object):
+    """The monthly statistics of a rowset, worked out in one sweep.
+
+       For every month this keeps the sums (in cents, see money.py) and row
+       counts of the incoming, outgoing, dues and other rows, along with the
+       dues hashtags that paid.  The statistics for any range of months are
+       then found from these small tables without looking at any rows again.
+    """
+
+    categories = ('incoming', 'outgoing', 'dues', 'other')
+
+    def __init__(self, rows):
+        if isinstance(rows, ColumnarRowSet):
+            month_ords, cents, exps, tag_ids, tags = self._read_columns(rows)
+        else:
+            month_ords, cents, exps, tag_ids, tags = self._read_rows(rows)
+
+        # which of the hashtags are dues
+        self.tags = tags
+        dues_ids = array('b', [
+            tag is not None and _is_dues(tag) is not None for tag in tags
+        ])
+
+        if numpy is not None and len(cents):
+            self.months = [int(x) for x in numpy.unique(month_ords)]
+        else:
+            self.months = sorted(set(month_ords))
+
+        if numpy is not None and len(cents):
+            tables = self._sweep_numpy(month_ords, cents, exps, tag_ids,
+                                       dues_ids)
+        else:
+            tables = self._sweep_arrays(month_ords, cents, exps, tag_ids,
+                                        dues_ids)
+        self._cents, self._exps, self._counts, self._paid = tables
+
+    @staticmethod
+    def _read_rows(rows):
+        month_ords = array('i')
+        cents = array(money.cents_typecode)
+        exps = array('b')
+        tag_ids = array('i')
+        tags = []
+        ids = {}
+        for row in rows:
+            tag = row.hashtag
+            tag_id = ids.get(tag)
+            if tag_id is None:
+                tag_id = ids[tag] = len(tags)
+                tags.append(tag)
+
+            month_ords.append(row.month_ordinal)
+            cents.append(row.cents)
+            exps.append(row._exp)
+            tag_ids.append(tag_id)
+        return month_ords, cents, exps, tag_ids, tags
+
+    @staticmethod
+    def _read_columns(cols):
+        """Read the columns of a ColumnarRowSet straight from its arrays
+        """
+        if numpy is not None and len(cols):
+            # the month of each distinct date, without a loop over the rows
+            dates, inverse = numpy.unique(numpy.asarray(cols.dates),
+                                          return_inverse=True)
+            months = numpy.array([
+                month_ordinal(datetime.date.fromordinal(int(date)))
+                for date in dates
+            ])
+            return months[inverse], cols.cents, cols.exps, cols.tags, \
+                cols._tags
+
+        ordinals = {}
+        month_ords = array('i')
+        for date in cols.dates:
+            try:
+                month_ords.append(ordinals[date])
+            except KeyError:
+                ordinals[date] = month_ordinal(
+                    datetime.date.fromordinal(date))
+                month_ords.append(ordinals[date])
+        return month_ords, cols.cents, cols.exps, cols.tags, cols._tags
+
+    def _masks(self, cents, dues):
+        """Return which rows are in each of the categories
+        """
+        incoming = cents > 0
+        return {
+            'incoming': incoming,
+            'outgoing': cents < 0,
+            'dues': dues,
+            'other': incoming & ~dues,
+        }
+
+    def _sweep_numpy(self, month_ords, cents, exps, tag_ids, dues_ids):
+        month_ords = numpy.asarray(month_ords)
+        cents = numpy.asarray(cents)
+        exps = numpy.asarray(exps)
+        tag_ids = numpy.asarray(tag_ids)
+
+        month_index = numpy.searchsorted(self.months, month_ords)
+        dues = numpy.asarray(dues_ids, dtype=bool)[tag_ids]
+        nr_months = len(self.months)
+
+        sums = {}
+        places = {}
+        counts = {}
+        for name, mask in self._masks(cents, dues).items():
+            index = month_index[mask]
+            total = numpy.zeros(nr_months, dtype=numpy.int64)
+            numpy.add.at(total, index, cents[mask])
+            exp = numpy.zeros(nr_months, dtype=numpy.int8)
+            numpy.minimum.at(exp, index, exps[mask])
+            count = numpy.bincount(index, minlength=nr_months)
+            sums[name] = [int(x) for x in total]
+            places[name] = [int(x) for x in exp]
+            counts[name] = [int(x) for x in count]
+
+        paid = [set() for _ in self.months]
+        pairs = numpy.unique(
+            numpy.stack([month_index[dues], tag_ids[dues]]), axis=1)
+        for month, tag in pairs.T:
+            paid[int(month)].add(int(tag))
+
+        return sums, places, counts, paid
+
+    def _sweep_arrays(self, month_ords, cents, exps, tag_ids, dues_ids):
+        index = dict((month, i) for i, month in enumerate(self.months))
+        nr_months = len(self.months)
+
+        sums = {}
+        places = {}
+        counts = {}
+        for name in self.categories:
+            sums[name] = [0] * nr_months
+            places[name] = [0] * nr_months
+            counts[name] = [0] * nr_months
+        paid = [set() for _ in self.months]
+
+        for month, value, exp, tag in zip(month_ords, cents, exps, tag_ids):
+            i = index[month]
+            names = []
+            if value > 0:
+                names.append('incoming')
+            elif value < 0:
+                names.append('outgoing')
+            if dues_ids[tag]:
+                names.append('dues')
+                paid[i].add(tag)
+            elif value > 0:
+                names.append('other')
+
+            for name in names:
+                sums[name][i] += value
+                places[name][i] = min(places[name][i], exp)
+                counts[name][i] += 1
+
+        return sums, places, counts, paid
+
+    def summary(self, first=None, last=None):
+        """Return the statistics for the months with ordinals between first
+           and last (inclusive, and unlimited if not given) as a dict of:
+           - the value of each category
+           - 'nr_months', the number of months with rows in each category
+           - 'members', the number of different dues hashtags that paid
+           - 'ARPM', the average revenue per member, or -1 with no members
+        """
+        start = 0
+        end = len(self.months)
+        if first is not None:
+            start = bisect.bisect_left(self.months, first)
+        if last is not None:
+            end = bisect.bisect_right(self.months, last)
+
+        r = {'nr_months': {}}
+        for name in self.categories:
+            counts = self._counts[name][start:end]
+            r[name] = money.normalise(sum(self._cents[name][start:end]),
+                                      min(self._exps[name][start:end] or [0]))
+            r['nr_months'][name] = len([x for x in counts if x])
+
+        paid = set()
+        for tags in self._paid[start:end]:
+            paid |= tags
+        r['members'] = len(paid)
+        if r['members']:
+            r['ARPM'] = int(r['dues'] / r['members'])
+        else:
+            r['ARPM'] = -1
+
+        return r
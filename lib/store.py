@@ -0,0 +1,377 @@
+# Licensed under GPLv3
+import threading
+import sqlite3
+import json
+import os
+import re
+
+from row import Row, parse_date, month_date, month_ordinal, get_now, make_row
+from filters import parse_filter, cents_limit, is_finite
+from rowset import BaseRowSet, RowSet
+from ledger import ledger_files
+from cache import RowCache
+import instrument
+import money
+
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rows (
+    file TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    cents INTEGER NOT NULL,
+    exp INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    month TEXT NOT NULL,
+    month_ordinal INTEGER NOT NULL,
+    direction TEXT NOT NULL,
+    hashtag TEXT,
+    comment TEXT NOT NULL,
+    PRIMARY KEY (file, seq)
+);
+CREATE INDEX IF NOT EXISTS rows_date ON rows (date);
+CREATE INDEX IF NOT EXISTS rows_month_ordinal ON rows (month_ordinal);
+CREATE INDEX IF NOT EXISTS rows_direction ON rows (direction);
+CREATE INDEX IF NOT EXISTS rows_hashtag ON rows (hashtag);
+'''
+
+# The order that the rows were parsed in, the same as a RowSet would have
+_order = 'file, seq'
+
+# The Row fields that filters can use, and the SQL for their simple value.
+# A row without a hashtag is compared as the string "None", the same as the
+# filters on Row objects do.  The bangtag is not kept, as a split row has
+# two of them and so no value for it.
+_filter_columns = {
+    'cents': 'cents',
+    'date': 'date',
+    'month': 'month',
+    'month_ordinal': 'month_ordinal',
+    'direction': 'direction',
+    'hashtag': "IFNULL(hashtag, 'None')",
+    'comment': 'comment',
+}
+
+# The Row fields that group_by() can use, with the column that decides the
+# group and how to turn that into the key that RowSet.group_by() would give
+_group_columns = {
+    'month': ('month_ordinal', month_date),
+    'date': ('date', parse_date),
+    'direction': ('direction', None),
+    'hashtag': ('hashtag', None),
+    'comment': ('comment', None),
+}
+
+_sql_ops = {
+    '==': '=',
+    '!=': '!=',
+    '>': '>',
+    '<': '<',
+}
+
+_patterns = {}
+
+
+def _regexp(pattern, value):
+    """The REGEXP function for SQLite, matching the same way as the "=~"
+       filter does
+    """
+    try:
+        search = _patterns[pattern]
+    except KeyError:
+        search = _patterns[pattern] = re.compile(pattern, re.I).search
+    if value is None:
+        value = 'None'
+    return search(value) is not None
+
+
+def filter_sql(string):
+    """Translate a human readable filter into an SQL condition on the rows
+       table, returning the condition and its parameters
+    """
+    field, op, value_match = parse_filter(string)
+
+    if op in ('=~', '!~'):
+        if field not in _filter_columns:
+            raise ValueError('Cannot filter on "{}" in SQL'.format(field))
+        if not isinstance(value_match, str):
+            raise ValueError('Filter pattern "{}" is not a string'.format(
+                value_match))
+        condition = '{} REGEXP ?'.format(_filter_columns[field])
+        if op == '!~':
+            condition = 'NOT ' + condition
+        return condition, [value_match]
+
+    if op not in _sql_ops:
+        raise ValueError('Unknown filter operation "{}"'.format(op))
+    sql_op = _sql_ops[op]
+
+    if field == 'value':
+        if isinstance(value_match, float) and is_finite(value_match):
+            # Compare the cents, exactly as the filters on Row objects do
+            limit = cents_limit(op, value_match)
+            if limit is None:
+                return ('1' if op == '!=' else '0'), []
+            value_match = limit
+        return 'cents {} ?'.format(sql_op), [value_match]
+
+    if field == 'rel_months':
+        now_month = month_ordinal(get_now())
+        if isinstance(value_match, float):
+            # Compared as a month ordinal, so that the index can be used
+            return 'month_ordinal {} ?'.format(sql_op), \
+                [value_match + now_month]
+        return 'month_ordinal - ? {} ?'.format(sql_op), \
+            [now_month, value_match]
+
+    if field not in _filter_columns:
+        raise ValueError('Cannot filter on "{}" in SQL'.format(field))
+
+    if field == 'hashtag' and op == '==' and value_match != 'None':
+        # Without the IFNULL, so that the index can be used
+        return 'hashtag = ?', [value_match]
+    return '{} {} ?'.format(_filter_columns[field], sql_op), [value_match]
+
+
+class Store(object):
+    """Keep the rows of the accounting files in a SQLite database, so that
+       they can be queried with indexes instead of being looked at one by
+       one.  Only the files that have changed since the database was last
+       updated are parsed again.
+
+       When split is set the rows are stored already split, a database made
+       the other way is emptied and made again.
+    """
+
+    # Change this whenever the tables change, an older database is then
+    # emptied and made again
+    version = 1
+
+    def __init__(self, pathname, split=False):
+        self.pathname = pathname
+        self.split = split
+
+        # The rowsets are read from the server threads, one at a time
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(pathname, check_same_thread=False)
+        self.db.create_function('regexp', 2, _regexp)
+        self.db.executescript(_schema)
+
+        meta = json.dumps({'version': self.version, 'split': split})
+        with self.db:
+            stored = self.db.execute(
+                "SELECT value FROM meta WHERE key = 'format'").fetchone()
+            if stored is None or stored[0] != meta:
+                self.db.execute('DELETE FROM rows')
+                self.db.execute('DELETE FROM files')
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('format', ?)",
+                    (meta,))
+
+    def close(self):
+        self.db.close()
+
+    def query(self, sql, params=()):
+        """Run a query and return all of the result rows
+        """
+        instrument.count('sql queries')
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _insert(self, filename, rows):
+        values = []
+        for seq, row in enumerate(rows):
+            values.append((filename, seq, row.cents, row._exp,
+                           row.date.isoformat(), row.month, row.month_ordinal,
+                           row.direction, row.hashtag, row.comment))
+        self.db.executemany(
+            'INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            values)
+
+    def update(self, dirname, parse):
+        """Bring the database up to date with the accounting files in
+           dirname, parsing them with parse(pathname), and return the number
+           of files that were parsed again
+        """
+        stored = dict(self.query('SELECT filename, fingerprint FROM files'))
+
+        changed = 0
+        with self.lock, self.db:
+            filenames = ledger_files(dirname)
+            for filename in set(stored) - set(filenames):
+                self.db.execute('DELETE FROM rows WHERE file = ?',
+                                (filename,))
+                self.db.execute('DELETE FROM files WHERE filename = ?',
+                                (filename,))
+
+            for filename in filenames:
+                pathname = os.path.join(dirname, filename)
+                fingerprint = json.dumps(RowCache.fingerprint(pathname))
+                if stored.get(filename) == fingerprint:
+                    continue
+
+                changed += 1
+                self.db.execute('DELETE FROM rows WHERE file = ?',
+                                (filename,))
+                rows = RowSet()
+                rows.append(parse(pathname))
+                if self.split:
+                    rows = rows.autosplit()
+                self._insert(filename, rows)
+                self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?)',
+                                (filename, fingerprint))
+
+        instrument.count('files parsed', changed)
+        return changed
+
+    def rows(self):
+        """Return all of the rows, as a StoreRowSet
+        """
+        return StoreRowSet(self)
+
+
+class StoreRowSet(BaseRowSet):
+    """The rows of a Store that match some conditions, which can be used in
+       the same way as a RowSet.  The aggregates, filter() and group_by()
+       are all queries on the database, and the rows themselves are only
+       read when they are looked at.
+
+       Like a ledger, these are never changed once they are made.
+    """
+
+    def __init__(self, store, where=(), params=()):
+        BaseRowSet.__init__(self)
+        self.store = store
+        self.where = list(where)
+        self.params = list(params)
+
+        # Read from the database when first asked for
+        self._aggregates = None
+        self._rows = None
+
+    def _query(self, select, suffix=''):
+        sql = 'SELECT {} FROM rows'.format(select)
+        if self.where:
+            sql += ' WHERE ' + ' AND '.join(
+                '({})'.format(x) for x in self.where)
+        return self.store.query(sql + suffix, self.params)
+
+    def _aggregate(self, total, exp, count, min_cents, max_cents):
+        self._aggregates = (total or 0, min(0, exp or 0), count, min_cents,
+                            max_cents)
+
+    @property
+    def aggregates(self):
+        if self._aggregates is None:
+            self._aggregate(*self._query(
+                'SUM(cents), MIN(exp), COUNT(*), MIN(cents), MAX(cents)')[0])
+        return self._aggregates
+
+    @property
+    def value(self):
+        total, exp = self.aggregates[:2]
+        return money.normalise(total, exp)
+
+    @property
+    def count(self):
+        return self.aggregates[2]
+
+    @property
+    def _min(self):
+        return self.aggregates[3]
+
+    @property
+    def _max(self):
+        return self.aggregates[4]
+
+    @staticmethod
+    def _row(cents, exp, date, comment, hashtag):
+        return make_row(Row, (cents, exp, parse_date(date), comment),
+                        {'_hashtag': hashtag})
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = [self._row(*x) for x in self._query(
+                'cents, exp, date, comment, hashtag',
+                ' ORDER BY ' + _order)]
+        return self._rows
+
+    def __getitem__(self, i):
+        return self.rows[i]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return self.count
+
+    def filter(self, filter_strings):
+        """Apply the given list of human readable filters to the rows, as
+           conditions on the query
+        """
+        if not filter_strings:
+            return self
+
+        where = list(self.where)
+        params = list(self.params)
+        for s in filter_strings:
+            condition, condition_params = filter_sql(s)
+            where.append(condition)
+            params.extend(condition_params)
+        return StoreRowSet(self.store, where, params)
+
+    def autosplit(self):
+        """Return the rows all split, see RowSet.autosplit().  A store that
+           was made with split set already has them split.
+        """
+        if self.store.split:
+            return self
+        rows = RowSet()
+        rows.append(self.rows)
+        return rows.autosplit()
+
+    def _build_groups(self, field):
+        if field not in _group_columns:
+            # Not one of the columns, so the rows have to be looked at
+            rows = RowSet()
+            rows.append(self.rows)
+            return rows.group_by(field)
+
+        column, convert = _group_columns[field]
+        result = {}
+        # In the order that each group is first found in the rows, the same
+        # as RowSet.group_by() gives
+        for values in self._query(
+                '{}, SUM(cents), MIN(exp), COUNT(*), MIN(cents), MAX(cents)'
+                .format(column),
+                " GROUP BY {} ORDER BY MIN(file || printf(' %09d', seq))"
+                .format(column)):
+            key = values[0]
+            group = StoreRowSet(self.store, self.where + [column + ' IS ?'],
+                                self.params + [key])
+            group._aggregate(*values[1:])
+
+            if key is None:
+                key = 'unknown'
+            elif convert is not None:
+                key = convert(key)
+            result[key] = group
+        return result
+
+    def last(self):
+        """Return the chronologically last row from the rowset
+        """
+        # The same row as a stable sort by date would put last
+        rows = self._query('cents, exp, date, comment, hashtag',
+                           ' ORDER BY date DESC, file DESC, seq DESC LIMIT 1')
+        if not rows:
+            raise IndexError('no rows in the rowset')
+        return self._row(*rows[0])
@@ -0,0 +1,98 @@
+# Licensed under GPLv3
+import datetime
+import calendar
+import random
+import os
+
+
+# The expense hashtags used when none are given, along with the share of
+# the monthly dues that each one costs
+expense_tags = {
+    'bills:rent': 0.5,
+    'bills:electric': 0.1,
+    'bills:internet': 0.05,
+    'clubmate': 0.1,
+    'fridge': 0.05,
+    'fees:paypal': 0.01,
+}
+
+
+def generate(dirname, members=30, years=3, expenses=None, split=0.1,
+             start=2010, seed=1):
+    """Write a made up ledger into dirname, in the same layout as the cash
+       directory, and return the number of rows written.
+
+       - members is the number of members paying dues every month
+       - years is the number of years of history, starting from start
+       - expenses maps each expense hashtag to the share of the monthly dues
+         that it costs, by default expense_tags
+       - split is the fraction of the dues and rent rows that are paid for
+         several months at once with a "!months" bangtag
+
+       The same arguments always give the same ledger.
+    """
+    if expenses is None:
+        expenses = expense_tags
+    rand = random.Random(seed)
+
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    dues = 500
+    budget = members * dues
+    names = ['member{}'.format(i) for i in range(members)]
+    # How many more months each member has already paid for
+    paid = dict((name, 0) for name in names)
+
+    count = 0
+    for year in range(start, start + years):
+        for month in range(1, 13):
+            days = calendar.monthrange(year, month)[1]
+
+            def date():
+                day = rand.randint(1, days)
+                return datetime.date(year, month, day).isoformat()
+
+            incoming = []
+            for name in names:
+                if paid[name]:
+                    paid[name] -= 1
+                    continue
+                if rand.random() < split:
+                    months = rand.randint(2, 12)
+                    paid[name] = months - 1
+                    incoming.append('{} {} #dues:{} !months:{}'.format(
+                        dues * months, date(), name, months))
+                else:
+                    incoming.append('{} {} #dues:{}'.format(
+                        dues, date(), name))
+
+            # Some donations without a hashtag
+            for _ in range(rand.randint(0, 3)):
+                incoming.append('{}.{:02d} {} Anon'.format(
+                    rand.randint(1, 100), rand.randint(0, 99), date()))
+
+            outgoing = []
+            for tag in sorted(expenses):
+                # never spend more than the budget, so the sum stays positive
+                value = int(budget * expenses[tag] * rand.uniform(0.5, 1))
+                if tag == 'bills:rent' and rand.random() < split:
+                    outgoing.append('{} {} #{} !months:-1:1 {}'.format(
+                        value, date(), tag, 'paid late'))
+                else:
+                    outgoing.append('{} {} #{}'.format(value, date(), tag))
+
+            for direction, rows in (('incoming', incoming),
+                                    ('outgoing', outgoing)):
+                filename = '{}-{:04d}-{:02d}'.format(direction, year, month)
+                with open(os.path.join(dirname, filename), 'w') as f:
+                    # the files are mostly, but not always, in date order
+                    rows.sort(key=lambda row: row.split()[1])
+                    if len(rows) > 2:
+                        i = rand.randrange(len(rows) - 1)
+                        rows[i], rows[i + 1] = rows[i + 1], rows[i]
+                    for row in rows:
+                        f.write(row + '\n')
+                count += len(rows)
+
+    return count
@@ -0,0 +1,66 @@
+""" Perform tests on the cache.py
+"""
+
+import unittest
+import tempfile
+import shutil
+import sys
+import os
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+from cache import RowCache # noqa
+from row import Row # noqa
+
+
+class TestRowCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'incoming-1970-01')
+        with open(self.filename, 'w') as f:
+            f.write("100 1970-01-01 a #hashtag\n")
+
+        self.cache = RowCache(os.path.join(self.dir, 'cache'))
+        self.rows = [Row("100", "1970-01-01", "a #hashtag", "incoming")]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_miss_then_hit(self):
+        fingerprint = self.cache.fingerprint(self.filename)
+        self.assertEqual(self.cache.get(fingerprint), None)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+
+        self.cache.put(fingerprint, self.rows)
+        got = self.cache.get(fingerprint)
+        self.assertEqual(got, self.rows)
+        self.assertEqual(got[0].hashtag, 'hashtag')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_changed_file(self):
+        self.cache.put(self.cache.fingerprint(self.filename), self.rows)
+
+        with open(self.filename, 'a') as f:
+            f.write("200 1970-01-02 another\n")
+
+        fingerprint = self.cache.fingerprint(self.filename)
+        self.assertEqual(self.cache.get(fingerprint), None)
+
+    def test_clear(self):
+        fingerprint = self.cache.fingerprint(self.filename)
+        self.cache.put(fingerprint, self.rows)
+        self.cache.clear()
+        self.assertEqual(self.cache.get(fingerprint), None)
+
+    def test_corrupt_entry(self):
+        fingerprint = self.cache.fingerprint(self.filename)
+        self.cache.put(fingerprint, self.rows)
+        with open(self.cache._entryname(fingerprint), 'wb') as f:
+            f.write(b'garbage')
+        self.assertEqual(self.cache.get(fingerprint), None)
@@ -0,0 +1,232 @@
+""" Perform tests on the checkpoint.py
+"""
+
+import unittest
+import tempfile
+import shutil
+import sys
+import os
+if sys.version_info[0] == 2:  # pragma: no cover
+    import mock
+else:
+    from unittest import mock  # pragma: no cover
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+from checkpoint import Checkpoints, read_checkpoints # noqa
+from partition import Partitions # noqa
+from ledger import ledger_files # noqa
+from rowset import RowSet # noqa
+from row import Row # noqa
+
+
+def parse(pathname):
+    """Return the rows of a file and its "#!balance" lines, as
+       balance.parse_file_pragmas() would
+    """
+    direction = os.path.basename(pathname).split('-', 1)[0]
+    rows = []
+    pragmas = []
+    with open(pathname) as f:
+        for line in f:
+            if line.startswith('#!balance'):
+                pragmas.append(line.rstrip('\n'))
+            if line.startswith('#'):
+                continue
+            value, date, comment = line.split(None, 2)
+            rows.append(Row(value, date, comment.strip(), direction))
+    return rows, pragmas
+
+
+class TestCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = tempfile.mkdtemp()
+        self.write('incoming-1970-01', "10 1970-01-05 comment1\n"
+                                       "20 1970-01-20 comment2\n"
+                                       "#!balance 1970-01-10 10\n")
+        self.write('outgoing-1970-01', "5 1970-01-25 comment3\n"
+                                       "#!balance 1970-01-31 25.00\n")
+        self.write('incoming-1970-02', "#!balance 1970-01-31 26\n"
+                                       "5 1970-02-01 comment4\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        shutil.rmtree(self.cache)
+
+    def write(self, filename, data):
+        with open(os.path.join(self.dir, filename), 'w') as f:
+            f.write(data)
+
+    def load(self, cache_dir=True):
+        """Parse all of the files, as the first load would, keeping their
+           spans in the partitions and collecting their pragmas
+        """
+        partitions = None
+        if cache_dir:
+            partitions = Partitions(self.dir, cache_dir=self.cache)
+        rows = RowSet()
+        pragmas = {}
+        for filename in ledger_files(self.dir):
+            file_rows, pragmas[filename] = parse(
+                os.path.join(self.dir, filename))
+            if partitions is not None:
+                partitions.record(filename, file_rows)
+            rows.append(file_rows)
+        if partitions is not None:
+            partitions.save()
+        return rows, partitions, pragmas
+
+    def verify(self, cache_dir=True):
+        checkpoints = Checkpoints(self.dir,
+                                  cache_dir=self.cache if cache_dir else None)
+        rows, partitions, pragmas = self.load(cache_dir)
+        found = checkpoints.update(pragmas, ledger_files(self.dir),
+                                   partitions)
+        with mock.patch('checkpoint.sys.stderr') as stderr:
+            checkpoints.verify(found, rows, ledger_files(self.dir),
+                               partitions)
+        checkpoints.save()
+        return [x[0][0] for x in stderr.write.call_args_list]
+
+    def trusted(self):
+        checkpoints = Checkpoints(self.dir, cache_dir=self.cache)
+        filenames = ledger_files(self.dir)
+        partitions = Partitions(self.dir, cache_dir=self.cache)
+        found = checkpoints.known(filenames, partitions)
+        if not found:
+            return None
+        return checkpoints.trusted(found, filenames, partitions)
+
+    def test_read(self):
+        self.assertEqual(
+            read_checkpoints(['#!balance 1970-01-31 25.00'], 'outgoing'),
+            [['1970-01-31', '25.00']])
+
+        for bad in ('#!balance 1970-01-31', '#!balance 1970-01-31 x',
+                    '#!balance 1970-13-01 10'):
+            with self.assertRaises(ValueError) as e:
+                read_checkpoints([bad], 'incoming-1970-03')
+            self.assertIn('incoming-1970-03', str(e.exception))
+
+    def test_known(self):
+        # Nothing is known until the files have been parsed
+        partitions = Partitions(self.dir, cache_dir=self.cache)
+        checkpoints = Checkpoints(self.dir, cache_dir=self.cache)
+        self.assertIsNone(checkpoints.known(ledger_files(self.dir),
+                                            partitions))
+
+        self.verify()
+        partitions = Partitions(self.dir, cache_dir=self.cache)
+        checkpoints = Checkpoints(self.dir, cache_dir=self.cache)
+        found = checkpoints.known(ledger_files(self.dir), partitions)
+        self.assertEqual([x.key for x in found], [
+            '1970-01-10 10', '1970-01-31 26', '1970-01-31 25.00'])
+        self.assertEqual(found[2].cents, 2500)
+
+        # until one of them changes
+        self.write('incoming-1970-02', "5 1970-02-01 comment4\n")
+        partitions = Partitions(self.dir, cache_dir=self.cache)
+        self.assertIsNone(checkpoints.known(ledger_files(self.dir),
+                                            partitions))
+
+    def test_update(self):
+        checkpoints = Checkpoints(self.dir, cache_dir=self.cache)
+        rows, partitions, pragmas = self.load()
+        filenames = ledger_files(self.dir)
+        self.assertEqual(len(checkpoints.update(pragmas, filenames,
+                                                partitions)), 3)
+
+        # the files that were not parsed keep their checkpoints
+        del pragmas['incoming-1970-01']
+        pragmas['incoming-1970-02'] = []
+        self.assertEqual([x.key for x in checkpoints.update(
+            pragmas, filenames, partitions)], [
+            '1970-01-10 10', '1970-01-31 25.00'])
+
+        # and those that are gone lose them
+        self.assertEqual([x.key for x in checkpoints.update(
+            {}, filenames[1:], partitions)], ['1970-01-31 25.00'])
+
+    def test_verify(self):
+        self.assertEqual(self.verify(), [
+            'Balance checkpoint 1970-01-31 26 in incoming-1970-02 does not'
+            ' match the running balance of 25\n'])
+        self.assertEqual(self.trusted().key, '1970-01-31 25.00')
+
+        # A checkpoint is not trusted once the rows before it change
+        self.write('outgoing-1970-01', "50 1970-01-25 comment3\n"
+                                       "#!balance 1970-01-31 25.00\n")
+        self.verify()
+        self.assertEqual(self.trusted().key, '1970-01-10 10')
+
+        # nor while any of the files have not been parsed since they changed
+        self.write('incoming-1970-03', "1 1970-03-01 comment6\n")
+        self.assertIsNone(self.trusted())
+        self.verify()
+        self.assertEqual(self.trusted().key, '1970-01-10 10')
+
+        # or when a new file has rows before it
+        self.write('outgoing-1969-12', "1 1969-12-31 comment5\n")
+        self.verify()
+        self.assertIsNone(self.trusted())
+
+    def test_verify_same_stat(self):
+        self.verify()
+        self.assertEqual(self.trusted().key, '1970-01-31 25.00')
+
+        # A change that keeps the size and mtime is still seen
+        pathname = os.path.join(self.dir, 'outgoing-1970-01')
+        stat = os.stat(pathname)
+        self.write('outgoing-1970-01', "6 1970-01-25 comment3\n"
+                                       "#!balance 1970-01-31 25.00\n")
+        os.utime(pathname, (stat.st_atime, stat.st_mtime))
+        self.verify()
+        self.assertEqual(self.trusted().key, '1970-01-10 10')
+
+    def test_verify_start(self):
+        self.verify()
+        start = self.trusted()
+
+        # Only the checkpoints after the start are checked
+        self.write('incoming-1970-02', "5 1970-02-01 comment4\n"
+                                       "#!balance 1970-02-01 20\n")
+        checkpoints = Checkpoints(self.dir, cache_dir=self.cache)
+        rows, partitions, pragmas = self.load()
+        found = checkpoints.update(pragmas, ledger_files(self.dir),
+                                   partitions)
+
+        after = RowSet()
+        after.append([start.row()])
+        after.append(list(rows.filter(['date>1970-01-31'])))
+        with mock.patch('checkpoint.sys.stderr') as stderr:
+            checkpoints.verify(found, after, ledger_files(self.dir),
+                               partitions, start)
+        stderr.write.assert_called_once_with(
+            'Balance checkpoint 1970-02-01 20 in incoming-1970-02 does not'
+            ' match the running balance of 30\n')
+
+    def test_save(self):
+        # Without a cache directory they are only checked
+        self.assertEqual(len(self.verify(cache_dir=False)), 1)
+        self.assertEqual(os.listdir(self.cache), [])
+
+        self.verify()
+        self.assertEqual(len(os.listdir(self.cache)), 2)
+
+        # nor is anything written when no file has a checkpoint
+        for name in os.listdir(self.cache):
+            os.remove(os.path.join(self.cache, name))
+        for filename in ledger_files(self.dir):
+            self.write(filename, "1 1970-01-01 comment\n")
+        self.assertEqual(self.verify(), [])
+        self.assertEqual([x.split('-')[0] for x in os.listdir(self.cache)],
+                         ['partitions'])
+        self.assertEqual(sorted(os.listdir(self.dir)), sorted(
+            ledger_files(self.dir)))
@@ -0,0 +1,127 @@
+""" Perform tests on the columnar.py
+"""
+
+import unittest
+import decimal
+import sys
+import os
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+from columnar import ColumnarRowSet # noqa
+from rowset import RowSet # noqa
+from row import Row # noqa
+
+
+class TestColumnarRowSet(unittest.TestCase):
+    def setUp(self):
+        r = [None for x in range(7)]
+        r[0] = Row("10", "1970-02-06", "comment4", "outgoing")
+        r[1] = Row("10.5", "1970-01-05", "comment1", "incoming")
+        r[2] = Row("10", "1970-01-10", "comment2 #rent", "outgoing")
+        r[3] = Row("0.20", "1970-01-01", "comment3 #water", "outgoing")
+        r[4] = Row("10", "1970-03-01", "comment5 #rent", "outgoing")
+        r[5] = Row("15", "1970-01-11", "comment6 #water !months:3", "outgoing")
+        r[6] = Row("20", "1970-03-01", "comment7 #dues:test1", "incoming")
+
+        self.rows = RowSet()
+        self.rows.append(r)
+        self.cols = ColumnarRowSet(self.rows)
+
+    def tearDown(self):
+        self.rows = None
+        self.cols = None
+
+    def test_rows(self):
+        self.assertEqual(len(self.cols), len(self.rows))
+        self.assertEqual(list(self.cols), list(self.rows))
+        self.assertEqual(self.cols[-1], self.rows[-1])
+        self.assertEqual(str(self.cols[3].value), '-0.20')
+        self.assertEqual([row.hashtag for row in self.cols],
+                         [row.hashtag for row in self.rows])
+        with self.assertRaises(IndexError):
+            self.cols[7]
+
+    def test_value(self):
+        self.assertEqual(str(self.cols.value), str(self.rows.value))
+        self.assertEqual(str(ColumnarRowSet().value), '0')
+
+        cols = self.cols.filter(['value>0'])
+        self.assertEqual(str(cols.value), '30.5')
+
+        cols = self.cols.filter(['value<-1'])
+        self.assertEqual(str(cols.value), '-45')
+
+    def test_subcent(self):
+        with self.assertRaises(ValueError):
+            ColumnarRowSet([Row("0.001", "1970-01-01", "", "incoming")])
+
+    def test_filter(self):
+        for filters in (
+                [],
+                ['hashtag=~^dues:'],
+                ['hashtag!~^dues:', 'value<0'],
+                ['direction==outgoing', 'month>1970-01'],
+                ['date==1970-03-01'],
+                ['bangtag==months:3'],
+                ['value==10.5'],
+        ):
+            self.assertEqual(list(self.cols.filter(filters)),
+                             list(self.rows.filter(filters)))
+
+        self.assertIs(self.cols.filter([]), self.cols)
+
+        with self.assertRaises(AttributeError):
+            self.cols.filter(['foo==bar'])
+
+    def test_group_by(self):
+        for field in ('month', 'hashtag', 'direction'):
+            got = self.cols.group_by(field)
+            want = self.rows.group_by(field)
+            self.assertEqual(sorted(got.keys()), sorted(want.keys()))
+            for key in want:
+                self.assertEqual(list(got[key]), list(want[key]))
+
+    def test_autosplit(self):
+        self.assertEqual(list(self.cols.autosplit()),
+                         list(self.rows.autosplit()))
+
+    def test_last(self):
+        self.assertEqual(self.cols.last(), self.rows.last())
+        self.assertEqual(self.cols.last().comment, 'comment7 #dues:test1')
+        with self.assertRaises(IndexError):
+            ColumnarRowSet().last()
+
+    def test_append(self):
+        cols = ColumnarRowSet()
+        cols.append(self.cols)
+        cols.append(Row("1", "1970-01-01", "#rent", "incoming"))
+        self.assertEqual(len(cols), 8)
+        self.assertEqual(cols.value, self.rows.value + decimal.Decimal(1))
+
+        with self.assertRaises(ValueError):
+            cols.append(1)
+
+    def test_group_by_reused(self):
+        first = self.cols.group_by('hashtag')
+        self.assertEqual(self.cols.group_by('hashtag'), first)
+        self.assertEqual(self.cols.index_builds, {'hashtag': 1})
+
+        self.cols.append(Row("1", "1970-01-01", "#new", "incoming"))
+        self.assertTrue('new' in self.cols.group_by('hashtag'))
+        self.assertEqual(self.cols.index_builds, {'hashtag': 2})
+
+    def test_aggregates(self):
+        self.assertEqual(self.cols.count, 7)
+        self.assertEqual(self.cols.min_value, self.rows.min_value)
+        self.assertEqual(self.cols.max_value, self.rows.max_value)
+
+        got = self.cols.group_by('hashtag')['rent']
+        self.assertEqual((got.value, got.count), (-20, 2))
+        self.assertEqual(ColumnarRowSet().min_value, None)
@@ -0,0 +1,79 @@
+""" Perform tests on the filters.py
+"""
+
+import unittest
+import sys
+import os
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+from filters import compile_filter, compile_filters # noqa
+from row import Row # noqa
+
+
+class TestFilters(unittest.TestCase):
+    def setUp(self):
+        r = [None for x in range(7)]
+        r[0] = Row("100", "1970-01-01", "incoming comment", "incoming")
+        r[1] = Row("100", "1970-01-02", "outgoing comment", "outgoing")
+        r[2] = Row( "10", "1970-01-03", "a !bangtag", "incoming") # noqa
+        r[3] = Row("100", "1970-01-04", "a #hashtag", "incoming")
+        r[4] = Row("100", "1972-02-29", "!months:-1:5", "incoming")
+        r[5] = Row("100", "1972-01-31", "!months:4", "incoming")
+        r[6] = Row("100", "1970-01-05", "!months:3", "incoming")
+        self.rows = r
+
+    def test_compile_filter(self):
+        with self.assertRaises(ValueError):
+            compile_filter('direction<>value')
+        with self.assertRaises(ValueError):
+            compile_filter('nooperator')
+
+        predicate = compile_filter('foo==bar')
+        with self.assertRaises(AttributeError):
+            predicate(self.rows[0])
+
+        # The indexes of the rows that each filter matches
+        for s, want in (('value>50', [0, 3, 4, 5, 6]),
+                        ('value<50', [1, 2]),
+                        ('value==100', [0, 3, 4, 5, 6]),
+                        ('value!=10', [0, 1, 3, 4, 5, 6]),
+                        ('value==10.0', [2]),
+                        ('hashtag==None', [0, 1, 2, 4, 5, 6]),
+                        ('hashtag=~^hash', [3]),
+                        ('hashtag!~^hash', [0, 1, 2, 4, 5, 6]),
+                        ('bangtag==bangtag', [2]),
+                        ('date>1970-01-02', [2, 3, 4, 5, 6]),
+                        ('direction==incoming', [0, 2, 3, 4, 5, 6]),
+                        ('month==1970-01', [0, 1, 2, 3, 6]),
+                        ('comment=~TAG', [2, 3]),
+                        ('value>99.999', [0, 3, 4, 5, 6]),
+                        ('value<100.001', [0, 1, 2, 3, 4, 5, 6]),
+                        ('value==100.001', []),
+                        ('value!=99.5', [0, 1, 2, 3, 4, 5, 6]),
+                        ('value<inf', [0, 1, 2, 3, 4, 5, 6])):
+            predicate = compile_filter(s)
+            got = [i for i, obj in enumerate(self.rows) if predicate(obj)]
+            self.assertEqual(got, want, s)
+
+    def test_compile_filter_cents(self):
+        obj = Row("100.50", "1970-01-01", "", "outgoing")
+        for s, want in (('value<-100.25', True), ('value<-100.5', False),
+                        ('value>-100.75', True), ('value>-100.5', False),
+                        ('value==-100.5', True), ('value!=-100.5', False),
+                        ('value==-100.501', False), ('value!=-100.501', True)):
+            self.assertEqual(compile_filter(s)(obj), want)
+
+    def test_compile_filters(self):
+        predicate = compile_filters(None)
+        self.assertTrue(predicate(self.rows[0]))
+
+        predicate = compile_filters(['value>50', 'comment=~tag'])
+        self.assertEqual([predicate(obj) for obj in self.rows],
+                         [False, False, False, True, False, False, False])
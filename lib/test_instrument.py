@@ -0,0 +1,88 @@
+""" Perform tests on the instrument.py
+"""
+
+import unittest
+import sys
+import os
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+import instrument # noqa
+from rowset import RowSet # noqa
+from columnar import ColumnarRowSet # noqa
+from row import Row # noqa
+
+
+class TestInstrument(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(instrument.enable, False)
+
+    def test_disabled(self):
+        instrument.enable(False)
+        with instrument.phase('load'):
+            instrument.count('rows parsed', 10)
+        self.assertEqual(instrument.results(),
+                         {'phases': [], 'counters': {}})
+
+        f = []
+        self.assertIs(instrument.writer(f), f)
+
+    def test_enabled(self):
+        instrument.enable()
+        with instrument.phase('load'):
+            instrument.count('rows parsed', 10)
+        with instrument.phase('grid'):
+            instrument.count('rows parsed')
+        with instrument.phase('load'):
+            pass
+
+        class File(object):
+            data = ''
+
+            def write(self, data):
+                self.data += data
+
+        f = File()
+        instrument.writer(f).write('hello')
+        self.assertEqual(f.data, 'hello')
+
+        got = instrument.results()
+        self.assertEqual([(x['name'], x['calls']) for x in got['phases']],
+                         [('load', 2), ('grid', 1)])
+        self.assertEqual(got['counters'],
+                         {'rows parsed': 11, 'render bytes': 5})
+
+        table = instrument.render().split('\n')
+        self.assertEqual(table[0].split(), ['Phase', 'Seconds', 'Calls'])
+        self.assertEqual(table[1].split()[::2], ['load', '2'])
+        self.assertEqual(table[5].split(), ['render', 'bytes', '5'])
+
+        # enabling again starts from nothing
+        instrument.enable()
+        self.assertEqual(instrument.results(),
+                         {'phases': [], 'counters': {}})
+
+    def test_rowsets(self):
+        rows = RowSet()
+        rows.append(Row("10", "1970-01-01", "#a !months:3", "incoming"))
+        rows.append(Row("5", "1970-02-01", "#b", "incoming"))
+
+        # columns evaluate the filter once for each distinct hashtag
+        for rowset, evaluations in ((rows, 4), (ColumnarRowSet(rows), 2)):
+            instrument.enable()
+            rowset = rowset.autosplit()
+            len(rowset)
+            rowset.filter(['hashtag==a'])
+            rowset.group_by('month')
+            rowset.group_by('month')
+            self.assertEqual(instrument.counters, {
+                'rows split': 2,
+                'filter evaluations': evaluations,
+                'group_by builds': 1,
+            })
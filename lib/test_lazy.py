@@ -0,0 +1,27 @@
+""" Perform tests on the lazy.py
+"""
+
+import unittest
+import sys
+import os
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+import lazy # noqa
+
+
+class TestLazy(unittest.TestCase):
+    def test_optional(self):
+        self.assertIsNone(lazy.optional('no_such_module_here'))
+
+        module = lazy.optional('colorsys')
+        self.assertEqual(repr(module), "<lazy module 'colorsys'>")
+        self.assertIsNone(module._module)
+        self.assertEqual(module.rgb_to_hsv(0, 0, 0), (0, 0, 0))
+        self.assertIs(module._module, sys.modules['colorsys'])
@@ -0,0 +1,134 @@
+""" Perform tests on the ledger.py
+"""
+
+import unittest
+import datetime
+import tempfile
+import shutil
+import sys
+import os
+if sys.version_info[0] == 2:  # pragma: no cover
+    import mock
+else:
+    from unittest import mock  # pragma: no cover
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+from ledger import Ledger, ledger_files # noqa
+from rowset import RowSet # noqa
+from pivot import Pivot # noqa
+from row import Row # noqa
+
+
+def parse(pathname):
+    direction = os.path.basename(pathname).split('-', 1)[0]
+    rows = []
+    with open(pathname) as f:
+        for line in f:
+            value, date, comment = line.split(None, 2)
+            rows.append(Row(value, date, comment.strip(), direction))
+    return rows
+
+
+def reload(dirname):
+    """Load the rows the slow way, to check the ledger against
+    """
+    rows = RowSet()
+    for filename in ledger_files(dirname):
+        rows.append(parse(os.path.join(dirname, filename)))
+    return rows
+
+
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.write('incoming-1970-01', "10 1970-01-05 comment1\n"
+                                       "20 1970-01-02 #dues:test1\n")
+        self.write('outgoing-1970-01', "10 1970-01-10 comment2 #rent\n")
+        self.write('incoming-1970-02', "5.50 1970-02-01 comment3\n")
+        self.write('README', "not an accounting file\n")
+
+        with mock.patch('ledger.sys.stderr'):
+            self.ledger = Ledger(self.dir, parse)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, filename, data):
+        with open(os.path.join(self.dir, filename), 'w') as f:
+            f.write(data)
+
+    def check(self, ledger):
+        with mock.patch('ledger.sys.stderr'):
+            want = reload(self.dir)
+
+        self.assertEqual(list(ledger), list(want))
+        self.assertEqual(str(ledger.value), str(want.value))
+        self.assertEqual(ledger.count, want.count)
+        self.assertEqual((ledger.min_value, ledger.max_value),
+                         (want.min_value, want.max_value))
+        for field in ('month', 'hashtag'):
+            got = ledger.group_by(field)
+            self.assertEqual(sorted(got), sorted(want.group_by(field)))
+            for key, rows in want.group_by(field).items():
+                self.assertEqual(list(got[key]), list(rows))
+                self.assertEqual(str(got[key].value), str(rows.value))
+        self.assertEqual(ledger.pivot().grid(), Pivot(want).grid())
+
+    def test_load(self):
+        self.check(self.ledger)
+        self.assertEqual(len(self.ledger), 4)
+        self.assertIs(self.ledger.filter(None), self.ledger)
+        self.assertEqual(len(self.ledger.filter(['direction==incoming'])), 3)
+
+    def test_update(self):
+        old = self.ledger
+        old_months = old.group_by('month')
+        old_pivot = old.pivot()
+
+        self.write('incoming-1970-02', "7 1970-02-01 comment3\n"
+                                       "1 1970-02-09 #dues:test1\n")
+        new = old.update(['incoming-1970-02'])
+        self.check(new)
+
+        # Only the changed month is worked out again
+        january = datetime.date(1970, 1, 1)
+        february = datetime.date(1970, 2, 1)
+        months = new.group_by('month')
+        self.assertIs(months[january], old_months[january])
+        self.assertIs(months[january].pivot(), old_months[january].pivot())
+        self.assertIsNot(months[february], old_months[february])
+
+        # The old ledger is left as it was
+        self.assertEqual(str(old.value), '25.50')
+        self.assertIs(old.pivot(), old_pivot)
+        self.assertEqual(str(new.value), '28')
+
+    def test_update_add_remove(self):
+        self.write('outgoing-1970-03', "1 1970-03-01 #rent\n")
+        os.unlink(os.path.join(self.dir, 'incoming-1970-02'))
+        self.write('notes', "ignored\n")
+
+        new = self.ledger.update(['outgoing-1970-03', 'incoming-1970-02',
+                                  'notes'])
+        self.check(new)
+        self.assertEqual(str(new.value), '19')
+
+    def test_prepare(self):
+        def prepare(rows):
+            return rows.filter(['direction==incoming'])
+
+        with mock.patch('ledger.sys.stderr'):
+            ledger = Ledger(self.dir, parse, prepare)
+        self.assertEqual(str(ledger.value), '35.50')
+
+        self.write('outgoing-1970-01', "10 1970-01-10 comment2 #rent\n"
+                                       "10 1970-01-11 comment2 #rent\n")
+        ledger = ledger.update(['outgoing-1970-01'])
+        self.assertEqual(str(ledger.value), '35.50')
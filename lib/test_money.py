@@ -0,0 +1,60 @@
+""" Perform tests on the money.py
+"""
+
+from array import array
+import unittest
+import decimal
+import sys
+import os
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+import money # noqa
+
+
+class TestMoney(unittest.TestCase):
+    def test_from_string(self):
+        self.assertEqual(money.from_string('100'), (10000, 0))
+        self.assertEqual(money.from_string('164.5'), (16450, -1))
+        self.assertEqual(money.from_string('0.20'), (20, -2))
+        self.assertEqual(money.from_string('-12.34'), (-1234, -2))
+        self.assertEqual(money.from_string(' 7 '), (700, 0))
+        self.assertEqual(money.from_string('1.500'), (150, -2))
+
+        with self.assertRaises(ValueError):
+            money.from_string('0.001')
+        with self.assertRaises(ValueError):
+            money.from_string('NaN')
+        with self.assertRaises(decimal.InvalidOperation):
+            money.from_string('fred')
+
+    def test_from_value(self):
+        self.assertEqual(money.from_value(5), (500, 0))
+        self.assertEqual(money.from_value(decimal.Decimal('-2.5')),
+                         (-250, -1))
+
+    def test_to_decimal(self):
+        for s in ('100', '164.5', '0.20', '-12.34', '-0.5', '0'):
+            got = money.to_decimal(*money.from_string(s))
+            self.assertEqual(str(got), s)
+
+    def test_normalise(self):
+        self.assertEqual(str(money.normalise(-450000, -2)), '-4500')
+        self.assertEqual(str(money.normalise(-4550, -2)), '-45.50')
+        self.assertEqual(str(money.normalise(0, -2)), '0')
+
+    def test_split(self):
+        self.assertEqual(money.split(10000, 3), (3300, 100))
+        self.assertEqual(money.split(-2220, 4), (-500, -220))
+        self.assertEqual(money.split(50, 3), (0, 50))
+
+    def test_cents_typecode(self):
+        cents = array(money.cents_typecode, [2 ** 53, -2 ** 53])
+        self.assertEqual(cents.itemsize, 8)
+        self.assertEqual(list(cents), [2 ** 53, -2 ** 53])
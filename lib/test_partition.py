@@ -0,0 +1,182 @@
+""" Perform tests on the partition.py
+"""
+
+import unittest
+import tempfile
+import shutil
+import sys
+import os
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+from partition import Partitions # noqa
+from ledger import ledger_files # noqa
+from rowset import RowSet # noqa
+from row import Row, set_now # noqa
+import instrument # noqa
+
+
+def parse(pathname):
+    direction = os.path.basename(pathname).split('-', 1)[0]
+    rows = []
+    with open(pathname) as f:
+        for line in f:
+            value, date, comment = line.split(None, 2)
+            rows.append(Row(value, date, comment.strip(), direction))
+    return rows
+
+
+class TestPartitions(unittest.TestCase):
+    def setUp(self):
+        set_now('1970-03-15')
+        self.dir = tempfile.mkdtemp()
+        self.cache = tempfile.mkdtemp()
+        self.write('incoming-1970-01', "10 1970-01-05 comment1\n"
+                                       "20 1970-01-02 #dues:test1 !months:3\n")
+        self.write('outgoing-1970-01', "10 1970-01-10 comment2 #rent\n"
+                                       "0 1970-01-11 nothing\n")
+        self.write('incoming-1970-02', "5 1970-02-01 comment3\n")
+        self.write('outgoing-1970-03', "")
+
+        self.record(self.partitions())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        shutil.rmtree(self.cache)
+
+    def partitions(self, split=False):
+        return Partitions(self.dir, split=split, cache_dir=self.cache)
+
+    def write(self, filename, data):
+        with open(os.path.join(self.dir, filename), 'w') as f:
+            f.write(data)
+
+    def record(self, partitions):
+        for filename in ledger_files(self.dir):
+            rows = parse(os.path.join(self.dir, filename))
+            partitions.record(filename, rows)
+        partitions.save()
+
+    def prune(self, filters, split=False):
+        """Check that no file is pruned that has rows matching the filters,
+           and return the files that are kept
+        """
+        partitions = self.partitions(split)
+        filenames = ledger_files(self.dir)
+        kept = partitions.prune(filenames, filters)
+
+        for filename in filenames:
+            rows = RowSet()
+            rows.append(parse(os.path.join(self.dir, filename)))
+            if split:
+                rows = rows.autosplit()
+            if len(rows.filter(filters)):
+                self.assertIn(filename, kept)
+        return kept
+
+    def test_sidecar(self):
+        # The sidecar is kept in the cache directory, not with the files
+        self.assertEqual(len(os.listdir(self.cache)), 1)
+        self.assertEqual(sorted(os.listdir(self.dir)), [
+            'incoming-1970-01',
+            'incoming-1970-02',
+            'outgoing-1970-01',
+            'outgoing-1970-03',
+        ])
+
+        # and without a cache directory, the spans are only kept for the run
+        partitions = Partitions(self.dir)
+        self.assertEqual(len(partitions.prune(ledger_files(self.dir),
+                                              ['month==1970-02'])), 4)
+        self.record(partitions)
+        self.assertEqual(partitions.prune(ledger_files(self.dir),
+                                          ['month==1970-02']),
+                         ['incoming-1970-02'])
+        self.assertEqual(len(Partitions(self.dir).files), 0)
+
+    def test_prune(self):
+        self.assertEqual(len(self.prune([])), 4)
+        self.assertEqual(self.prune(['month==1970-02']),
+                         ['incoming-1970-02'])
+        self.assertEqual(self.prune(['month>1970-01', 'hashtag==rent']),
+                         ['incoming-1970-02'])
+        self.assertEqual(self.prune(['rel_months<-1']),
+                         ['incoming-1970-01', 'outgoing-1970-01'])
+        self.assertEqual(self.prune(['month_ordinal==23641']),
+                         ['incoming-1970-01', 'outgoing-1970-01'])
+        self.assertEqual(self.prune(['date>1970-01-10']),
+                         ['incoming-1970-02', 'outgoing-1970-01'])
+        self.assertEqual(self.prune(['date==1970-01-02']),
+                         ['incoming-1970-01'])
+        self.assertEqual(self.prune(['date<1970-01-03']),
+                         ['incoming-1970-01'])
+        self.assertEqual(self.prune(['month=~-0[23]$']),
+                         ['incoming-1970-02'])
+
+        # A zero value row is always incoming
+        self.assertEqual(self.prune(['direction==incoming']), [
+            'incoming-1970-01',
+            'incoming-1970-02',
+            'outgoing-1970-01',
+        ])
+        self.assertEqual(self.prune(['direction!=incoming']),
+                         ['outgoing-1970-01'])
+
+    def test_prune_split(self):
+        # The split spans are only worked out for a run that splits
+        self.assertEqual(len(self.prune(['month==1970-03'], split=True)), 4)
+        self.record(self.partitions(split=True))
+
+        # The split rows of january end up in march
+        self.assertEqual(self.prune(['month==1970-03'], split=True),
+                         ['incoming-1970-01'])
+        self.assertEqual(self.prune(['month==1970-03']), [])
+
+    def test_bad_split(self):
+        # A run that does not split never looks at the split tags
+        self.write('incoming-1970-02', "5 1970-02-01 comment3 !months:0\n")
+        self.record(self.partitions())
+        self.assertEqual(self.prune(['month==1970-01']),
+                         ['incoming-1970-01', 'outgoing-1970-01'])
+
+    def test_prune_unknown(self):
+        # Filters that the spans cannot answer keep every file
+        for filters in (['value>10'], ['date!=1970-01-05'], ['date==1970']):
+            self.assertEqual(len(self.prune(filters)), 3)
+
+        # Left for the filter on the rows to raise its usual error
+        partitions = self.partitions()
+        self.assertEqual(len(partitions.prune(ledger_files(self.dir),
+                                              ['month>1970'])), 3)
+
+    def test_changed(self):
+        self.write('incoming-1970-02', "5 1970-04-01 comment3\n")
+        os.utime(os.path.join(self.dir, 'incoming-1970-02'), (1, 1))
+        self.write('incoming-1970-05', "5 1970-05-01 comment3\n")
+
+        # Files that have changed since their span was kept are not pruned
+        partitions = self.partitions()
+        self.assertEqual(partitions.prune(ledger_files(self.dir),
+                                          ['month==1970-01']),
+                         ['incoming-1970-01', 'incoming-1970-02',
+                          'incoming-1970-05', 'outgoing-1970-01'])
+        self.record(partitions)
+        self.assertEqual(self.prune(['month==1970-04']),
+                         ['incoming-1970-02'])
+
+    def test_counter(self):
+        self.addCleanup(instrument.enable, False)
+        instrument.enable()
+        self.partitions().prune(ledger_files(self.dir), ['month==1970-02'])
+        self.assertEqual(instrument.counters, {'files pruned': 3})
+
+    def test_bad_sidecar(self):
+        for name in os.listdir(self.cache):
+            self.write(os.path.join(self.cache, name), 'not json')
+        self.assertEqual(len(self.prune(['month==1970-02'])), 4)
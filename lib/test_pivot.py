@@ -0,0 +1,116 @@
+""" Perform tests on the pivot.py
+"""
+
+import unittest
+import datetime
+import sys
+import os
+if sys.version_info[0] == 2:  # pragma: no cover
+    import mock
+else:
+    from unittest import mock  # pragma: no cover
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+from pivot import Pivot # noqa
+from columnar import ColumnarRowSet # noqa
+from rowset import RowSet # noqa
+from row import Row # noqa
+
+
+class TestPivot(unittest.TestCase):
+    def setUp(self):
+        r = [None for x in range(7)]
+        r[0] = Row("10", "1970-02-06", "comment4", "outgoing")
+        r[1] = Row("10.5", "1970-01-05", "comment1", "incoming")
+        r[2] = Row("10", "1970-01-10", "comment2 #rent", "outgoing")
+        r[3] = Row("0.20", "1970-01-01", "comment3 #water", "outgoing")
+        r[4] = Row("10", "1970-03-01", "comment5 #rent", "outgoing")
+        r[5] = Row("0.30", "1970-01-11", "comment6 #water", "incoming")
+        r[6] = Row("0", "1970-03-01", "comment7 #dues:test1", "incoming")
+
+        self.rows = RowSet()
+        self.rows.append(r)
+
+    def tearDown(self):
+        self.rows = None
+
+    def check(self, pivot):
+        self.assertEqual(pivot.tags, ['dues:test1', 'rent', 'unknown',
+                                      'water'])
+        self.assertEqual(pivot.months, [
+            datetime.date(1970, 1, 1),
+            datetime.date(1970, 2, 1),
+            datetime.date(1970, 3, 1),
+        ])
+        self.assertEqual([[str(x) for x in pivot.line(tag)]
+                          for tag in pivot.tags], [
+            ['None', 'None', '0'],
+            ['-10', 'None', '-10'],
+            ['10.5', '-10', 'None'],
+            ['0.10', 'None', 'None'],
+        ])
+        self.assertEqual([str(x) for x in pivot.month_totals],
+                         ['0.60', '-10', '-10'])
+        self.assertEqual([str(x) for x in pivot.running_totals],
+                         ['0.60', '-9.40', '-19.40'])
+        self.assertEqual(str(pivot.total), str(self.rows.value))
+
+        # the same sums that group_by would give
+        for tag, months in pivot.grid().items():
+            for month, cell in months.items():
+                want = self.rows.group_by('hashtag')[tag]
+                want = want.group_by('month')[month].value
+                self.assertEqual(str(cell['sum']), str(want))
+
+    def test_pivot(self):
+        self.check(Pivot(self.rows))
+
+    @mock.patch('pivot.numpy', None)
+    def test_pivot_arrays(self):
+        self.check(Pivot(self.rows))
+
+    def test_label(self):
+        pivot = Pivot(self.rows, lambda row: row.direction)
+        self.assertEqual(pivot.tags, ['incoming', 'outgoing'])
+        self.assertEqual(str(pivot.cell('incoming', 0)), '10.80')
+
+    def test_columnar(self):
+        self.check(Pivot(ColumnarRowSet(self.rows)))
+
+        def label(row):
+            return '{} {}'.format(row.hashtag, row.direction)
+        label.fields = ('hashtag', 'direction')
+
+        want = Pivot(self.rows, label)
+        got = Pivot(ColumnarRowSet(self.rows), label)
+        self.assertEqual(got.tags, want.tags)
+        self.assertEqual(got.grid(), want.grid())
+
+    @mock.patch('pivot.numpy', None)
+    def test_columnar_arrays(self):
+        self.check(Pivot(ColumnarRowSet(self.rows)))
+
+    def test_empty(self):
+        pivot = Pivot(RowSet())
+        self.assertEqual((pivot.tags, pivot.months), ([], []))
+        self.assertEqual(pivot.total, 0)
+
+    def test_merge(self):
+        months = self.rows.group_by('month')
+        self.check(Pivot.merge([Pivot(rows) for rows in months.values()]))
+
+        # the same cells from more than one pivot are added together
+        pivot = Pivot.merge([Pivot(self.rows), Pivot(self.rows)])
+        self.assertEqual(str(pivot.cell('water', 0)), '0.20')
+        self.assertEqual(str(pivot.cell('dues:test1', 2)), '0')
+
+        pivot = Pivot.merge([])
+        self.assertEqual((pivot.tags, pivot.months), ([], []))
+        self.assertEqual(pivot.total, 0)
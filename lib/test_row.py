@@ -4,12 +4,9 @@
 
 import unittest
 import datetime
+import pickle
 import sys
 import os
-if sys.version_info[0] == 2:  # pragma: no cover
-    import mock
-else:
-    from unittest import mock  # pragma: no cover
 
 # Ensure that we look for any modules in our local lib dir.  This allows simple
 # testing and development use.  It also does not break the case where the lib
@@ -26,13 +23,6 @@ import row as balance # noqa
 # - rename all the balance lines below to use row instead
 
 
-class fakedatetime(datetime.datetime):
-
-    @classmethod
-    def now(cls):
-        return cls(1990, 5, 4, 12, 12, 12, 0)
-
-
 class TestRowClass(unittest.TestCase):
     def setUp(self):
         r = [None for x in range(7)]
@@ -65,6 +55,15 @@ class TestRowClass(unittest.TestCase):
         with self.assertRaises(ValueError):
             balance.Row("-100", "1970-01-01", "a comment", "incoming")
 
+        # values are kept as whole cents, so fractions of a cent cannot be
+        # stored
+        with self.assertRaises(ValueError):
+            balance.Row("0.001", "1970-01-01", "a comment", "incoming")
+
+        obj = balance.Row("0.20", "1970-01-01", "a comment", "outgoing")
+        self.assertEqual(obj.cents, -20)
+        self.assertEqual(str(obj.value), '-0.20')
+
     def test_incoming(self):
         obj = self.rows[0]
         self.assertEqual(obj.value, 100)
@@ -77,6 +76,50 @@ class TestRowClass(unittest.TestCase):
         self.assertEqual(obj.value, -100)
         self.assertEqual(obj.direction, 'outgoing')
 
+    def test_date(self):
+        obj = balance.Row("100", datetime.date(1970, 1, 1), "", "incoming")
+        self.assertEqual(obj, balance.Row("100", "1970-01-01", "", "incoming"))
+        obj = balance.Row("100", datetime.datetime(1970, 1, 1, 12), "",
+                          "incoming")
+        self.assertEqual(obj.date, datetime.date(1970, 1, 1))
+
+        with self.assertRaises(ValueError):
+            balance.Row("100", "1970-13-01", "", "incoming")
+        with self.assertRaises(ValueError):
+            balance.Row("100", "1970/01/01", "", "incoming")
+
+    def test_parse_date(self):
+        self.assertEqual(balance.parse_date("1972-02-29"),
+                         datetime.date(1972, 2, 29))
+        self.assertEqual(balance.parse_date(" 1970-1-5\n"),
+                         datetime.date(1970, 1, 5))
+
+        # the same day is always the same object
+        self.assertIs(balance.parse_date("1970-01-05"),
+                      balance.parse_date(" 1970-1-5\n"))
+        self.assertIs(balance.intern_date(datetime.date(1970, 1, 5)),
+                      balance.parse_date("1970-01-05"))
+        self.assertIs(self.rows[6].autosplit()[1].date,
+                      balance.parse_date("1970-02-05"))
+
+    def test_parse_date_limit(self):
+        # the dates seen are forgotten, rather than kept for ever
+        self.addCleanup(setattr, balance, '_dates_limit',
+                        balance._dates_limit)
+        balance._dates_limit = 10
+        for day in range(1, 29):
+            date = balance.parse_date('1971-02-{:02}'.format(day))
+            self.assertEqual(date, datetime.date(1971, 2, day))
+            self.assertLessEqual(len(balance._dates), 10)
+        self.assertIs(balance.parse_date('1971-02-28'), date)
+
+    def test_pickle(self):
+        for obj in self.rows[0:4]:
+            got = pickle.loads(pickle.dumps(obj))
+            self.assertEqual(got, obj)
+            self.assertEqual(got.hashtag, obj.hashtag)
+            self.assertEqual(got.direction, obj.direction)
+
     def test_addnum(self):
         self.assertEqual(self.rows[0]+10, 110)
 
@@ -94,8 +137,28 @@ class TestRowClass(unittest.TestCase):
 
         self.assertEqual(self.rows[3].hashtag, 'hashtag')
 
+        # the hashtag is only looked for when it is first used
+        obj = balance.Row("100", "1970-01-01", "#two #hashtags", "incoming")
         with self.assertRaises(ValueError):
-            balance.Row("100", "1970-01-01", "#two #hashtags", "incoming")
+            obj.hashtag
+
+    def test_relabel(self):
+        obj = self.rows[3]
+        got = obj.relabel('hashtag in')
+        self.assertEqual(got.hashtag, 'hashtag in')
+        self.assertEqual(got, obj)
+        self.assertEqual(obj.hashtag, 'hashtag')
+
+    def test_tuple(self):
+        obj = self.rows[0]
+        self.assertEqual(tuple(obj), (
+            100, datetime.date(1970, 1, 1), "incoming comment"
+        ))
+        self.assertEqual(obj[2], "incoming comment")
+        self.assertEqual(len(obj), 3)
+        self.assertEqual(hash(obj), hash(tuple(obj)))
+        self.assertNotEqual(obj, self.rows[1])
+        self.assertFalse(hasattr(obj, '__dict__'))
 
     def test_bangtag(self):
         self.assertEqual(self.rows[0].bangtag(), None)
@@ -194,6 +257,13 @@ class TestRowClass(unittest.TestCase):
             balance.Row("33", "1970-03-05", "!months:3 !child", "incoming"),
         ])
 
+        # showing the remainder keeps the cents
+        obj = balance.Row("22.20", "1970-01-05", "!months:4", "outgoing")
+        got = obj.autosplit()
+        self.assertEqual([str(row.value) for row in got],
+                         ['-7.20', '-5', '-5', '-5'])
+        self.assertEqual(sum(row.cents for row in got), obj.cents)
+
         # TODO - at at least a trivial example showing method==proportional
 
     def test_match(self):
@@ -230,8 +300,25 @@ class TestRowClass(unittest.TestCase):
         self.assertEqual(obj.filter('comment=~^foo'), None)
         self.assertEqual(obj.filter('comment!~^foo'), obj)
 
-    @mock.patch('balance.datetime.datetime', fakedatetime)
     def test_filter_rel_months(self):
         obj = self.rows[2]
-        self.assertEqual(obj.filter('rel_months<-264'), obj)
-        self.assertEqual(obj.filter('rel_months<-265'), None)
+        # the reference date is global, so put it back afterwards
+        self.addCleanup(setattr, balance, '_now', balance._now)
+        self.addCleanup(setattr, balance, '_now_month', balance._now_month)
+        balance.set_now(datetime.date(1990, 5, 4))
+        self.assertEqual(obj.rel_months, -244)
+        self.assertEqual(obj.filter('rel_months<-243'), obj)
+        self.assertEqual(obj.filter('rel_months<-244'), None)
+
+        # months are counted exactly, whatever their length
+        balance.set_now("1970-02-28")
+        self.assertEqual(obj.filter('rel_months==-1'), obj)
+        balance.set_now("1970-01-31")
+        self.assertEqual(obj.rel_months, 0)
+        self.assertEqual(balance.get_now(), datetime.date(1970, 1, 31))
+
+    def test_month_ordinal(self):
+        self.assertEqual(self.rows[0].month_ordinal, 1970 * 12 + 1)
+        self.assertEqual(self.rows[4].month_ordinal -
+                         self.rows[0].month_ordinal, 25)
+        self.assertEqual(self.rows[4].month, "1972-02")
@@ -3,6 +3,7 @@
 """
 
 import unittest
+import threading
 import datetime
 import sys
 import os
@@ -54,6 +55,18 @@ class TestRowSet(unittest.TestCase):
 
         self.assertEqual(self.rows.value, -46)
 
+    def test_nested_rowset_later(self):
+        nested = balance.RowSet()
+        nested.append(self.rows_array[0])
+        self.rows.append(nested)
+
+        # The aggregates of a nested rowset are taken when it is appended
+        nested.append(self.rows_array[1])
+        self.assertEqual(nested.value, 0)
+        self.assertEqual(self.rows.value, -10)
+        self.assertEqual(self.rows.count, 1)
+        self.assertEqual(len(list(self.rows)[0]), 2)
+
     def test_append(self):
         self.rows.append(self.rows_array[0])
 
@@ -91,6 +104,68 @@ class TestRowSet(unittest.TestCase):
         # FIXME - looking inside the object
         self.assertEqual(len(self.rows.autosplit().rows), 8)
 
+    def test_autosplit_lazy(self):
+        self.rows.append(self.rows_array)
+        self.rows.append(balance.Row("10.05", "1970-01-31", "#a !months:-1:3", "incoming")) # noqa
+        nested = balance.RowSet()
+        nested.append(balance.Row("7", "1970-01-01", "#b !months:2", "incoming")) # noqa
+        self.rows.append(nested)
+
+        eager = balance.RowSet()
+        for row in self.rows.rows:
+            eager.append(row.autosplit())
+
+        # The aggregates are known before any rows are split
+        lazy = self.rows.autosplit()
+        self.assertIsNotNone(lazy._unsplit)
+        self.assertEqual(str(lazy.value), str(eager.value))
+        self.assertEqual(lazy.count, eager.count)
+        self.assertEqual((lazy.min_value, lazy.max_value),
+                         (eager.min_value, eager.max_value))
+        self.assertEqual(lazy.last(), eager.last())
+
+        # and are passed on without splitting them
+        copy = lazy.filter(None)
+        self.assertIs(copy, lazy)
+        self.assertIsNotNone(copy._unsplit)
+
+        self.assertEqual(len(lazy), len(eager))
+        self.assertIsNone(lazy._unsplit)
+        self.assertEqual(lazy.rows[:-1], eager.rows[:-1])
+        self.assertEqual(copy.rows[:-1], eager.rows[:-1])
+        self.assertEqual(lazy.rows[-1].rows, eager.rows[-1].rows)
+
+        with self.assertRaises(ValueError):
+            self.rows.append(balance.Row("1", "1970-01-01", "!months:0", "incoming")) # noqa
+            self.rows.autosplit()
+
+    def test_autosplit_threads(self):
+        for i in range(2000):
+            self.rows.append(balance.Row("12", "1970-01-01", "!months:12", "incoming")) # noqa
+        lazy = self.rows.autosplit()
+
+        # Several threads splitting the same rows at once all see them split
+        lengths = []
+        errors = []
+
+        def look():
+            try:
+                lengths.append(len(lazy.rows))
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+        threads = [threading.Thread(target=look) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(lengths, [24000] * 8)
+
+        # and a thread that finds them already split leaves them alone
+        rows = lazy.rows
+        lazy._split_rows()
+        self.assertIs(lazy.rows, rows)
+
     def test_group_by(self):
         self.rows.append(self.rows_array)
 
@@ -115,3 +190,83 @@ class TestRowSet(unittest.TestCase):
                 'water',
             ]
         )
+
+    def test_group_by_reused(self):
+        self.rows.append(self.rows_array)
+
+        first = self.rows.group_by('month')
+        again = self.rows.group_by('month')
+        self.assertEqual(self.rows.index_builds, {'month': 1})
+        self.assertEqual(again, first)
+
+        # changing the returned dict does not change the index
+        del first[datetime.date(1970, 1, 1)]
+        self.assertEqual(len(self.rows.group_by('month')), 3)
+
+        self.rows.group_by('hashtag')
+        self.assertEqual(self.rows.index_builds, {'month': 1, 'hashtag': 1})
+
+    def test_group_by_invalidated(self):
+        self.rows.append(self.rows_array)
+
+        self.rows.group_by('month')
+        self.rows.append(balance.Row("5", "1970-04-01", "comment7", "incoming")) # noqa
+
+        self.assertEqual(len(self.rows.group_by('month')), 4)
+        self.assertEqual(self.rows.index_builds, {'month': 2})
+
+        self.rows.invalidate()
+        self.rows.group_by('month')
+        self.assertEqual(self.rows.index_builds, {'month': 3})
+
+    def test_last(self):
+        with self.assertRaises(IndexError):
+            self.rows.last()
+
+        self.rows.append(self.rows_array)
+        self.assertEqual(self.rows.last().comment, 'comment5 #rent')
+
+        # The later of two rows with the same date, like a stable sort
+        self.rows.append(balance.Row("1", "1970-03-01", "comment7", "incoming")) # noqa
+        self.assertEqual(self.rows.last().comment, 'comment7')
+        self.assertEqual(self.rows.filter(None).last().comment, 'comment7')
+        self.assertEqual(
+            self.rows.filter(['direction==outgoing']).last().comment,
+            'comment5 #rent')
+
+        # The groups have theirs too
+        groups = self.rows.group_by('hashtag')
+        self.assertEqual(groups['water'].last().comment,
+                         'comment6 #water !months:3')
+
+    def test_aggregates(self):
+        self.assertEqual(self.rows.value, 0)
+        self.assertEqual(self.rows.count, 0)
+        self.assertEqual(self.rows.min_value, None)
+
+        self.rows.append(self.rows_array)
+        self.assertEqual(self.rows.count, 6)
+        self.assertEqual(self.rows.min_value, -15)
+        self.assertEqual(self.rows.max_value, 10)
+
+        nested = balance.RowSet()
+        nested.append(balance.Row("20", "1971-01-05", "comment7", "incoming"))
+        self.rows.append(nested)
+        self.assertEqual(len(self.rows), 7)
+        self.assertEqual(self.rows.count, 7)
+        self.assertEqual(self.rows.max_value, 20)
+        self.assertEqual(self.rows.value, -25)
+
+    def test_aggregates_derived(self):
+        self.rows.append(self.rows_array)
+
+        got = self.rows.filter(None)
+        self.assertEqual((got.value, got.count), (-45, 6))
+
+        got = self.rows.filter(['value<-10'])
+        self.assertEqual((got.value, got.count), (-15, 1))
+        self.assertEqual((got.min_value, got.max_value), (-15, -15))
+
+        got = self.rows.group_by('hashtag')['water']
+        self.assertEqual((got.value, got.count), (-25, 2))
+        self.assertEqual((got.min_value, got.max_value), (-15, -10))
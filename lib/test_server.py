@@ -0,0 +1,176 @@
+""" Perform tests on the server.py
+"""
+
+import unittest
+import threading
+import datetime
+import tempfile
+import shutil
+import socket
+import json
+import sys
+import os
+
+try:
+    # python 2
+    from urllib2 import urlopen, HTTPError, Request
+except ImportError:
+    # python 3
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+import server # noqa
+from rowset import RowSet # noqa
+from row import Row, set_now, get_now # noqa
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_record(self):
+        h = server.LatencyHistogram()
+        h.record(0.0005)
+        h.record(0.003)
+        h.record(0.004)
+        h.record(100)
+        got = h.as_dict()
+        self.assertEqual(got['count'], 4)
+        self.assertEqual(got['buckets'], {
+            'le_1ms': 1, 'le_4ms': 2, 'le_infms': 1,
+        })
+        self.assertEqual(got['max_ms'], 100000)
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.loads = 0
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def load(self):
+        self.loads += 1
+        rows = RowSet()
+        rows.append(Row("10", "1970-01-01", "#rent", "outgoing"))
+        rows.append(Row(str(self.loads), "1970-01-02", "#dues:a", "incoming"))
+        return rows
+
+    def run_cmd(self, cmd, filters, rows):
+        if cmd == 'stats':
+            return 1 / (len(rows) - len(rows))
+        return rows.filter(filters).value
+
+    def start(self, **kwargs):
+        self.server = server.make_server(
+            self.load, self.run_cmd,
+            {'sum': 'text/plain', 'stats': 'text/plain'}, threads=2,
+            quiet=True, **kwargs)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    def get(self, path, data=None):
+        url = 'http://127.0.0.1:{}{}'.format(
+            self.server.server_address[1], path)
+        f = urlopen(Request(url, data))
+        try:
+            return f.read().decode('utf-8')
+        finally:
+            f.close()
+
+    def test_http(self):
+        self.start(listen='127.0.0.1:0')
+
+        self.assertEqual(self.get('/sum'), '-9\n')
+        self.assertEqual(self.get('/sum?filter=hashtag%3D%3Drent'), '-10\n')
+        self.assertEqual(self.get('/sum?filter=value%3E0&filter=value%3C0'),
+                         '0\n')
+
+        with self.assertRaises(HTTPError) as e:
+            self.get('/sum?filter=nooperator')
+        self.assertEqual(e.exception.code, 400)
+        with self.assertRaises(HTTPError) as e:
+            self.get('/csv')
+        self.assertEqual(e.exception.code, 404)
+
+        # a reload makes a new snapshot, the old one is left unchanged
+        old = self.server.snapshot
+        got = json.loads(self.get('/_reload', b''))
+        self.assertEqual(got, {'generation': 2})
+        self.assertEqual(self.get('/sum'), '-8\n')
+        self.assertEqual(old.rows.value, -9)
+
+        got = json.loads(self.get('/_metrics'))
+        self.assertEqual(got['generation'], 2)
+        self.assertEqual(got['rows'], 2)
+        self.assertEqual(got['latency']['sum']['count'], 5)
+        self.assertEqual(got['latency']['_unknown']['count'], 1)
+        self.assertEqual(got['latency']['_reload']['count'], 1)
+
+    def test_concurrent(self):
+        self.start(listen='127.0.0.1:0')
+
+        results = []
+
+        def client():
+            for _ in range(5):
+                results.append(self.get('/sum'))
+
+        threads = [threading.Thread(target=client) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['-9\n'] * 20)
+
+    def test_unix(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'socket')
+        self.start(path=path)
+
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(path)
+        s.sendall(b'GET /sum HTTP/1.0\r\n\r\n')
+        reply = b''
+        while True:
+            data = s.recv(4096)
+            if not data:
+                break
+            reply += data
+        s.close()
+
+        self.assertTrue(reply.startswith(b'HTTP/1.0 200'))
+        self.assertTrue(reply.endswith(b'\r\n\r\n-9\n'))
+
+    def test_error(self):
+        self.start(listen='127.0.0.1:0')
+
+        # Anything other than a bad filter is answered too
+        with self.assertRaises(HTTPError) as e:
+            self.get('/stats')
+        self.assertEqual(e.exception.code, 500)
+        self.assertEqual(self.get('/sum'), '-9\n')
+
+    def test_now(self):
+        self.addCleanup(set_now, get_now())
+        self.start(listen='127.0.0.1:0', now='1970-02-15')
+        self.assertEqual(self.server.snapshot.now, datetime.date(1970, 2, 15))
+
+        # The requests keep to the date that the rows were loaded at, even
+        # when the rest of the process has another idea of "now"
+        set_now('1970-01-15')
+        self.assertEqual(self.get('/sum?filter=rel_months%3D%3D-1'), '-9\n')
+        self.assertEqual(self.get('/sum?filter=rel_months%3D%3D0'), '0\n')
+        self.assertEqual(get_now(), datetime.date(1970, 1, 15))
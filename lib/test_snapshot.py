@@ -0,0 +1,93 @@
+""" Perform tests on the snapshot.py
+"""
+
+import unittest
+import tempfile
+import shutil
+import sys
+import os
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+import snapshot # noqa
+from columnar import ColumnarRowSet # noqa
+from rowset import RowSet # noqa
+from pivot import Pivot # noqa
+from row import Row # noqa
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        r = [None for x in range(7)]
+        r[0] = Row("10", "1970-02-06", "comment4", "outgoing")
+        r[1] = Row("10.5", "1970-01-05", "comment1", "incoming")
+        r[2] = Row("10", "1970-01-10", "comment2 #rent", "outgoing")
+        r[3] = Row("0.20", "1970-01-01", "comment3 #water", "outgoing")
+        r[4] = Row("10", "1970-03-01", "comment5 #rent", "outgoing")
+        r[5] = Row("15", "1970-01-11", "comment6 #water !months:3", "outgoing")
+        r[6] = Row("20", "1970-03-01", u'caf\xe9 #dues:test1', "incoming")
+
+        self.rows = RowSet()
+        self.rows.append(r)
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def roundtrip(self, rows, split=False):
+        snapshot.write(self.filename, ColumnarRowSet(rows), split)
+        return snapshot.load(self.filename)
+
+    def test_roundtrip(self):
+        got, split = self.roundtrip(self.rows)
+        self.assertFalse(split)
+        self.assertEqual(list(got), list(self.rows))
+        self.assertEqual([row.hashtag for row in got],
+                         [row.hashtag for row in self.rows])
+        self.assertEqual(got[6].comment, u'caf\xe9 #dues:test1')
+        self.assertEqual(str(got.value), str(self.rows.value))
+        self.assertEqual((str(got.min_value), str(got.max_value)),
+                         ('-15', '20'))
+        self.assertEqual(got.last(), self.rows.last())
+        self.assertEqual(os.listdir(self.dir), ['snapshot'])
+
+    def test_reports(self):
+        got, _ = self.roundtrip(self.rows)
+        self.assertEqual(Pivot(got).grid(), Pivot(self.rows).grid())
+        # without any filters the mapped columns are not copied
+        self.assertIs(got.filter(None), got)
+        self.assertEqual(list(got.filter(['hashtag=~^w'])),
+                         list(self.rows.filter(['hashtag=~^w'])))
+        self.assertEqual(sorted(got.group_by('month')),
+                         sorted(self.rows.group_by('month')))
+
+        # derived rowsets can add new comments to the shared tables
+        split = got.autosplit()
+        self.assertEqual(list(split), list(self.rows.autosplit()))
+        self.assertEqual(split.filter(['comment=~!child']).count, 3)
+
+    def test_split(self):
+        got, split = self.roundtrip(self.rows.autosplit(), split=True)
+        self.assertTrue(split)
+        self.assertEqual(list(got), list(self.rows.autosplit()))
+
+    def test_empty(self):
+        got, _ = self.roundtrip(RowSet())
+        self.assertEqual(len(got), 0)
+        self.assertEqual(str(got.value), '0')
+        self.assertIsNone(got.min_value)
+        with self.assertRaises(IndexError):
+            got.last()
+
+    def test_not_snapshot(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'10 1970-01-01 not a snapshot\n' * 10)
+        with self.assertRaises(ValueError):
+            snapshot.load(self.filename)
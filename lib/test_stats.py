@@ -0,0 +1,91 @@
+""" Perform tests on the stats.py
+"""
+
+import unittest
+import sys
+import os
+if sys.version_info[0] == 2:  # pragma: no cover
+    import mock
+else:
+    from unittest import mock  # pragma: no cover
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+from stats import Stats # noqa
+from columnar import ColumnarRowSet # noqa
+from rowset import RowSet # noqa
+from row import Row # noqa
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        r = [None for x in range(8)]
+        r[0] = Row("500", "1990-04-03", "#dues:test1", "incoming")
+        r[1] = Row("20.5", "1990-04-03", "Unknown", "incoming")
+        r[2] = Row("12500", "1990-04-15", "#bills:rent", "outgoing")
+        r[3] = Row("0.25", "1990-04-27", "#Dues:test2", "incoming")
+        r[4] = Row("500", "1990-05-02", "#dues:test1", "incoming")
+        r[5] = Row("488", "1990-05-25", "#bills:internet", "outgoing")
+        r[6] = Row("0", "1990-12-25", "#dues:test3", "incoming")
+        r[7] = Row("10", "1990-12-25", "#dues:test1", "outgoing")
+
+        self.rows = RowSet()
+        self.rows.append(r)
+
+    def tearDown(self):
+        self.rows = None
+
+    def want(self, rowset):
+        """The statistics worked out the slow way, with filters
+        """
+        r = {'nr_months': {}}
+        for name, filters in (('incoming', ['value>0']),
+                              ('outgoing', ['value<0']),
+                              ('dues', ['hashtag=~^dues:']),
+                              ('other', ['value>0', 'hashtag!~^dues:'])):
+            got = rowset.filter(filters)
+            r[name] = got.value
+            r['nr_months'][name] = len(got.group_by('month'))
+        r['members'] = len(rowset.filter(['hashtag=~^dues:'])
+                           .group_by('hashtag'))
+        r['ARPM'] = -1
+        if r['members']:
+            r['ARPM'] = int(r['dues'] / r['members'])
+        return r
+
+    def check(self, stats):
+        self.assertEqual(stats.months, [1990 * 12 + 4, 1990 * 12 + 5,
+                                        1990 * 12 + 12])
+
+        for month, rowset in self.rows.group_by('month').items():
+            ordinal = month.year * 12 + month.month
+            got = stats.summary(ordinal, ordinal)
+            want = self.want(rowset)
+            self.assertEqual(got, want)
+            self.assertEqual(str(got['incoming']), str(want['incoming']))
+
+        self.assertEqual(stats.summary(), self.want(self.rows))
+        self.assertEqual(stats.summary(last=1990 * 12 + 5),
+                         self.want(self.rows.filter(['month<1990-06'])))
+        self.assertEqual(stats.summary(1991 * 12 + 1)['members'], 0)
+        self.assertEqual(stats.summary(1991 * 12 + 1)['ARPM'], -1)
+
+    def test_stats(self):
+        self.check(Stats(self.rows))
+
+    @mock.patch('stats.numpy', None)
+    def test_stats_arrays(self):
+        self.check(Stats(self.rows))
+
+    def test_stats_columnar(self):
+        self.check(Stats(ColumnarRowSet(self.rows)))
+
+    @mock.patch('stats.numpy', None)
+    def test_stats_columnar_arrays(self):
+        self.check(Stats(ColumnarRowSet(self.rows)))
@@ -0,0 +1,203 @@
+""" Perform tests on the store.py
+"""
+
+import unittest
+import tempfile
+import shutil
+import sys
+import os
+if sys.version_info[0] == 2:  # pragma: no cover
+    import mock
+else:
+    from unittest import mock  # pragma: no cover
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+from store import Store, filter_sql # noqa
+from ledger import ledger_files # noqa
+from rowset import RowSet # noqa
+from pivot import Pivot # noqa
+from row import Row, set_now # noqa
+
+
+def parse(pathname):
+    direction = os.path.basename(pathname).split('-', 1)[0]
+    rows = []
+    with open(pathname) as f:
+        for line in f:
+            value, date, comment = line.split(None, 2)
+            rows.append(Row(value, date, comment.strip(), direction))
+    return rows
+
+
+def reload(dirname):
+    """Load the rows the slow way, to check the store against
+    """
+    rows = RowSet()
+    for filename in ledger_files(dirname):
+        rows.append(parse(os.path.join(dirname, filename)))
+    return rows
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        set_now('1970-03-15')
+        self.dir = tempfile.mkdtemp()
+        self.write('incoming-1970-01', "10 1970-01-05 comment1\n"
+                                       "20 1970-01-02 #dues:test1\n"
+                                       "0.25 1970-01-05 coins\n")
+        self.write('outgoing-1970-01', "10 1970-01-10 comment2 #rent\n"
+                                       "3 1970-01-05 #Fridge !months:2\n")
+        self.write('incoming-1970-02', "5.50 1970-02-01 comment3\n"
+                                       "20 1970-02-01 #dues:test2\n")
+        self.write('README', "not an accounting file\n")
+
+        self.dbname = os.path.join(self.dir, 'rows.db')
+        self.store = Store(self.dbname)
+        self.update(self.store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def write(self, filename, data):
+        with open(os.path.join(self.dir, filename), 'w') as f:
+            f.write(data)
+
+    def update(self, store):
+        with mock.patch('ledger.sys.stderr'):
+            return store.update(self.dir, parse)
+
+    def check(self, got, want):
+        self.assertEqual(list(got), list(want))
+        self.assertEqual([row.hashtag for row in got],
+                         [row.hashtag for row in want])
+        self.assertEqual(str(got.value), str(want.value))
+        self.assertEqual(got.count, want.count)
+        self.assertEqual((got.min_value, got.max_value),
+                         (want.min_value, want.max_value))
+        if want.count:
+            self.assertEqual(got.last(), want.last())
+
+    def test_rows(self):
+        with mock.patch('ledger.sys.stderr'):
+            want = reload(self.dir)
+        rows = self.store.rows()
+        self.check(rows, want)
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[1], want[1])
+        self.assertIs(rows.filter(None), rows)
+        self.assertEqual(rows.pivot().grid(), Pivot(want).grid())
+        self.check(rows.autosplit(), want.autosplit())
+
+    def test_filter(self):
+        with mock.patch('ledger.sys.stderr'):
+            want = reload(self.dir)
+        rows = self.store.rows()
+
+        for filters in [
+            ['direction==incoming'],
+            ['direction!=incoming', 'month==1970-01'],
+            ['month>1970-01'],
+            ['month<1970-02'],
+            ['date==1970-01-05'],
+            ['date>1970-01-03', 'date<1970-02-01'],
+            ['value>10'],
+            ['value<-3'],
+            ['value>-3.5', 'value<0.3'],
+            ['value==0.25'],
+            ['value!=0.251'],
+            ['value==0.251'],
+            ['value>inf'],
+            ['hashtag==rent'],
+            ['hashtag==None'],
+            ['hashtag!=rent'],
+            ['hashtag=~^dues:'],
+            ['hashtag!~^dues:'],
+            ['hashtag=~^DUES'],
+            ['hashtag=~one'],
+            ['hashtag!~one'],
+            ['comment=~comment[12]'],
+            ['comment!~comment'],
+            ['rel_months==-1'],
+            ['rel_months>-2'],
+            ['rel_months<-1.5'],
+            ['month_ordinal==23641'],
+            ['cents<0'],
+        ]:
+            self.check(rows.filter(filters), want.filter(filters))
+            self.check(rows.filter(filters[:1]).filter(filters[1:]),
+                       want.filter(filters))
+
+        for bad in ['bangtag==months:2', 'nothing==1', 'comment=~1']:
+            with self.assertRaises(ValueError):
+                rows.filter([bad])
+
+    def test_filter_sql(self):
+        self.assertEqual(filter_sql('hashtag==rent'),
+                         ('hashtag = ?', ['rent']))
+        self.assertEqual(filter_sql('value>1.005'), ('cents > ?', [100]))
+        self.assertEqual(filter_sql('rel_months>-2'),
+                         ('month_ordinal > ?', [1970 * 12 + 1]))
+        self.assertEqual(filter_sql('comment!~x'),
+                         ('NOT comment REGEXP ?', ['x']))
+
+    def test_group_by(self):
+        with mock.patch('ledger.sys.stderr'):
+            want = reload(self.dir)
+        rows = self.store.rows().filter(['month!=1970-03'])
+
+        for field in ('month', 'hashtag', 'direction', 'date', 'bangtag'):
+            got = rows.group_by(field)
+            # the keys can be dates and strings, and are in no set order
+            self.assertEqual(sorted(got, key=str),
+                             sorted(want.group_by(field), key=str))
+            for key, group in want.group_by(field).items():
+                self.check(got[key], group)
+                self.check(got[key].filter(['direction==incoming']),
+                           group.filter(['direction==incoming']))
+
+        self.assertEqual(rows.index_builds, {
+            'month': 1, 'hashtag': 1, 'direction': 1, 'date': 1,
+            'bangtag': 1,
+        })
+
+    def test_update(self):
+        # Nothing has changed
+        self.assertEqual(self.update(self.store), 0)
+
+        self.write('incoming-1970-02', "7 1970-02-01 comment3\n")
+        self.write('outgoing-1970-03', "1 1970-03-01 #rent\n")
+        os.unlink(os.path.join(self.dir, 'outgoing-1970-01'))
+        self.assertEqual(self.update(self.store), 2)
+
+        with mock.patch('ledger.sys.stderr'):
+            want = reload(self.dir)
+        self.check(self.store.rows(), want)
+
+        # The rows are kept between runs
+        self.store.close()
+        self.store = Store(self.dbname)
+        self.assertEqual(self.update(self.store), 0)
+        self.check(self.store.rows(), want)
+
+    def test_split(self):
+        with mock.patch('ledger.sys.stderr'):
+            want = reload(self.dir).autosplit()
+
+        # A store of split rows is made again from the files
+        self.store.close()
+        self.store = Store(self.dbname, split=True)
+        self.assertEqual(self.update(self.store), 3)
+
+        rows = self.store.rows()
+        self.check(rows, want)
+        self.assertIs(rows.autosplit(), rows)
+        self.check(rows.filter(['month==1970-02']),
+                   want.filter(['month==1970-02']))
@@ -0,0 +1,80 @@
+""" Perform tests on the synthetic.py
+"""
+
+import unittest
+import tempfile
+import shutil
+import sys
+import os
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+import synthetic # noqa
+from ledger import Ledger, ledger_files # noqa
+from row import Row # noqa
+
+
+def parse(pathname):
+    direction = os.path.basename(pathname).split('-', 1)[0]
+    with open(pathname) as f:
+        return [Row(*line.rstrip('\n').split(' ', 2), direction=direction)
+                for line in f]
+
+
+class TestGenerate(unittest.TestCase):
+    def setUp(self):
+        self.dirs = []
+
+    def tearDown(self):
+        for dirname in self.dirs:
+            shutil.rmtree(dirname)
+
+    def generate(self, **kwargs):
+        self.dirs.append(tempfile.mkdtemp())
+        count = synthetic.generate(self.dirs[-1], **kwargs)
+        return count, self.dirs[-1]
+
+    def read(self, dirname):
+        files = {}
+        for filename in os.listdir(dirname):
+            with open(os.path.join(dirname, filename)) as f:
+                files[filename] = f.read()
+        return files
+
+    def test_generate(self):
+        count, dirname = self.generate(members=5, years=2, split=0.5,
+                                       start=2000)
+        self.assertEqual(len(ledger_files(dirname)), 48)
+        self.assertEqual(ledger_files(dirname)[0], 'incoming-2000-01')
+
+        ledger = Ledger(dirname, parse)
+        self.assertEqual(len(ledger), count)
+        self.assertTrue(ledger.value > 0)
+
+        tags = ledger.group_by('hashtag')
+        self.assertEqual(
+            len([tag for tag in tags if tag.startswith('dues:')]), 5)
+        for tag in synthetic.expense_tags:
+            self.assertIn(tag, tags)
+        self.assertTrue(len(ledger.autosplit()) > count)
+
+    def test_deterministic(self):
+        _, first = self.generate(members=3, years=1)
+        _, second = self.generate(members=3, years=1)
+        _, other = self.generate(members=3, years=1, seed=2)
+        self.assertEqual(self.read(first), self.read(second))
+        self.assertNotEqual(self.read(first), self.read(other))
+
+    def test_options(self):
+        _, dirname = self.generate(members=2, years=1,
+                                   expenses={'snacks': 0.1}, split=0)
+        ledger = Ledger(dirname, parse)
+        self.assertEqual(sorted(ledger.group_by('hashtag')),
+                         ['dues:member0', 'dues:member1', 'snacks', 'unknown'])
+        self.assertEqual(len(ledger.autosplit()), len(ledger))
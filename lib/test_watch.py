@@ -0,0 +1,61 @@
+""" Perform tests on the watch.py
+"""
+
+import unittest
+import tempfile
+import shutil
+import sys
+import os
+
+# Ensure that we look for any modules in our local lib dir.  This allows simple
+# testing and development use.  It also does not break the case where the lib
+# has been installed properly on the normal sys.path
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+                )
+# I would use site.addsitedir, but it does an append, not insert
+
+import watch # noqa
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.write('incoming-1970-01', "10 1970-01-05 comment1\n")
+        self.write('incoming-1970-02', "10 1970-02-05 comment1\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, filename, data):
+        with open(os.path.join(self.dir, filename), 'w') as f:
+            f.write(data)
+
+    def check(self, watcher):
+        try:
+            self.assertEqual(watcher.changes(0.01), set())
+
+            self.write('incoming-1970-01', "10 1970-01-05 comment1\n"
+                                           "20 1970-01-06 comment2\n")
+            os.unlink(os.path.join(self.dir, 'incoming-1970-02'))
+            self.write('incoming-1970-03', "1 1970-03-05 comment1\n")
+
+            self.assertEqual(watcher.changes(0.5), set([
+                'incoming-1970-01', 'incoming-1970-02', 'incoming-1970-03',
+            ]))
+            self.assertEqual(watcher.changes(0.01), set())
+        finally:
+            watcher.close()
+
+    def test_poll(self):
+        watcher = watch.PollWatcher(self.dir)
+        # the sizes change, so this does not depend on the mtime resolution
+        self.check(watcher)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'needs inotify')
+    def test_inotify(self):
+        self.check(watch.InotifyWatcher(self.dir))
+
+    def test_make_watcher(self):
+        watcher = watch.make_watcher(self.dir)
+        self.check(watcher)
@@ -0,0 +1,115 @@
+# Licensed under GPLv3
+import ctypes.util
+import ctypes
+import select
+import struct
+import time
+import os
+
+
+class PollWatcher(object):
+    """Find the files in a directory that changed by looking at their size
+       and modification time every so often
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self._state = self._scan()
+
+    def _scan(self):
+        state = {}
+        for filename in os.listdir(self.dirname):
+            try:
+                stat = os.stat(os.path.join(self.dirname, filename))
+            except OSError:
+                # removed while we were looking
+                continue
+            state[filename] = (stat.st_size, stat.st_mtime)
+        return state
+
+    def changes(self, timeout):
+        """Wait for timeout seconds and return the names of the files that
+           were changed, added or removed since the last call
+        """
+        time.sleep(timeout)
+        old, self._state = self._state, self._scan()
+        return set(filename for filename in set(old) | set(self._state)
+                   if old.get(filename) != self._state.get(filename))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Find the files in a directory that changed using the linux inotify
+       interface, so that nothing needs to be looked at until they do
+    """
+
+    # From <sys/inotify.h>
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_DELETE = 0x200
+
+    _event = struct.Struct('iIII')
+
+    # How long to wait for the rest of the events when a file is written,
+    # so that an editor saving a file is seen as a single change
+    settle = 0.05
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+        self._fd = libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+
+        mask = (self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO |
+                self.IN_DELETE)
+        if libc.inotify_add_watch(self._fd, dirname.encode('utf-8'),
+                                  mask) < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def _read(self, timeout):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self._fd, 65536)
+        filenames = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = self._event.unpack_from(data, offset)
+            offset += self._event.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            filenames.append(name.decode('utf-8'))
+            offset += length
+        return filenames
+
+    def changes(self, timeout):
+        """Wait up to timeout seconds and return the names of the files that
+           were changed, added or removed
+        """
+        filenames = set(self._read(timeout))
+        while filenames:
+            more = self._read(self.settle)
+            if not more:
+                break
+            filenames.update(more)
+        return filenames
+
+    def close(self):
+        os.close(self._fd)
+
+
+def make_watcher(dirname):
+    """Return an InotifyWatcher, or a PollWatcher where inotify cannot be
+       used
+    """
+    try:
+        return InotifyWatcher(dirname)
+    except (OSError, AttributeError):
+        # AttributeError is a libc without inotify_init
+        return PollWatcher(dirname)
@@ -3,22 +3,283 @@
 """
 
 import unittest
+import argparse
 import datetime
+import subprocess
+import tempfile
+import shutil
+import time
 import sys
 import json
+import os
 if sys.version_info[0] == 2:  # pragma: no cover
     import mock
 else:
     from unittest import mock  # pragma: no cover
+try:
+    from StringIO import StringIO  # python 2
+except ImportError:
+    from io import StringIO  # python 3
 
 import balance # noqa
+from columnar import ColumnarRowSet # noqa
+import snapshot # noqa
+import row # noqa
+from pivot import Pivot # noqa
+from cache import RowCache # noqa
 
 
-class fakedatetime(datetime.datetime):
+class TestParse(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        files = {
+            'incoming-1970-01': "10 1970-01-05 comment1\n"
+                                "# a comment line\n"
+                                "\n"
+                                "20 1970-01-02 #dues:test1 !months:2\n",
+            'outgoing-1970-01': "10 1970-01-10 comment2 #rent\n",
+            'incoming-1970-02': "5 1970-02-01 comment3\n",
+            'README': "not an accounting file\n",
+        }
+        for name, data in files.items():
+            with open(os.path.join(self.dir, name), 'w') as f:
+                f.write(data)
 
-    @classmethod
-    def now(cls):
-        return cls(1990, 5, 4, 12, 12, 12, 0)
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_parse_file(self):
+        got = balance.parse_file(os.path.join(self.dir, 'incoming-1970-01'))
+        self.assertEqual(got, [
+            balance.Row("10", "1970-01-05", "comment1", "incoming"),
+            balance.Row("20", "1970-01-02", "#dues:test1 !months:2",
+                        "incoming"),
+        ])
+
+        # more than one hashtag is still caught while parsing
+        with open(os.path.join(self.dir, 'incoming-1970-03'), 'w') as f:
+            f.write("5 1970-03-01 #rent #dues:test1\n")
+        with self.assertRaises(ValueError):
+            balance.parse_file(os.path.join(self.dir, 'incoming-1970-03'))
+
+    @mock.patch('balance.sys.stderr')
+    def test_parse_dir_jobs(self, stderr):
+        serial = list(balance.parse_dir(self.dir))
+        self.assertEqual([row.comment for row in serial], [
+            'comment1',
+            '#dues:test1 !months:2',
+            'comment3',
+            'comment2 #rent',
+        ])
+
+        parallel = list(balance.parse_dir(self.dir, jobs=2))
+        self.assertEqual(parallel, serial)
+        self.assertEqual([row.hashtag for row in parallel],
+                         [row.hashtag for row in serial])
+
+    @mock.patch('balance.sys.stderr')
+    def test_load_rows_profile(self, stderr):
+        self.addCleanup(balance.instrument.enable, False)
+        balance.instrument.enable()
+
+        args = argparse.Namespace(dir=self.dir, filter=['month==1970-01'],
+                                  split=True, jobs=1, columnar=False,
+                                  cache_stats=False, profile=True,
+                                  profile_json=os.path.join(self.dir, 'p'))
+        rows = balance.load_rows(args)
+        self.assertEqual(len(rows), 3)
+
+        balance.write_profile(args)
+        with open(args.profile_json) as f:
+            got = json.load(f)
+        # nothing can be pruned without a cache directory
+        self.assertEqual([x['name'] for x in got['phases']],
+                         ['parse', 'split', 'filter'])
+        self.assertEqual(got['counters'], {
+            'rows parsed': 4,
+            'rows split': 1,
+            'filter evaluations': 5,
+        })
+        stderr.write.assert_called_with(balance.instrument.render())
+
+    @mock.patch('balance.sys.stderr')
+    def test_load_rows_prune(self, stderr):
+        self.addCleanup(balance.instrument.enable, False)
+        cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache)
+
+        def load(filters, split=True, prune=None):
+            balance.instrument.enable()
+            args = argparse.Namespace(dir=self.dir, filter=filters,
+                                      split=split, jobs=1, columnar=False,
+                                      cache_stats=False, prune=prune,
+                                      cache=cache)
+            rows = balance.load_rows(args)
+            return ([row.comment for row in rows],
+                    balance.instrument.counters['files pruned'])
+
+        # The first load finds the span of each file
+        self.assertEqual(load(['month==1970-02']), ([
+            '#dues:test1 !months:2 !child',
+            'comment3',
+        ], 0))
+        # and then only the files that can match are parsed, including the
+        # rows split into other months
+        self.assertEqual(load(['month==1970-02']), ([
+            '#dues:test1 !months:2 !child',
+            'comment3',
+        ], 1))
+        self.assertEqual(load(['month==1970-02'], split=False),
+                         (['comment3'], 2))
+
+        # The files that the subcommand would filter out are not parsed
+        self.assertEqual(load(None, prune=['direction==outgoing']),
+                         (['comment2 #rent'], 2))
+
+        # None of this is kept with the accounting files
+        self.assertEqual(sorted(os.listdir(self.dir)), [
+            'README', 'incoming-1970-01', 'incoming-1970-02',
+            'outgoing-1970-01',
+        ])
+
+    @mock.patch('balance.sys.stderr')
+    def test_load_rows_checkpoint(self, stderr):
+        self.addCleanup(balance.instrument.enable, False)
+        cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache)
+        with open(os.path.join(self.dir, 'incoming-1970-02'), 'a') as f:
+            f.write("#!balance 1970-01-05 31\n"
+                    "#!balance 1970-01-31 20\n")
+
+        def load(split=False, checkpoint=True, cache_dir=cache,
+                 row_cache=None):
+            balance.instrument.enable()
+            args = argparse.Namespace(dir=self.dir, filter=None,
+                                      split=split, jobs=1, columnar=False,
+                                      cache_stats=False, cache=cache_dir,
+                                      checkpoint=checkpoint,
+                                      row_cache=row_cache)
+            rows = balance.load_rows(args)
+            counters = balance.instrument.counters
+            return ([row.comment for row in rows], str(rows.value),
+                    counters.get('checkpoints verified', 0),
+                    counters.get('checkpoint mismatches', 0))
+
+        # Without a cache directory they are only checked, from the pragmas
+        # that are found while parsing the files
+        self.assertEqual(load(cache_dir=None)[1:], ('25', 1, 1))
+        self.assertEqual(load(cache_dir=None)[1:], ('25', 1, 1))
+        self.assertEqual(os.listdir(cache), [])
+
+        # All of the rows are loaded to check the checkpoints first
+        self.assertEqual(load(), (['comment1', '#dues:test1 !months:2',
+                                   'comment3', 'comment2 #rent'],
+                                  '25', 1, 1))
+        stderr.write.assert_called_with(
+            'Balance checkpoint 1970-01-05 31 in incoming-1970-02 does not'
+            ' match the running balance of 30\n')
+
+        # and then the sum starts from the newest one that was verified
+        self.assertEqual(load(), (['balance brought forward', 'comment3'],
+                                  '25', 0, 0))
+
+        # but not when the rows are to be split, or for other reports
+        self.assertEqual(load(split=True)[1:], ('25', 1, 1))
+        self.assertEqual(len(load(checkpoint=False)[0]), 4)
+
+        # nor once the rows before it have changed
+        with open(os.path.join(self.dir, 'outgoing-1970-01'), 'a') as f:
+            f.write("5 1970-01-20 comment4\n")
+        self.assertEqual(load()[1:], ('20', 0, 2))
+
+        # The pragmas are kept with the cached rows, so they are still
+        # found when the files are not parsed
+        row_cache = RowCache(cache)
+        self.assertEqual(load(row_cache=row_cache)[1:], ('20', 0, 2))
+        self.assertEqual(load(row_cache=row_cache)[1:], ('20', 0, 2))
+        self.assertEqual(row_cache.hits, 3)
+
+        # The checkpoints are only kept in the cache directory
+        self.assertNotIn('.checkpoints', os.listdir(self.dir))
+
+    @mock.patch('balance.sys.stderr')
+    def test_load_rows_snapshot(self, stderr):
+        args = argparse.Namespace(dir=self.dir, filter=None, split=True,
+                                  jobs=1, columnar=False, cache_stats=False)
+        args.rows = balance.load_rows(args)
+        args.output = os.path.join(self.dir, 'snapshot')
+        balance.subp_compile(args)
+
+        # the snapshot is already split, so it is not split again
+        args.snapshot = args.output
+        args.filter = ['month==1970-02']
+        with mock.patch('columnar.ColumnarRowSet.autosplit') as autosplit:
+            rows = balance.load_rows(args)
+        self.assertFalse(autosplit.called)
+        self.assertIsInstance(rows, ColumnarRowSet)
+        self.assertEqual([row.comment for row in rows], [
+            '#dues:test1 !months:2 !child',
+            'comment3',
+        ])
+
+        # and it cannot be unsplit for a run without --split
+        args.split = False
+        with self.assertRaises(ValueError):
+            balance.load_rows(args)
+
+        # but one that was not split can still be split as it is loaded
+        args.rows = balance.load_rows(argparse.Namespace(
+            dir=self.dir, filter=None, split=False, jobs=1, columnar=False,
+            cache_stats=False))
+        balance.subp_compile(args)
+        self.assertEqual(len(balance.load_rows(args)), 1)
+        args.split = True
+        self.assertEqual(len(balance.load_rows(args)), 2)
+
+    @mock.patch('balance.sys.stderr')
+    def test_load_rows_store(self, stderr):
+        args = argparse.Namespace(dir=self.dir, filter=['month==1970-02'],
+                                  split=True, jobs=1, columnar=False,
+                                  cache_stats=False,
+                                  store=os.path.join(self.dir, 'rows.db'))
+        want = balance.load_rows(argparse.Namespace(
+            dir=self.dir, filter=args.filter, split=True, jobs=1,
+            columnar=False, cache_stats=False))
+
+        for _ in range(2):
+            rows = balance.load_rows(args)
+            self.assertEqual(list(rows), list(want))
+            self.assertEqual(str(rows.value), str(want.value))
+            rows.store.close()
+
+    def test_watch_update(self):
+        class Server(object):
+            def update(self, func, name):
+                self.rows = func(self.rows)
+
+        server = Server()
+        with mock.patch('ledger.sys.stderr'):
+            server.rows = balance.Ledger(self.dir, balance.parse_file)
+        watcher = mock.Mock()
+
+        watcher.changes.return_value = []
+        balance.watch_update(server, watcher)
+        self.assertEqual(str(server.rows.value), '25')
+
+        with open(os.path.join(self.dir, 'outgoing-1970-02'), 'w') as f:
+            f.write("5 1970-02-02 comment4\n")
+        watcher.changes.return_value = ['outgoing-1970-02']
+        balance.watch_update(server, watcher)
+        self.assertEqual(str(server.rows.value), '20')
+
+        # A file that cannot be parsed leaves the rows as they were
+        with open(os.path.join(self.dir, 'outgoing-1970-02'), 'w') as f:
+            f.write("5 1970-02\n")
+        with mock.patch('balance.sys.stderr') as stderr:
+            balance.watch_update(server, watcher)
+        self.assertEqual(str(server.rows.value), '20')
+        self.assertTrue(stderr.write.call_args[0][0].startswith(
+            'Could not update from outgoing-1970-02: '))
 
 
 class TestMisc(unittest.TestCase):
@@ -37,43 +298,12 @@ class TestMisc(unittest.TestCase):
     def tearDown(self):
         self.rows = None
 
-    def test_grid_accumulate(self):
-        self.assertEqual(
-            balance.grid_accumulate(self.rows), (
-                set([
-                    datetime.date(1970, 1, 1),
-                    datetime.date(1970, 2, 1),
-                    datetime.date(1970, 3, 1),
-                ]),
-                {
-                    'water': {
-                        datetime.date(1970, 1, 1): {
-                            'sum': -25,
-                        },
-                    },
-                    'unknown': {
-                        datetime.date(1970, 1, 1): {
-                            'sum': 10,
-                        },
-                        datetime.date(1970, 2, 1): {
-                            'sum': -10,
-                        },
-                    },
-                    'rent': {
-                        datetime.date(1970, 3, 1): {
-                            'sum': -10,
-                        },
-                        datetime.date(1970, 1, 1): {
-                            'sum': -10,
-                        },
-                    },
-                },
-                {
-                    datetime.date(1970, 1, 1): -25,
-                    datetime.date(1970, 2, 1): -10,
-                    datetime.date(1970, 3, 1): -10,
-                    'total': -45
-                }))
+    def test_date_sorted(self):
+        self.assertEqual(balance.date_runs(self.rows),
+                         [(0, 1), (1, 3), (3, 5), (5, 6)])
+        self.assertEqual(list(balance.date_sorted(self.rows)),
+                         sorted(self.rows, key=lambda x: x.date))
+        self.assertEqual(list(balance.date_sorted(balance.RowSet())), [])
 
     def test_topay_render(self):
         strings = {
@@ -120,10 +350,7 @@ class TestMisc(unittest.TestCase):
             "TOTAL:       -45",
         ]
 
-        (m, grid, total) = balance.grid_accumulate(self.rows)
-        t = self.rows.group_by('hashtag')
-
-        got = balance.grid_render(m, t, grid, total).split("\n")
+        got = balance.grid_render(Pivot(self.rows)).split("\n")
         self.assertEqual(got, expect)
 
 
@@ -250,6 +477,11 @@ class TestSubp(unittest.TestCase):
         got = balance.subp_csv(self).split("\n")
         self.assertEqual(got, expect)
 
+        # written as it goes, when there is a stream
+        self.stream = StringIO()
+        self.assertEqual(balance.subp_csv(self), None)
+        self.assertEqual(self.stream.getvalue().split("\n"), expect)
+
     def test_grid(self):
         expect = [
             "                     1990-04  1990-05",
@@ -269,6 +501,50 @@ class TestSubp(unittest.TestCase):
         got = balance.subp_grid(self).split("\n")
         self.assertEqual(got, expect)
 
+    def test_report_args(self):
+        # without any filters the jobs share the rows and their indexes
+        jobs = [balance.report_args(self, 'grid') for _ in range(2)]
+        self.assertIs(jobs[0].rows, self.rows)
+        self.assertIs(jobs[0].rows.pivot(balance.grid_label),
+                      jobs[1].rows.pivot(balance.grid_label))
+
+        job = balance.report_args(self, 'sum', ['direction==incoming'])
+        self.assertEqual(balance.subp_sum(job), '15672')
+
+    def test_batch(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        output = os.path.join(tmpdir, 'payments.json')
+
+        self.commands = [
+            'grid',
+            '--output {} json_payments'.format(output),
+            "--filter 'hashtag=~^dues:' --filter month==1990-05 sum",
+        ]
+        got = balance.subp_batch(self)
+        self.assertEqual(got, balance.subp_grid(self) + "\n\n500")
+        # the shared rows are not changed by the filters
+        self.assertEqual(len(self.rows), 9)
+
+        with open(output) as f:
+            self.assertEqual(f.read(),
+                             balance.subp_json_payments(self) + "\n")
+
+        self.commands = ['--output {} sum'.format(output)]
+        self.assertEqual(balance.subp_batch(self), None)
+
+        # the csv is written straight to its output
+        self.commands = ['--output {} csv'.format(output)]
+        self.assertEqual(balance.subp_batch(self), None)
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read().decode('utf-8'),
+                             balance.subp_csv(self))
+
+        self.commands = ['batch']
+        with self.assertRaises(SystemExit):
+            with mock.patch('sys.stderr'):
+                balance.subp_batch(self)
+
     def test_json_payments(self):
         expect = {
             'unknown':    '1990-05',
@@ -278,8 +554,15 @@ class TestSubp(unittest.TestCase):
         got = json.loads(balance.subp_json_payments(self))
         self.assertEqual(got, expect)
 
-    @mock.patch('balance.datetime.datetime', fakedatetime)
+    def keep_now(self):
+        """Put the global reference date back after the test
+        """
+        self.addCleanup(setattr, row, '_now', row._now)
+        self.addCleanup(setattr, row, '_now_month', row._now_month)
+
     def test_make_balance(self):
+        self.keep_now()
+        balance.set_now(datetime.date(1990, 5, 4))
         got = balance.subp_make_balance(self)
 
         # this is the {grid_header} and {grid} values from the template
@@ -292,8 +575,9 @@ class TestSubp(unittest.TestCase):
         want = '(due on: <span class="color_neg">1990-04-23</span>) Rent:'
         self.assertTrue(want in got)
 
-    @mock.patch('balance.datetime.datetime', fakedatetime)
     def test_stats(self):
+        self.keep_now()
+        balance.set_now(datetime.date(1990, 5, 4))
         # FIXME - this would look more meaningful with at least one more
         #         month's data
         expect = [
@@ -321,3 +605,87 @@ class TestSubp(unittest.TestCase):
 
         got = balance.subp_stats(self).split("\n")
         self.assertEqual(got, expect)
+
+
+class TestSubpColumnar(TestSubp):
+    """Run all the sub-command tests again using the columnar rowset
+    """
+    def setUp(self):
+        super(TestSubpColumnar, self).setUp()
+        self.rows = ColumnarRowSet(self.rows)
+
+
+class TestSubpSnapshot(TestSubp):
+    """Run all the sub-command tests again using rows mapped from a snapshot
+    """
+    def setUp(self):
+        super(TestSubpSnapshot, self).setUp()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+
+        self.output = os.path.join(tmpdir, 'snapshot')
+        self.split = False
+        balance.subp_compile(self)
+        self.rows, _ = snapshot.load(self.output)
+
+
+class TestStartup(unittest.TestCase):
+    """Check that the simple subcommands do not pay for the modules that
+       only the others need
+    """
+
+    # The time (in seconds) that "sum" of a single row may take, over that
+    # of starting the interpreter.  Without any bytecode cached, it measured
+    # about 50ms here, against about 40ms before the money, instrument and
+    # ledger modules were added, so anything heavy that is imported again
+    # (eg: the 12ms of checkpoint.py and json) goes over it.  Timing is too
+    # noisy on a shared machine, so it is only checked when asked for (see
+    # "make test.startup").
+    budget = 0.06
+
+    # Modules that "sum" and "party" have no use for
+    heavy = ('numpy', 'http', 'socketserver', 'multiprocessing', 'sqlite3',
+             'mmap', 'cProfile', 'csv', 'pickle', 'tempfile', 'json',
+             'hashlib', 'fractions', 'filters', 'pivot', 'partition',
+             'checkpoint')
+    if sys.version_info[0] > 2:
+        # On python 2, the decimal module imports it itself
+        heavy += ('threading',)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        with open(os.path.join(self.dir, 'incoming-1970-01'), 'w') as f:
+            f.write("10 1970-01-05 comment1\n")
+        self.balance = os.path.join(os.path.dirname(os.path.abspath(
+            __file__)), 'balance.py')
+
+    def run_python(self, args):
+        """Return the output of python run with args, and the time it took
+        """
+        start = time.time()
+        output = subprocess.check_output([sys.executable] + args)
+        return output.decode('utf8'), time.time() - start
+
+    def test_modules(self):
+        code = (
+            'import sys, runpy\n'
+            'sys.argv = {!r}\n'
+            'runpy.run_path(sys.argv[0], run_name="__main__")\n'
+            'print(" ".join(sys.modules))\n'
+        )
+        for cmd in ('sum', 'party'):
+            argv = [self.balance, '--dir', self.dir, cmd]
+            output, _ = self.run_python(['-c', code.format(argv)])
+            modules = output.split('\n')[-2].split()
+            loaded = [x for x in modules if x.split('.')[0] in self.heavy]
+            self.assertEqual(loaded, [])
+
+    @unittest.skipUnless(os.environ.get('BALANCE_STARTUP_BUDGET'),
+                         'set BALANCE_STARTUP_BUDGET to time the startup')
+    def test_budget(self):
+        bare = min(self.run_python(['-c', 'pass'])[1] for _ in range(3))
+        runs = [self.run_python([self.balance, '--dir', self.dir, 'sum'])
+                for _ in range(5)]
+        self.assertEqual(runs[0][0], '10\n')
+        self.assertLess(min(x[1] for x in runs) - bare, self.budget)
@@ -0,0 +1,56 @@
+""" Perform tests on the bench.py
+"""
+
+import unittest
+import tempfile
+import shutil
+import json
+import sys
+import os
+if sys.version_info[0] == 2:  # pragma: no cover
+    import mock
+else:
+    from unittest import mock  # pragma: no cover
+
+import bench # noqa
+
+
+class TestBench(unittest.TestCase):
+    def test_main(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        output = os.path.join(tmpdir, 'results.json')
+
+        bench.main(['--members', '2,4', '--years', '1', '--repeat', '1',
+                    '--output', output])
+        with open(output) as f:
+            report = json.load(f)
+
+        self.assertEqual(report['repeat'], 1)
+        phases = ['load', 'split', 'filter'] + sorted(
+            cmd for cmd in bench.balance.subp_cmds
+            if cmd not in bench.balance._not_reports)
+        self.assertEqual([r['phase'] for r in report['results']],
+                         phases * 2)
+        self.assertEqual(set(r['members'] for r in report['results']),
+                         set([2, 4]))
+        for result in report['results']:
+            self.assertNotIn('error', result)
+            self.assertTrue(result['seconds'] >= 0)
+
+    def test_error(self):
+        # a subcommand that fails is recorded, instead of stopping the run
+        def fail(args):
+            raise ValueError('broken')
+
+        patch = mock.patch.dict(bench.balance.subp_cmds,
+                                {'sum': {'func': fail}})
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        args = bench.argparse.Namespace(years=1, start=2000, repeat=1,
+                                        split_fraction=0.1, jobs=1,
+                                        columnar=True)
+        results = dict((r['phase'], r) for r in bench.bench_size(args, 2))
+        self.assertEqual(results['sum']['error'], 'ValueError: broken')
+        self.assertIn('seconds', results['grid'])